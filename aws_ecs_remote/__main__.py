@@ -0,0 +1,5 @@
+import sys
+
+from aws_ecs_remote.cli import main
+
+sys.exit(main())
@@ -0,0 +1,215 @@
+import asyncio
+import functools
+import os
+
+from .archive import ArchiveFormat
+from .bucket import SourceMode
+from .cloudwatch import LogTailer, log_event_handler, TAIL_WORKERS
+from .download import output_prefix
+from .ecs import FleetTracker, POLL_SEC, ecs_run_task, print_task_stopped
+from .run_task import DEFAULT_CPU, DEFAULT_IMAGE, DEFAULT_MEMORY, default_log_strategy, launch_task, launch_tasks, prepare_run, task_log_streams
+from .task_args import args_key, upload_args_batch
+from .tracing import in_context
+
+# Asyncio counterparts of the blocking API. boto3 calls run on an executor
+# (the loop's default unless one is given); waiting between polls is
+# asyncio.sleep, so idle jobs hold no thread.
+LOG_POLL_SEC = 2
+
+
+async def run_blocking(fn, *args, executor=None, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, in_context(functools.partial(fn, *args, **kwargs)))
+
+
+async def async_prepare_run(cluster, script, executor=None, **kwargs):
+    return await run_blocking(
+        prepare_run, cluster=cluster, script=os.path.abspath(script), executor=executor, **kwargs)
+
+
+async def async_ecs_run_task(ecs, cluster, task_definition, command, subnets, security_groups,
+                             executor=None, **kwargs):
+    return await run_blocking(
+        ecs_run_task,
+        ecs=ecs,
+        cluster=cluster,
+        task_definition=task_definition,
+        command=command,
+        subnets=subnets,
+        security_groups=security_groups,
+        executor=executor,
+        **kwargs
+    )
+
+
+async def async_launch_task(run, output, args_key=None, args_index=0, bootstrap=None,
+                            executor=None):
+    return await run_blocking(
+        launch_task,
+        run=run,
+        output=output,
+        args_key=args_key,
+        args_index=args_index,
+        bootstrap=bootstrap,
+        executor=executor
+    )
+
+
+async def async_launch_tasks(run, launches, bootstrap=None, executor=None, **kwargs):
+    # Returns [(index, task, failure)] in launch order
+    def launch():
+        return sorted(launch_tasks(run=run, launches=launches, bootstrap=bootstrap, **kwargs),
+                      key=lambda result: result[0])
+    return await run_blocking(launch, executor=executor)
+
+
+async def async_iter_stopped(ecs, cluster, task_arns, poll_sec=POLL_SEC, executor=None):
+    # Async iterator of tasks, each yielded once when it is seen stopped
+    tracker = FleetTracker(ecs=ecs, cluster=cluster, task_arns=task_arns, poll_sec=poll_sec)
+    while not tracker.done:
+        for task in await run_blocking(tracker.poll, executor=executor):
+            yield task
+        if not tracker.done:
+            await asyncio.sleep(tracker.poll_sec)
+
+
+async def async_wait_tasks(ecs, cluster, task_arns, poll_sec=POLL_SEC, executor=None):
+    # Returns {taskArn: task} once every task has stopped
+    stopped = {}
+    async for task in async_iter_stopped(
+            ecs=ecs, cluster=cluster, task_arns=task_arns, poll_sec=poll_sec, executor=executor):
+        stopped[task['taskArn']] = task
+    return stopped
+
+
+async def async_log_events(logs, log_streams, stopped=None, strategy=None, poll_sec=LOG_POLL_SEC,
+                           max_workers=TAIL_WORKERS, executor=None):
+    # Async iterator of log events. Runs until the asyncio.Event stopped is
+    # set, then reads once more so nothing written before the stop is lost.
+    if strategy is None:
+        strategy = default_log_strategy(log_streams)
+    batch = []
+    tailer = LogTailer(
+        logs=logs,
+        log_streams=log_streams,
+        strategy=strategy,
+        max_workers=max_workers,
+        log_handler=batch.append
+    )
+    while True:
+        done = stopped is not None and stopped.is_set()
+        await run_blocking(tailer.poll, executor=executor)
+        events = list(batch)
+        del batch[:]
+        for event in events:
+            yield event
+        if done:
+            return
+        if stopped is None:
+            await asyncio.sleep(poll_sec)
+        else:
+            try:
+                await asyncio.wait_for(stopped.wait(), poll_sec)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def async_follow_tasks(run, tasks, log_handler=log_event_handler(), log_strategy=None,
+                             on_stopped=None, executor=None):
+    # Streams logs until every task stops; returns {taskArn: stopped task}
+    if on_stopped is None and len(tasks) > 1:
+        on_stopped = print_task_stopped
+    stopped = asyncio.Event()
+    results = {}
+
+    async def wait():
+        try:
+            async for task in async_iter_stopped(
+                    ecs=run['ecs'],
+                    cluster=run['cluster'],
+                    task_arns=[task['taskArn'] for task in tasks],
+                    executor=executor):
+                results[task['taskArn']] = task
+                if on_stopped is not None:
+                    on_stopped(task)
+        finally:
+            stopped.set()
+
+    waiter = asyncio.ensure_future(wait())
+    try:
+        async for event in async_log_events(
+                logs=run['logs'],
+                log_streams=task_log_streams(run, tasks),
+                stopped=stopped,
+                strategy=log_strategy,
+                executor=executor):
+            log_handler(event)
+    finally:
+        if not stopped.is_set():
+            # Following logs raised or was cancelled; stop polling the tasks too
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+    await waiter
+    return results
+
+
+async def async_run_task(
+    cluster,
+    script,
+    bucket=None,
+    src=None,
+    args=None,
+    profile=None,
+    base_name=None,
+    image=DEFAULT_IMAGE,
+    cpu=DEFAULT_CPU,
+    memory=DEFAULT_MEMORY,
+    src_mode=SourceMode.ZIP,
+    archive_format=ArchiveFormat.ZIP_DEFLATE,
+    workers=None,
+    transfer_config=None,
+    bootstrap=None,
+    wait=True,
+    use_cache=True,
+    quiet=False,
+    log_handler=log_event_handler(),
+    executor=None
+):
+    # Same steps as run_task. script is required: there is no calling file
+    # to default to inside an event loop.
+    run = await async_prepare_run(
+        cluster=cluster,
+        script=script,
+        bucket=bucket,
+        src=src,
+        profile=profile,
+        base_name=base_name,
+        image=image,
+        cpu=cpu,
+        memory=memory,
+        src_mode=src_mode,
+        archive_format=archive_format,
+        workers=workers,
+        transfer_config=transfer_config,
+        use_cache=use_cache,
+        quiet=quiet,
+        executor=executor
+    )
+    key = None
+    if args is not None:
+        key = args_key(run['name'], 0)
+        await run_blocking(
+            upload_args_batch, s3=run['s3'], bucket=run['bucket'], key=key, args_list=[args],
+            executor=executor)
+    task = await async_launch_task(
+        run=run,
+        output=output_prefix(run['name']),
+        args_key=key,
+        bootstrap=bootstrap,
+        executor=executor
+    )
+    print("task: {}".format(task['taskArn']))
+    if wait:
+        stopped = await async_follow_tasks(run=run, tasks=[task], log_handler=log_handler, executor=executor)
+        task = stopped.get(task['taskArn'], task)
+    return task
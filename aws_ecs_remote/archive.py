@@ -0,0 +1,345 @@
+import multiprocessing
+import os
+import struct
+import tarfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_CHUNK_SIZE = 1024 * 1024
+# Files up to this size are compressed in the process pool, larger files are
+# streamed from the main process so they never sit in memory whole
+POOL_FILE_LIMIT = 32 * 1024 * 1024
+POOL_BATCH_BYTES = 4 * 1024 * 1024
+POOL_BATCH_FILES = 256
+# Below this many bytes a process pool costs more than it saves
+POOL_MIN_BYTES = 8 * 1024 * 1024
+DEFLATE_LEVEL = 6
+ZSTD_LEVEL = 3
+
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_MAX = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+ZIP_FLAG_UTF8 = 0x800
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+ZIP_CREATE_SYSTEM_UNIX = 3
+# 1980-01-01 00:00:00, the zip epoch, so archives do not depend on mtimes
+ZIP_DOS_TIME = 0
+ZIP_DOS_DATE = (1 << 5) | 1
+
+
+class ArchiveFormat:
+    ZIP_DEFLATE = 'zip-deflate'
+    ZIP_STORED = 'zip-stored'
+    TAR_ZSTD = 'tar-zstd'
+
+
+ARCHIVE_EXTENSIONS = {
+    ArchiveFormat.ZIP_DEFLATE: 'zip',
+    ArchiveFormat.ZIP_STORED: 'zip',
+    ArchiveFormat.TAR_ZSTD: 'tar.zst'
+}
+
+
+def archive_extension(archive_format):
+    if archive_format not in ARCHIVE_EXTENSIONS:
+        raise ValueError("Unknown archive format [{}]. Expected one of {}".format(
+            archive_format, sorted(ARCHIVE_EXTENSIONS)
+        ))
+    return ARCHIVE_EXTENSIONS[archive_format]
+
+
+def normalize_mode(mode):
+    # Only the executable bit survives, so checkouts with different umasks match
+    return 0o755 if mode & 0o111 else 0o644
+
+
+def pool_context():
+    # Archives are built from TaskGraph worker threads; forking a process
+    # with other threads running can deadlock the child, so workers start
+    # from a fresh interpreter
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def compress_file(path, level=DEFLATE_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    size = 0
+    chunks = []
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return crc, size, b''.join(chunks)
+
+
+def compress_batch(paths, level=DEFLATE_LEVEL):
+    return [compress_file(path, level=level) for path in paths]
+
+
+class CountingWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+
+class ZipWriter:
+    # Minimal zip writer that accepts data compressed elsewhere, which
+    # zipfile cannot do. Entries get fixed timestamps and normalized modes.
+
+    def __init__(self, stream):
+        self.out = CountingWriter(stream)
+        self.entries = []
+
+    def local_header(self, name, method, flags, crc, compressed_size, size, zip64):
+        extra = b''
+        version = ZIP_VERSION
+        if zip64:
+            version = ZIP64_VERSION
+            extra = struct.pack('<HHQQ', 1, 16, size, compressed_size)
+            compressed_size = size = ZIP_MAX
+        return struct.pack(
+            '<IHHHHHIIIHH',
+            0x04034b50, version, flags, method, ZIP_DOS_TIME, ZIP_DOS_DATE,
+            crc, compressed_size, size, len(name), len(extra)
+        ) + name + extra
+
+    def add_entry(self, name, mode, method, flags, crc, compressed_size, size, offset, zip64):
+        self.entries.append((name, mode, method, flags, crc, compressed_size, size, offset, zip64))
+
+    def write_compressed(self, arcname, mode, method, crc, size, data):
+        name = arcname.encode('utf-8')
+        offset = self.out.position
+        zip64 = len(data) > ZIP64_LIMIT or size > ZIP64_LIMIT
+        self.out.write(self.local_header(name, method, ZIP_FLAG_UTF8, crc, len(data), size, zip64))
+        self.out.write(data)
+        self.add_entry(name, mode, method, ZIP_FLAG_UTF8, crc, len(data), size, offset, zip64)
+
+    def write_stream(self, arcname, mode, method, path, level=DEFLATE_LEVEL):
+        # Sizes and CRC are unknown up front, so they follow in a data descriptor
+        name = arcname.encode('utf-8')
+        offset = self.out.position
+        zip64 = os.path.getsize(path) * 1.05 > ZIP64_LIMIT
+        flags = ZIP_FLAG_UTF8 | ZIP_FLAG_DATA_DESCRIPTOR
+        self.out.write(self.local_header(name, method, flags, 0, 0, 0, zip64))
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+        crc = 0
+        size = 0
+        compressed_size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                compressed_size += len(chunk)
+                self.out.write(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compressed_size += len(chunk)
+            self.out.write(chunk)
+        if zip64:
+            self.out.write(struct.pack('<IIQQ', 0x08074b50, crc, compressed_size, size))
+        else:
+            self.out.write(struct.pack('<IIII', 0x08074b50, crc, compressed_size, size))
+        self.add_entry(name, mode, method, flags, crc, compressed_size, size, offset, zip64)
+
+    def close(self):
+        cd_offset = self.out.position
+        for name, mode, method, flags, crc, compressed_size, size, offset, zip64 in self.entries:
+            extra_fields = []
+            if size > ZIP64_LIMIT:
+                extra_fields.append(size)
+                size = ZIP_MAX
+            if compressed_size > ZIP64_LIMIT:
+                extra_fields.append(compressed_size)
+                compressed_size = ZIP_MAX
+            if offset > ZIP64_LIMIT:
+                extra_fields.append(offset)
+                offset = ZIP_MAX
+            extra = b''
+            version = ZIP_VERSION
+            if extra_fields or zip64:
+                version = ZIP64_VERSION
+            if extra_fields:
+                extra = struct.pack('<HH', 1, 8 * len(extra_fields)) + struct.pack(
+                    '<{}Q'.format(len(extra_fields)), *extra_fields)
+            self.out.write(struct.pack(
+                '<IHHHHHHIIIHHHHHII',
+                0x02014b50, (ZIP_CREATE_SYSTEM_UNIX << 8) | version, version, flags, method,
+                ZIP_DOS_TIME, ZIP_DOS_DATE, crc, compressed_size, size,
+                len(name), len(extra), 0, 0, 0, (0o100000 | mode) << 16, offset
+            ) + name + extra)
+        cd_size = self.out.position - cd_offset
+        count = len(self.entries)
+        if count >= ZIP_MAX_ENTRIES or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            zip64_offset = self.out.position
+            self.out.write(struct.pack(
+                '<IQHHIIQQQQ',
+                0x06064b50, 44, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                count, count, cd_size, cd_offset
+            ))
+            self.out.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1))
+            # Saturated fields tell readers to use the zip64 record
+            count = ZIP_MAX_ENTRIES
+            cd_size = ZIP_MAX
+            cd_offset = ZIP_MAX
+        self.out.write(struct.pack(
+            '<IHHHHIIH',
+            0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0
+        ))
+
+
+def batch_files(entries):
+    batch = []
+    batch_bytes = 0
+    for entry in entries:
+        batch.append(entry)
+        batch_bytes += entry[2]
+        if batch_bytes >= POOL_BATCH_BYTES or len(batch) >= POOL_BATCH_FILES:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+def iter_pool_compressed(path, entries, executor, level, window):
+    # Yields (arcname, full path, mode, result) in input order. Small files are
+    # compressed ahead in the pool, bounded by window batches; large files
+    # yield result None and are streamed by the caller.
+    def groups():
+        small = []
+        for entry in entries:
+            if entry[2] <= POOL_FILE_LIMIT:
+                small.append(entry)
+            else:
+                if small:
+                    for batch in batch_files(small):
+                        yield batch, True
+                    small = []
+                yield [entry], False
+        for batch in batch_files(small):
+            yield batch, True
+
+    pending = deque()
+
+    def drain():
+        batch, future = pending.popleft()
+        results = future.result() if future is not None else [None]
+        for (f, mode, _), result in zip(batch, results):
+            yield f, os.path.join(path, f), mode, result
+
+    for batch, pooled in groups():
+        future = None
+        if pooled:
+            future = executor.submit(
+                compress_batch, [os.path.join(path, f) for f, _, _ in batch], level)
+        pending.append((batch, future))
+        while len(pending) > window or (pending and pending[0][1] is None):
+            yield from drain()
+    while pending:
+        yield from drain()
+
+
+def stat_entries(path, files):
+    entries = []
+    for f in files:
+        st = os.stat(os.path.join(path, f))
+        entries.append((f, normalize_mode(st.st_mode), st.st_size))
+    return entries
+
+
+def write_zip(stream, path, files, compress=True, workers=None, level=DEFLATE_LEVEL, quiet=False):
+    entries = stat_entries(path, files)
+    writer = ZipWriter(stream)
+    method = ZIP_DEFLATED if compress else ZIP_STORED
+    pool_bytes = sum(size for _, _, size in entries if size <= POOL_FILE_LIMIT)
+    if compress and workers != 1 and pool_bytes >= POOL_MIN_BYTES:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+            for f, full_path, mode, result in iter_pool_compressed(
+                    path, entries, executor, level, window=2 * workers):
+                if not quiet:
+                    print(f)
+                if result is None:
+                    writer.write_stream(f, mode, method, full_path, level=level)
+                else:
+                    crc, size, data = result
+                    writer.write_compressed(f, mode, method, crc, size, data)
+    else:
+        for f, mode, size in entries:
+            if not quiet:
+                print(f)
+            full_path = os.path.join(path, f)
+            if size <= POOL_FILE_LIMIT:
+                if compress:
+                    crc, size, data = compress_file(full_path, level=level)
+                else:
+                    with open(full_path, 'rb') as fp:
+                        data = fp.read()
+                    crc = zlib.crc32(data)
+                writer.write_compressed(f, mode, method, crc, size, data)
+            else:
+                writer.write_stream(f, mode, method, full_path, level=level)
+    writer.close()
+
+
+def write_tar_zstd(stream, path, files, workers=None, level=ZSTD_LEVEL, quiet=False):
+    if zstandard is None:
+        raise ImportError(
+            "Archive format [{}] requires zstandard (pip install aws-ecs-remote[zstd])".format(
+                ArchiveFormat.TAR_ZSTD))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # zstd splits the stream across its own worker threads; multi-threaded
+    # output does not depend on the worker count, so digests stay stable
+    compressor = zstandard.ZstdCompressor(level=level, threads=max(workers, 1))
+    with compressor.stream_writer(stream, closefd=False) as zstream:
+        with tarfile.open(fileobj=zstream, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            for f, mode, size in stat_entries(path, files):
+                if not quiet:
+                    print(f)
+                info = tarfile.TarInfo(name=f)
+                info.size = size
+                info.mode = mode
+                info.mtime = 0
+                info.uid = info.gid = 0
+                info.uname = info.gname = ''
+                with open(os.path.join(path, f), 'rb') as fp:
+                    tar.addfile(info, fp)
+
+
+def write_archive(stream, path, files, archive_format=ArchiveFormat.ZIP_DEFLATE, workers=None,
+                  quiet=False):
+    archive_extension(archive_format)
+    files = sorted(files)
+    if archive_format == ArchiveFormat.TAR_ZSTD:
+        write_tar_zstd(stream=stream, path=path, files=files, workers=workers, quiet=quiet)
+    else:
+        write_zip(
+            stream=stream,
+            path=path,
+            files=files,
+            compress=archive_format == ArchiveFormat.ZIP_DEFLATE,
+            workers=workers,
+            quiet=quiet
+        )
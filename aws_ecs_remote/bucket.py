@@ -1,9 +1,31 @@
 import os
 
 import boto3
-import glob
-import io
-import zipfile
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from aws_ecs_remote.archive import ArchiveFormat, archive_extension, write_archive
+from aws_ecs_remote.boto import is_boto_exception
+from aws_ecs_remote.index import FileIndex, HASH_ALGORITHM, hash_file
+from aws_ecs_remote.multipart import MultipartUploadWriter, DEFAULT_TRANSFER_CONFIG
+from aws_ecs_remote.tracing import span
+from aws_ecs_remote.walk import list_files
+
+BUCKET_NAME_FORMAT = 'aws-ecs-remote-{region}-{account}'
+CAS_PREFIX = 'cas'
+UPLOAD_WORKERS = 16
+
+
+class SourceMode:
+    ZIP = 'zip'
+    CAS_ARCHIVE = 'cas-archive'
+    CAS_BLOBS = 'cas-blobs'
+
+
+def default_bucket_name(region, account):
+    return BUCKET_NAME_FORMAT.format(region=region, account=account)
+
 
 def create_bucket(s3, bucket, region=None):
     print("create bucket {} in {}".format(bucket, region))
@@ -28,7 +50,10 @@ def create_bucket(s3, bucket, region=None):
 )"""
 
 
-def ensure_bucket(s3, bucket, region):
+def ensure_bucket(s3, bucket, region, cache=None):
+    key = 'bucket:{}'.format(bucket)
+    if cache is not None and cache.get(key):
+        return
     exists = False
     try:
         s3.head_bucket(Bucket=bucket)
@@ -40,15 +65,179 @@ def ensure_bucket(s3, bucket, region):
     else:
         print("Create bucket")
         create_bucket(s3=s3, bucket=bucket, region=region)
+    if cache is not None:
+        cache.put(key, True)
+
+
+def upload_archive(s3, path, bucket, key, archive_format=ArchiveFormat.ZIP_DEFLATE,
+                   workers=None, transfer_config=None, files=None, quiet=False):
+    if files is None:
+        with span('list_files'):
+            files = list_files(path)
+    # Compressed output streams straight into multipart parts, so compression
+    # and upload overlap and memory does not grow with the archive
+    with span('upload_archive', key=key, files=len(files)):
+        with MultipartUploadWriter(s3=s3, bucket=bucket, key=key, config=transfer_config) as stream:
+            write_archive(
+                stream=stream,
+                path=path,
+                files=files,
+                archive_format=archive_format,
+                workers=workers,
+                quiet=quiet
+            )
+
+
+def upload_as_zip(s3, path, bucket, key, transfer_config=None, workers=None, quiet=False):
+    upload_archive(
+        s3=s3,
+        path=path,
+        bucket=bucket,
+        key=key,
+        archive_format=ArchiveFormat.ZIP_DEFLATE,
+        workers=workers,
+        transfer_config=transfer_config,
+        quiet=quiet
+    )
+
+
+def build_manifest(path, algorithm=HASH_ALGORITHM, files=None, index=None):
+    # index digests must come from the same algorithm the manifest declares
+    if index is not None and index.algorithm != algorithm:
+        raise ValueError("Index uses [{}] but the manifest uses [{}]".format(index.algorithm, algorithm))
+    if files is None:
+        files = list_files(path)
+    entries = []
+    for f in files:
+        if index is not None:
+            st, digest = index.stat_digest(f)
+        else:
+            full_path = os.path.join(path, f)
+            st = os.stat(full_path)
+            digest = hash_file(full_path, algorithm=algorithm)
+        entries.append({
+            'path': f,
+            'digest': digest,
+            'size': st.st_size,
+            'mode': st.st_mode & 0o777
+        })
+    return {
+        'version': 1,
+        'algorithm': algorithm,
+        'files': entries
+    }
+
+
+def manifest_digest(manifest):
+    # Digest of the canonical manifest encoding, so identical trees share a key
+    data = json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+    return hashlib.new(manifest['algorithm'], data.encode('utf-8')).hexdigest()
+
 
+def blob_key(digest, prefix=CAS_PREFIX):
+    # Two-character fan-out spreads blobs across S3 key partitions
+    return '{}/blobs/{}/{}'.format(prefix, digest[:2], digest)
 
-def upload_as_zip(s3, path, bucket, key):
-    stream = io.BytesIO()
-    with zipfile.ZipFile(file=stream, mode="w") as z:
-        for f in glob.glob(os.path.join(path, "**", "*"), recursive=True):
-            if os.path.isfile(f):
-                print(f)
-                print(f[len(path)+1:])
-                z.write(f, f[len(path)+1:])
-    stream.seek(0)
-    s3.upload_fileobj(Bucket=bucket, Key=key, Fileobj=stream)
+
+def manifest_key(digest, prefix=CAS_PREFIX):
+    return '{}/manifests/{}.json'.format(prefix, digest)
+
+
+def archive_key(digest, archive_format=ArchiveFormat.ZIP_DEFLATE, prefix=CAS_PREFIX):
+    return '{}/archives/{}/{}.{}'.format(
+        prefix, archive_format, digest, archive_extension(archive_format))
+
+
+def object_exists(s3, bucket, key):
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if is_boto_exception(e, '404') or is_boto_exception(e, 'NoSuchKey'):
+            return False
+        else:
+            raise e
+
+
+def upload_missing_blobs(s3, path, bucket, manifest, prefix=CAS_PREFIX, max_workers=UPLOAD_WORKERS,
+                         transfer_config=None, quiet=False):
+    if transfer_config is None:
+        transfer_config = DEFAULT_TRANSFER_CONFIG
+    blobs = {}
+    for entry in manifest['files']:
+        blobs.setdefault(entry['digest'], entry['path'])
+
+    def upload_blob(item):
+        digest, f = item
+        key = blob_key(digest, prefix=prefix)
+        if object_exists(s3=s3, bucket=bucket, key=key):
+            return False
+        if not quiet:
+            print("upload {}".format(f))
+        s3.upload_file(Filename=os.path.join(path, f), Bucket=bucket, Key=key,
+                       Config=transfer_config)
+        return True
+
+    with span('upload_blobs', blobs=len(blobs)) as attributes:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            uploaded = sum(executor.map(upload_blob, sorted(blobs.items())))
+        attributes['uploaded'] = uploaded
+    print("Uploaded {} of {} blobs".format(uploaded, len(blobs)))
+    return uploaded
+
+
+def upload_content_addressed(s3, path, bucket, prefix=CAS_PREFIX, archive=False,
+                             archive_format=ArchiveFormat.ZIP_DEFLATE, workers=None,
+                             max_workers=UPLOAD_WORKERS, transfer_config=None, quiet=False,
+                             use_index=True):
+    with span('list_files'):
+        files = list_files(path)
+    index = None
+    with span('build_manifest', files=len(files)) as attributes:
+        if use_index:
+            index = FileIndex.for_root(path)
+        manifest = build_manifest(path, files=files, index=index)
+        if index is not None:
+            index.prune(files)
+            index.save()
+            attributes['hashed'] = index.hashed
+            print("Hashed {} of {} files".format(index.hashed, len(files)))
+    digest = manifest_digest(manifest)
+    if archive:
+        key = archive_key(digest, archive_format=archive_format, prefix=prefix)
+    else:
+        key = manifest_key(digest, prefix=prefix)
+    if object_exists(s3=s3, bucket=bucket, key=key):
+        print("Source unchanged [{}]".format(key))
+        return key
+    if archive:
+        upload_archive(
+            s3=s3,
+            path=path,
+            bucket=bucket,
+            key=key,
+            archive_format=archive_format,
+            workers=workers,
+            transfer_config=transfer_config,
+            files=files,
+            quiet=quiet
+        )
+    else:
+        upload_missing_blobs(
+            s3=s3,
+            path=path,
+            bucket=bucket,
+            manifest=manifest,
+            prefix=prefix,
+            max_workers=max_workers,
+            transfer_config=transfer_config,
+            quiet=quiet
+        )
+        # Manifest goes last so its existence implies every blob is present
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(manifest, sort_keys=True).encode('utf-8'),
+            ContentType='application/json'
+        )
+    return key
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import threading
+
+from aws_ecs_remote.state import read_json, state_path, write_json
+
+CHECKPOINT_DIR = 'logs'
+
+
+def checkpoint_path(task_arn):
+    key = hashlib.sha256(task_arn.encode('utf-8')).hexdigest()[:16]
+    return state_path(CHECKPOINT_DIR, '{}.json'.format(key))
+
+
+class LogCheckpoint:
+    # Log positions of followed tasks, one state file per task ARN. For each
+    # stream: the forward token, the newest event timestamp and the ids of the
+    # events at that timestamp (filter_log_events resumes by time and is the
+    # only source of ids).
+
+    def __init__(self):
+        self.tasks = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, task_arns):
+        checkpoint = cls()
+        for task_arn in task_arns:
+            data = read_json(checkpoint_path(task_arn))
+            if data is not None and data.get('task_arn') == task_arn:
+                checkpoint.tasks[task_arn] = data
+        return checkpoint
+
+    def register(self, cluster, log_streams):
+        with self.lock:
+            for log_stream in log_streams:
+                task_arn = log_stream['taskArn']
+                task = self.tasks.setdefault(task_arn, {
+                    'task_arn': task_arn,
+                    'cluster': cluster,
+                    'streams': {}
+                })
+                if log_stream['stream'] not in task['streams']:
+                    task['streams'][log_stream['stream']] = {
+                        'log_stream': log_stream,
+                        'token': None,
+                        'timestamp': None,
+                        'event_ids': []
+                    }
+                    self.dirty.add(task_arn)
+
+    def log_streams(self, task_arns=None):
+        if task_arns is None:
+            task_arns = list(self.tasks)
+        return [
+            position['log_stream']
+            for task_arn in task_arns if task_arn in self.tasks
+            for position in self.tasks[task_arn]['streams'].values()
+        ]
+
+    def cluster(self, task_arn):
+        task = self.tasks.get(task_arn)
+        return task['cluster'] if task else None
+
+    def position(self, log_stream):
+        task = self.tasks.get(log_stream['taskArn'])
+        if task is None:
+            return {}
+        return task['streams'].get(log_stream['stream'], {})
+
+    def update(self, log_stream, token=None, events=()):
+        with self.lock:
+            task = self.tasks.get(log_stream['taskArn'])
+            if task is None:
+                return
+            position = task['streams'][log_stream['stream']]
+            changed = False
+            if token is not None and token != position['token']:
+                position['token'] = token
+                changed = True
+            if events:
+                timestamp = max(event['timestamp'] for event in events)
+                # get_log_events events have no eventId; the GET strategy
+                # resumes from the token, so only FILTER needs the ids
+                event_ids = [
+                    event['eventId'] for event in events
+                    if event['timestamp'] == timestamp and 'eventId' in event
+                ]
+                if position['timestamp'] is None or timestamp > position['timestamp']:
+                    position['timestamp'] = timestamp
+                    position['event_ids'] = event_ids
+                elif timestamp == position['timestamp']:
+                    position['event_ids'] = sorted(set(position['event_ids']) | set(event_ids))
+                changed = True
+            if changed:
+                self.dirty.add(task['task_arn'])
+
+    def save(self):
+        with self.lock:
+            dirty = [(task_arn, self.tasks[task_arn]) for task_arn in self.dirty]
+            self.dirty = set()
+        for task_arn, task in dirty:
+            write_json(checkpoint_path(task_arn), task)
+
+    def remove(self, task_arns):
+        for task_arn in task_arns:
+            self.tasks.pop(task_arn, None)
+            try:
+                os.remove(checkpoint_path(task_arn))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,88 @@
+import argparse
+import sys
+
+from aws_ecs_remote.args import aws_args
+from aws_ecs_remote.bucket import default_bucket_name
+from aws_ecs_remote.clients import get_client, get_session
+from aws_ecs_remote.download import DOWNLOAD_WORKERS, DownloadStatus, download_outputs
+from aws_ecs_remote.run_task import attach
+
+
+def resolve_bucket(session, bucket):
+    if bucket:
+        return bucket
+    account = get_client('sts', session=session).get_caller_identity().get('Account')
+    return default_bucket_name(region=session.region_name, account=account)
+
+
+def download_command(args):
+    session = get_session(args.profile)
+    s3 = get_client('s3', session=session)
+    bucket = resolve_bucket(session, args.bucket)
+    dest = args.dest or args.name
+    print("Downloading s3://{}/{} outputs to {}".format(bucket, args.name, dest))
+    results = download_outputs(
+        s3=s3,
+        bucket=bucket,
+        name=args.name,
+        dest=dest,
+        max_workers=args.workers,
+        quiet=args.quiet
+    )
+    counts = {}
+    for status in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    print("downloaded: {}, skipped: {}, failed: {}".format(
+        counts.get(DownloadStatus.DOWNLOADED, 0),
+        counts.get(DownloadStatus.SKIPPED, 0),
+        counts.get(DownloadStatus.FAILED, 0)
+    ))
+    return 1 if counts.get(DownloadStatus.FAILED) else 0
+
+
+def attach_command(args):
+    attach(
+        task_arns=args.tasks,
+        cluster=args.cluster,
+        profile=args.profile,
+        log_strategy=args.log_strategy
+    )
+    return 0
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='aws-ecs-remote')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    download = subparsers.add_parser('download', help='Download the outputs of a run')
+    aws_args(download)
+    download.add_argument('name', help='Run name printed by run_task')
+    download.add_argument('--dest', default=None,
+                          help='Destination directory (default: the run name)')
+    download.add_argument('--bucket', default=None,
+                          help='Run bucket (default: aws-ecs-remote-{region}-{account})')
+    download.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS,
+                          help='Concurrent downloads (default: {})'.format(DOWNLOAD_WORKERS))
+    download.add_argument('--quiet', action='store_true')
+    download.set_defaults(func=download_command)
+
+    attach_parser = subparsers.add_parser('attach', help='Follow running tasks, resuming their logs')
+    aws_args(attach_parser)
+    attach_parser.add_argument('tasks', nargs='+', help='Task ARNs')
+    attach_parser.add_argument('--cluster', default=None,
+                               help='Cluster of the tasks (default: from the checkpoint)')
+    attach_parser.add_argument('--log-strategy', default=None, choices=['get', 'filter'],
+                               help='Log API to tail with (default: by number of streams)')
+    attach_parser.set_defaults(func=attach_command)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
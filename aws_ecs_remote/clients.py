@@ -0,0 +1,97 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Connections per client; boto3's default of 10 caps thread pools at 10 in-flight calls
+MAX_POOL_CONNECTIONS = 64
+RETRY_MODE = 'adaptive'
+MAX_ATTEMPTS = 10
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+
+def client_config(max_pool_connections=MAX_POOL_CONNECTIONS, retry_mode=RETRY_MODE, max_attempts=MAX_ATTEMPTS,
+                  connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={'mode': retry_mode, 'max_attempts': max_attempts},
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout
+    )
+
+
+class ClientRegistry:
+    # Process-wide cache of sessions (per profile) and clients (per session,
+    # region, service and endpoint). Clients are thread-safe once built;
+    # sessions are not, so building either happens under the lock.
+
+    def __init__(self, config=None):
+        self.config = config or client_config()
+        self.sessions = {}
+        self.clients = {}
+        self.lock = threading.RLock()
+
+    def session(self, profile=None):
+        profile = profile or None
+        session = self.sessions.get(profile)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(profile)
+                if session is None:
+                    session = boto3.Session(profile_name=profile)
+                    self.sessions[profile] = session
+        return session
+
+    def client(self, service, profile=None, region=None, session=None, endpoint_url=None, pooled=True):
+        # session: use this session (e.g. one built by the caller) instead of
+        # the profile's. pooled=False builds a client of its own, for callers
+        # that hook its events (metrics.ApiMetrics) and must not see other
+        # runs' calls.
+        with self.lock:
+            if session is None:
+                session = self.session(profile)
+            key = (session, region or session.region_name, service, endpoint_url)
+            client = self.clients.get(key) if pooled else None
+            if client is None:
+                client = session.client(
+                    service,
+                    region_name=region,
+                    endpoint_url=endpoint_url,
+                    config=self.config
+                )
+                if pooled:
+                    self.clients[key] = client
+        return client
+
+    def configure(self, config):
+        # Clients built after this use config
+        with self.lock:
+            self.config = config
+            self.clients = {}
+
+    def clear(self):
+        with self.lock:
+            self.sessions = {}
+            self.clients = {}
+
+
+_registry = ClientRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+def configure_clients(**kwargs):
+    # Keyword arguments of client_config
+    _registry.configure(client_config(**kwargs))
+
+
+def get_session(profile=None):
+    return _registry.session(profile)
+
+
+def get_client(service, profile=None, region=None, session=None, endpoint_url=None, pooled=True):
+    return _registry.client(service, profile=profile, region=region, session=session, endpoint_url=endpoint_url,
+                            pooled=pooled)
@@ -1,37 +1,243 @@
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import ClientError
 from aws_ecs_remote.boto import is_boto_exception
+from aws_ecs_remote.tracing import span
 LOG_FORMAT = '{dt}: {message}'
 LOG_LIMIT = 100
+# get_log_events returns at most 10000 events per call
+DRAIN_LIMIT = 10000
+TAIL_WORKERS = 16
+# filter_log_events accepts at most this many logStreamNames
+FILTER_STREAMS_LIMIT = 100
+# Re-query this far behind the newest event seen, for late-ingested events
+FILTER_OVERLAP_MS = 10000
+
+
+class LogStrategy:
+    GET = 'get'
+    FILTER = 'filter'
+
+
+def ensure_log_group(logs, log_group, cache=None):
+    key = 'log_group:{}'.format(log_group)
+    if cache is not None and cache.get(key):
+        return
+    try:
+        logs.create_log_group(logGroupName=log_group)
+        print("Created log group [{}]".format(log_group))
+    except ClientError as e:
+        if is_boto_exception(e, 'ResourceAlreadyExistsException'):
+            pass
+        else:
+            raise e
+    if cache is not None:
+        cache.put(key, True)
+
+
+def format_log_event(event, log_format=LOG_FORMAT):
+    timestamp = event['timestamp']
+    dt = datetime.fromtimestamp(timestamp/1000.)
+    dt = dt.isoformat()
+    message = event['message']
+    return log_format.format(dt=dt, message=message, timestamp=timestamp)
+
+
+def tag_log_events(events, group, stream=None):
+    # get_log_events does not say where its events came from and
+    # filter_log_events only gives the stream; sinks need both
+    for event in events:
+        event.setdefault('logGroupName', group)
+        if stream is not None:
+            event.setdefault('logStreamName', stream)
+    return events
 
 
 def log_event_handler(log_format=LOG_FORMAT):
     def handler(event):
-        timestamp = event['timestamp']
-        dt = datetime.fromtimestamp(timestamp/1000.)
-        dt = dt.isoformat()
-        message = event['message']
-        print(log_format.format(dt=dt, message=message, timestamp=timestamp))
+        print(format_log_event(event, log_format=log_format))
     return handler
 
 
-def follow_log_events(logs, log_streams, waiter, log_handler=log_event_handler()):
-    tokens = None
-    done = False
-    while not done:
-        tokens = handle_log_events(
-            logs=logs,
-            log_streams=log_streams,
-            tokens=tokens,
-            log_handler=log_handler
-        )
-        done = waiter()
-    tokens = handle_log_events(
+def follow_log_events(logs, log_streams, waiter, log_handler=log_event_handler(),
+                      strategy=LogStrategy.GET, max_workers=TAIL_WORKERS, checkpoint=None):
+    tailer = LogTailer(
         logs=logs,
         log_streams=log_streams,
-        tokens=tokens,
-        log_handler=log_handler
+        strategy=strategy,
+        max_workers=max_workers,
+        log_handler=log_handler,
+        checkpoint=checkpoint
     )
+    done = False
+    while not done:
+        tailer.poll()
+        done = waiter()
+    with span('log_drain'):
+        tailer.poll()
+    return tailer
+
+
+def drain_log_stream(logs, log_stream, token=None, limit=DRAIN_LIMIT):
+    # Reads forward until the token stops advancing. Returns (events, token).
+    events = []
+    while True:
+        kwargs = {}
+        if token:
+            kwargs['nextToken'] = token
+        try:
+            response = logs.get_log_events(
+                logGroupName=log_stream['group'],
+                logStreamName=log_stream['stream'],
+                limit=limit,
+                startFromHead=True,
+                **kwargs
+            )
+        except ClientError as e:
+            if is_boto_exception(e, 'ResourceNotFoundException'):
+                # stream not created yet
+                return events, token
+            raise e
+        events.extend(response['events'])
+        next_token = response['nextForwardToken']
+        if next_token == token:
+            return events, token
+        token = next_token
+
+
+class LogTailer:
+    # Follows many log streams. GET drains each stream with get_log_events on
+    # a thread pool. FILTER covers up to 100 streams of a group per
+    # filter_log_events call and drops repeated events by eventId.
+    # With a checkpoint (see checkpoint.LogCheckpoint), positions are loaded
+    # from it at start and saved after every poll, once log_handler.flush()
+    # (when it has one) returns.
+
+    def __init__(self, logs, log_streams, strategy=LogStrategy.GET, max_workers=TAIL_WORKERS,
+                 log_handler=log_event_handler(), checkpoint=None):
+        if strategy not in (LogStrategy.GET, LogStrategy.FILTER):
+            raise ValueError("Unknown log strategy [{}]".format(strategy))
+        self.logs = logs
+        self.log_streams = list(log_streams)
+        self.strategy = strategy
+        self.max_workers = max_workers
+        self.log_handler = log_handler
+        self.checkpoint = checkpoint
+        self.tokens = {}
+        self.streams = {}
+        self.filters = []
+        groups = {}
+        for log_stream in self.log_streams:
+            key = (log_stream['group'], log_stream['stream'])
+            self.streams[key] = log_stream
+            if checkpoint is not None:
+                self.tokens[key] = checkpoint.position(log_stream).get('token')
+            groups.setdefault(log_stream['group'], []).append(log_stream)
+        for group, log_streams in groups.items():
+            for start in range(0, len(log_streams), FILTER_STREAMS_LIMIT):
+                batch = log_streams[start:start + FILTER_STREAMS_LIMIT]
+                start_time = 0
+                if checkpoint is not None:
+                    start_time = min(checkpoint.position(log_stream).get('timestamp') or 0
+                                     for log_stream in batch)
+                self.filters.append({
+                    'group': group,
+                    'streams': [log_stream['stream'] for log_stream in batch],
+                    'start_time': start_time,
+                    'seen': {}
+                })
+
+    def poll(self):
+        # Hands every new event to log_handler; returns the number of events
+        if self.strategy == LogStrategy.FILTER:
+            jobs = [(self.poll_filter, f) for f in self.filters]
+        else:
+            jobs = [(self.poll_stream, s) for s in self.log_streams]
+        count = 0
+        with span('log_poll', strategy=self.strategy, streams=len(self.log_streams)) as attributes:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(fn, arg) for fn, arg in jobs]
+                # Handlers run on this thread, one stream or batch at a time
+                for future in as_completed(futures):
+                    events, positions = future.result()
+                    for event in events:
+                        self.log_handler(event)
+                    count += len(events)
+                    if self.checkpoint is not None:
+                        for log_stream, token, stream_events in positions:
+                            self.checkpoint.update(log_stream, token=token, events=stream_events)
+            if self.checkpoint is not None:
+                # A handler that writes on another thread (sinks.LogDispatcher)
+                # must have written the events before their positions are saved
+                flush = getattr(self.log_handler, 'flush', None)
+                if flush is not None:
+                    flush()
+                self.checkpoint.save()
+            attributes['events'] = count
+        return count
+
+    def poll_stream(self, log_stream):
+        # Returns (events, [(log_stream, token, events)])
+        key = (log_stream['group'], log_stream['stream'])
+        events, token = drain_log_stream(
+            logs=self.logs, log_stream=log_stream, token=self.tokens.get(key))
+        self.tokens[key] = token
+        tag_log_events(events, group=log_stream['group'], stream=log_stream['stream'])
+        return events, [(log_stream, token, events)]
+
+    def checkpointed(self, log_stream, event):
+        # True if a previous session already handled this event
+        if self.checkpoint is None or log_stream is None:
+            return False
+        position = self.checkpoint.position(log_stream)
+        timestamp = position.get('timestamp')
+        if timestamp is None or event['timestamp'] > timestamp:
+            return False
+        return event['timestamp'] < timestamp or event.get('eventId') in position.get('event_ids', [])
+
+    def poll_filter(self, state):
+        events = []
+        kwargs = {}
+        while True:
+            try:
+                response = self.logs.filter_log_events(
+                    logGroupName=state['group'],
+                    logStreamNames=state['streams'],
+                    startTime=state['start_time'],
+                    **kwargs
+                )
+            except ClientError as e:
+                if is_boto_exception(e, 'ResourceNotFoundException'):
+                    break
+                raise e
+            for event in response['events']:
+                if event['eventId'] not in state['seen']:
+                    state['seen'][event['eventId']] = event['timestamp']
+                    log_stream = self.streams.get((state['group'], event.get('logStreamName')))
+                    if not self.checkpointed(log_stream, event):
+                        events.append(event)
+            if not response.get('nextToken'):
+                break
+            kwargs['nextToken'] = response['nextToken']
+        if state['seen']:
+            start_time = max(0, max(state['seen'].values()) - FILTER_OVERLAP_MS)
+            state['start_time'] = start_time
+            state['seen'] = {
+                event_id: timestamp
+                for event_id, timestamp in state['seen'].items()
+                if timestamp >= start_time
+            }
+        events.sort(key=lambda event: event['timestamp'])
+        tag_log_events(events, group=state['group'])
+        by_stream = {}
+        for event in events:
+            by_stream.setdefault(event.get('logStreamName'), []).append(event)
+        positions = [
+            (self.streams[(state['group'], stream)], None, stream_events)
+            for stream, stream_events in by_stream.items()
+            if (state['group'], stream) in self.streams
+        ]
+        return events, positions
 
 
 def handle_log_events(logs, log_streams, tokens=None, log_handler=log_event_handler()):
@@ -59,7 +265,7 @@ def handle_log_events(logs, log_streams, tokens=None, log_handler=log_event_hand
                 raise e
         if response:
             next_tokens.append(response['nextForwardToken'])
-            events = response['events']
+            events = tag_log_events(response['events'], group=log_stream['group'], stream=log_stream['stream'])
             for event in events:
                 log_handler(event)
         else:
@@ -68,9 +274,8 @@ def handle_log_events(logs, log_streams, tokens=None, log_handler=log_event_hand
 
 
 if __name__ == '__main__':
-    import boto3
-    session = boto3.Session()
-    logs = session.client('logs')
+    from aws_ecs_remote.clients import get_client
+    logs = get_client('logs')
     log_streams = [{
         'name': 'container',
         'group': '/ecs/fargate-task-definition',
@@ -8,6 +8,30 @@ class FargateProvider:
     FARGATE_SPOT = 'FARGATE_SPOT'
 
 
+def fargate_strategy(spot_weight=1, on_demand_weight=0, spot_base=0, on_demand_base=0):
+    # capacityProviderStrategy splitting tasks between Spot and on-demand
+    # Fargate by weight, after the first base tasks go to that provider.
+    # ECS allows a base on one provider only.
+    if spot_base and on_demand_base:
+        raise ValueError("Only one capacity provider can have a base")
+    strategy = []
+    for provider, weight, base in (
+            (FargateProvider.FARGATE_SPOT, spot_weight, spot_base),
+            (FargateProvider.FARGATE, on_demand_weight, on_demand_base)):
+        if weight or base:
+            strategy.append({'capacityProvider': provider, 'weight': weight, 'base': base})
+    if not strategy:
+        raise ValueError("Capacity provider strategy needs a weight or base")
+    return strategy
+
+
+ON_DEMAND_STRATEGY = [{'capacityProvider': FargateProvider.FARGATE, 'weight': 1, 'base': 0}]
+
+
+def uses_spot(strategy):
+    return any(entry['capacityProvider'] == FargateProvider.FARGATE_SPOT for entry in strategy or ())
+
+
 def get_cluster(ecs, cluster_name=CLUSTER_NAME):
     response = ecs.describe_clusters(
         clusters=[
@@ -55,16 +79,25 @@ def create_cluster(ecs, cluster_name=CLUSTER_NAME):
     return cluster
 
 
-def ensure_cluster(ecs, cluster_name=CLUSTER_NAME):
+def ensure_cluster(ecs, cluster_name=CLUSTER_NAME, cache=None):
+    key = 'cluster:{}'.format(cluster_name)
+    if cache is not None:
+        cluster = cache.get(key)
+        if cluster is not None:
+            return cluster
     cluster = get_cluster(ecs=ecs, cluster_name=cluster_name)
     if cluster is None:
         cluster = create_cluster(ecs=ecs, cluster_name=cluster_name)
+    if cache is not None:
+        cache.put(key, {
+            'clusterName': cluster['clusterName'],
+            'clusterArn': cluster['clusterArn']
+        })
     return cluster
 
 
 if __name__ == "__main__":
-    import boto3
-    session = boto3.Session()
-    ecs = session.client('ecs')
+    from aws_ecs_remote.clients import get_client
+    ecs = get_client('ecs')
     cluster = ensure_cluster(ecs)
     print("cluster: {}".format(cluster))
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from aws_ecs_remote.remote import USAGE_FILE, safe_path
+from aws_ecs_remote.state import read_json, write_json
+
+OUTPUT_PREFIX = 'output'
+DOWNLOAD_WORKERS = 16
+MB = 1024 * 1024
+RANGE_THRESHOLD = 64 * MB
+RANGE_SIZE = 16 * MB
+COPY_CHUNK_SIZE = MB
+# Records the ETag and size of every completed download in the destination
+DOWNLOAD_STATE = '.aws-ecs-remote-downloads.json'
+# The records are saved at most this often while downloading, and at the end.
+# Files finished since the last save are checked again on the next run.
+STATE_SAVE_SEC = 5
+PART_SUFFIX = '.part'
+PART_STATE_SUFFIX = '.part.json'
+
+
+class DownloadStatus:
+    DOWNLOADED = 'downloaded'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+
+def output_prefix(name, index=None):
+    # Sweep tasks each get their own numbered directory under the run's output
+    if index is None:
+        return '{}/{}/'.format(name, OUTPUT_PREFIX)
+    return '{}/{}/{:05d}/'.format(name, OUTPUT_PREFIX, index)
+
+
+def list_objects(s3, bucket, prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/') and not obj['Key'].endswith('/' + USAGE_FILE):
+                yield obj
+
+
+def md5_file(path):
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def local_matches(path, obj, record):
+    if not os.path.isfile(path) or os.path.getsize(path) != obj['Size']:
+        return False
+    if record is not None:
+        return record.get('etag') == obj['ETag'] and record.get('size') == obj['Size']
+    etag = obj['ETag'].strip('"')
+    # Single-part ETags are the MD5 of the content; multipart ones cannot be
+    # checked without the original part size
+    if '-' in etag:
+        return False
+    return md5_file(path) == etag
+
+
+def object_ranges(size, range_size):
+    return [(start, min(start + range_size, size) - 1) for start in range(0, size, range_size)]
+
+
+class RangedDownload:
+    # One large object downloaded as ranges into a preallocated .part file.
+    # Finished ranges are recorded beside it so an interrupted run resumes.
+
+    def __init__(self, s3, bucket, obj, path, range_size):
+        self.s3 = s3
+        self.bucket = bucket
+        self.obj = obj
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.state_path = path + PART_STATE_SUFFIX
+        self.ranges = object_ranges(obj['Size'], range_size)
+        self.lock = threading.Lock()
+        state = read_json(self.state_path)
+        if (
+                state is None
+                or state.get('etag') != obj['ETag']
+                or state.get('size') != obj['Size']
+                or state.get('range_size') != range_size
+                or not os.path.exists(self.part_path)):
+            state = {
+                'etag': obj['ETag'],
+                'size': obj['Size'],
+                'range_size': range_size,
+                'done': []
+            }
+            with open(self.part_path, 'wb') as f:
+                f.truncate(obj['Size'])
+            write_json(self.state_path, state)
+        self.state = state
+        self.done = set(state['done'])
+        self.remaining = len(self.ranges) - len(self.done)
+
+    def pending(self):
+        return [i for i in range(len(self.ranges)) if i not in self.done]
+
+    def fetch(self, i):
+        start, end = self.ranges[i]
+        response = self.s3.get_object(
+            Bucket=self.bucket,
+            Key=self.obj['Key'],
+            Range='bytes={}-{}'.format(start, end),
+            IfMatch=self.obj['ETag']
+        )
+        body = response['Body']
+        with open(self.part_path, 'r+b') as f:
+            f.seek(start)
+            for chunk in iter(lambda: body.read(COPY_CHUNK_SIZE), b''):
+                f.write(chunk)
+        with self.lock:
+            self.done.add(i)
+            self.remaining -= 1
+            self.state['done'] = sorted(self.done)
+            write_json(self.state_path, self.state)
+            finished = self.remaining == 0
+        if finished:
+            self.finish()
+        return finished
+
+    def finish(self):
+        os.replace(self.part_path, self.path)
+        os.remove(self.state_path)
+
+
+def download_object(s3, bucket, obj, path):
+    part_path = path + PART_SUFFIX
+    response = s3.get_object(Bucket=bucket, Key=obj['Key'], IfMatch=obj['ETag'])
+    body = response['Body']
+    with open(part_path, 'wb') as f:
+        for chunk in iter(lambda: body.read(COPY_CHUNK_SIZE), b''):
+            f.write(chunk)
+    os.replace(part_path, path)
+
+
+def download_prefix(s3, bucket, prefix, dest, max_workers=DOWNLOAD_WORKERS,
+                    range_threshold=RANGE_THRESHOLD, range_size=RANGE_SIZE, quiet=False):
+    # Downloads every object under prefix into dest, skipping files that already
+    # match. Keys that would land outside dest fail. Returns {key: DownloadStatus}.
+    os.makedirs(dest, exist_ok=True)
+    state_file = os.path.join(dest, DOWNLOAD_STATE)
+    records = read_json(state_file, default={})
+    records_lock = threading.Lock()
+    saved = [time.monotonic()]
+    results = {}
+    jobs = []
+    for obj in list_objects(s3=s3, bucket=bucket, prefix=prefix):
+        rel = obj['Key'][len(prefix):].lstrip('/')
+        try:
+            path = safe_path(dest, rel)
+        except ValueError as e:
+            print("Failed to download {}: {}".format(obj['Key'], e))
+            results[obj['Key']] = DownloadStatus.FAILED
+            continue
+        if local_matches(path, obj, records.get(rel)):
+            results[obj['Key']] = DownloadStatus.SKIPPED
+            records[rel] = {'etag': obj['ETag'], 'size': obj['Size']}
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if obj['Size'] > range_threshold:
+            download = RangedDownload(s3=s3, bucket=bucket, obj=obj, path=path, range_size=range_size)
+            pending = download.pending()
+            if pending:
+                jobs.extend((obj, rel, path, download, i) for i in pending)
+            else:
+                # Every range was fetched before the last run stopped; only
+                # the rename is left
+                jobs.append((obj, rel, path, download, None))
+        else:
+            jobs.append((obj, rel, path, None, None))
+
+    def complete(obj, rel):
+        with records_lock:
+            records[rel] = {'etag': obj['ETag'], 'size': obj['Size']}
+            if time.monotonic() - saved[0] >= STATE_SAVE_SEC:
+                write_json(state_file, records)
+                saved[0] = time.monotonic()
+        if not quiet:
+            print("download {}".format(rel))
+
+    def run(job):
+        obj, rel, path, download, i = job
+        if download is None:
+            download_object(s3=s3, bucket=bucket, obj=obj, path=path)
+            complete(obj, rel)
+        elif i is None:
+            download.finish()
+            complete(obj, rel)
+        elif download.fetch(i):
+            complete(obj, rel)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, job): job for job in jobs}
+        for future in as_completed(futures):
+            obj = futures[future][0]
+            try:
+                future.result()
+                results.setdefault(obj['Key'], DownloadStatus.DOWNLOADED)
+            except Exception as e:
+                if results.get(obj['Key']) != DownloadStatus.FAILED:
+                    print("Failed to download {}: {}".format(obj['Key'], e))
+                results[obj['Key']] = DownloadStatus.FAILED
+    write_json(state_file, records)
+    return results
+
+
+def download_outputs(s3, bucket, name, dest, **kwargs):
+    return download_prefix(s3=s3, bucket=bucket, prefix=output_prefix(name), dest=dest, **kwargs)
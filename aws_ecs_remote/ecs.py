@@ -1,10 +1,40 @@
-from aws_ecs_remote.task_definition import LaunchType, CONTAINER_NAME, describe_task_definition
-import itertools
-import hashlib
+from aws_ecs_remote.task_definition import LaunchType, CONTAINER_NAME, get_task_definition
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.exceptions import ClientError
+from aws_ecs_remote.boto import is_boto_exception
+from aws_ecs_remote.cluster import ON_DEMAND_STRATEGY, uses_spot
 from aws_ecs_remote.cloudwatch import follow_log_events
+from aws_ecs_remote.throttle import TokenBucket, backoff_delay
+from aws_ecs_remote.tracing import in_context, record_task_phases, span
 import warnings
 
+# RunTask launches at most this many tasks per call
+MAX_RUN_TASK_COUNT = 10
+RUN_TASK_RATE = 20
+RUN_TASK_BURST = 40
+RUN_TASK_WORKERS = 16
+RUN_TASK_ATTEMPTS = 8
+RETRYABLE_ERRORS = (
+    'ThrottlingException',
+    'ServerException',
+    'LimitExceededException',
+)
+# Substrings of RunTask failure reasons that mean "try again later"
+RETRYABLE_FAILURES = (
+    'Capacity is unavailable',
+    'RESOURCE:',
+)
+# DescribeTasks accepts at most this many tasks per call
+DESCRIBE_TASKS_LIMIT = 100
+DESCRIBE_TASKS_WORKERS = 8
+TERMINAL_STATUSES = ('STOPPED', 'DELETED')
+POLL_SEC = 6
+MIN_POLL_SEC = 2
+MAX_POLL_SEC = 30
+# New tasks can be briefly MISSING from DescribeTasks; give up after this many polls
+MISSING_POLLS = 5
+
 
 def get_log_paths(containers, container_definitions):
     cdefs = {
@@ -26,6 +56,7 @@ def get_log_paths(containers, container_definitions):
                 'group': log_group,
                 'prefix': log_prefix,
                 'taskId': taskId,
+                'taskArn': container['taskArn'],
                 'stream': '{}/{}/{}'.format(log_prefix, name, taskId)
             })
         else:
@@ -35,33 +66,165 @@ def get_log_paths(containers, container_definitions):
     return ldefs
 
 
-def tasks_waiter(ecs, cluster, task_arns, poll_sec=6):
-    def waiter():
-        done = tasks_stopped(ecs=ecs, cluster=cluster, task_arns=task_arns)
-        if not done:
-            time.sleep(poll_sec)
-        return done
-    return waiter
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def describe_tasks(ecs, cluster, task_arns, executor=None):
+    # DescribeTasks in chunks of 100, concurrently when given an executor.
+    # Returns (tasks, failures).
+    def describe(chunk):
+        return ecs.describe_tasks(cluster=cluster, tasks=chunk)
+
+    parts = chunks(list(task_arns), DESCRIBE_TASKS_LIMIT)
+    if executor is None or len(parts) <= 1:
+        responses = [describe(chunk) for chunk in parts]
+    else:
+        responses = list(executor.map(describe, parts))
+    tasks = []
+    failures = []
+    for response in responses:
+        tasks.extend(response['tasks'])
+        failures.extend(response.get('failures', []))
+    return tasks, failures
+
+
+class FleetTracker:
+    # Polls the status of many tasks. Only tasks that have not stopped are
+    # described, and the poll interval shrinks while tasks are changing state
+    # and grows while nothing happens.
+
+    def __init__(self, ecs, cluster, task_arns, poll_sec=POLL_SEC, min_poll_sec=MIN_POLL_SEC,
+                 max_poll_sec=MAX_POLL_SEC, max_workers=DESCRIBE_TASKS_WORKERS):
+        self.ecs = ecs
+        self.cluster = cluster
+        self.pending = list(dict.fromkeys(task_arns))
+        self.poll_sec = poll_sec
+        self.min_poll_sec = min_poll_sec
+        self.max_poll_sec = max_poll_sec
+        self.max_workers = max_workers
+        self.statuses = {}
+        self.missing = {}
+        self.stopped = {}
+        self.failed = {}
+        self.calls = 0
+
+    @property
+    def done(self):
+        return not self.pending
+
+    def add(self, task_arns):
+        # Tracks tasks launched after the tracker was created
+        known = set(self.pending)
+        self.pending.extend(arn for arn in task_arns if arn not in known and arn not in self.stopped)
+
+    def forget(self, task_arns):
+        # Drops finished tasks once the caller has recorded them, so
+        # long-lived trackers do not keep every task they have seen
+        for arn in task_arns:
+            self.statuses.pop(arn, None)
+            self.missing.pop(arn, None)
+            self.stopped.pop(arn, None)
+            self.failed.pop(arn, None)
+
+    def poll(self):
+        # Returns the tasks that reached a terminal state since the last poll
+        if not self.pending:
+            return []
+        with span('describe_tasks', tasks=len(self.pending)):
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                tasks, failures = describe_tasks(
+                    ecs=self.ecs, cluster=self.cluster, task_arns=self.pending, executor=executor)
+        self.calls += len(chunks(self.pending, DESCRIBE_TASKS_LIMIT))
+        transitions = 0
+        finished = []
+        for task in tasks:
+            arn = task['taskArn']
+            self.missing.pop(arn, None)
+            if self.statuses.get(arn) != task['lastStatus']:
+                transitions += 1
+                self.statuses[arn] = task['lastStatus']
+            if task['lastStatus'] in TERMINAL_STATUSES:
+                self.stopped[arn] = task
+                finished.append(task)
+                record_task_phases(task)
+        for failure in failures:
+            arn = failure.get('arn')
+            self.missing[arn] = self.missing.get(arn, 0) + 1
+            if self.missing[arn] >= MISSING_POLLS:
+                self.failed[arn] = failure
+                transitions += 1
+        if finished or self.failed:
+            self.pending = [
+                arn for arn in self.pending
+                if arn not in self.stopped and arn not in self.failed
+            ]
+        self.adapt(transitions)
+        return finished
+
+    def adapt(self, transitions):
+        if transitions:
+            self.poll_sec = max(self.min_poll_sec, self.poll_sec / 2.)
+        else:
+            self.poll_sec = min(self.max_poll_sec, self.poll_sec * 1.5)
+
+    def iter_stopped(self):
+        # Yields each task once, as soon as a poll sees it stop
+        while self.pending:
+            for task in self.poll():
+                yield task
+            if self.pending:
+                time.sleep(self.poll_sec)
+
+    def waiter(self, on_stopped=None):
+        # Callable for follow_log_events: polls once, sleeps if tasks remain
+        def waiter():
+            for task in self.poll():
+                if on_stopped is not None:
+                    on_stopped(task)
+            if self.pending:
+                time.sleep(self.poll_sec)
+            return self.done
+        return waiter
+
+
+def task_exit_codes(task):
+    return {
+        container['name']: container.get('exitCode')
+        for container in task.get('containers', [])
+    }
+
+
+def print_task_stopped(task):
+    print("Task {} stopped: {} (exit codes {})".format(
+        task['taskArn'], task.get('stoppedReason', ''), task_exit_codes(task)))
+
+
+def tasks_waiter(ecs, cluster, task_arns, poll_sec=POLL_SEC, on_stopped=None):
+    tracker = FleetTracker(ecs=ecs, cluster=cluster, task_arns=task_arns, poll_sec=poll_sec)
+    return tracker.waiter(on_stopped=on_stopped)
 
 
 def tasks_stopped(ecs, cluster, task_arns):
-    response = ecs.describe_tasks(
-        cluster=cluster,
-        tasks=task_arns
-    )
-    tasks = response['tasks']
+    tasks, _ = describe_tasks(ecs=ecs, cluster=cluster, task_arns=task_arns)
     for task in tasks:
         if task['lastStatus'] != 'STOPPED':
             return False
     return True
 
 
-def ecs_run_task(
-        ecs, cluster, task_definition, command, subnets, security_groups, launch_type=LaunchType.FARGATE,
+def run_task_kwargs(
+        cluster, task_definition, command, subnets, security_groups, launch_type=LaunchType.FARGATE,
         platform_version='1.4.0', container_name=CONTAINER_NAME,
         assign_public_ip='ENABLED',
-        started_by='aws-ecs-remote', group='aws-ecs-remote-group'):
-    response = ecs.run_task(
+        started_by='aws-ecs-remote', group='aws-ecs-remote-group',
+        capacity_provider_strategy=None):
+    # A capacity provider strategy replaces the launch type; RunTask rejects both
+    if capacity_provider_strategy:
+        placement = {'capacityProviderStrategy': capacity_provider_strategy}
+    else:
+        placement = {'launchType': launch_type}
+    return dict(
         cluster=cluster,
         taskDefinition=task_definition,
         overrides={
@@ -72,10 +235,8 @@ def ecs_run_task(
                 },
             ]
         },
-        count=1,
         startedBy=started_by,
         group=group,
-        launchType=launch_type,
         platformVersion=platform_version,
         networkConfiguration={
             'awsvpcConfiguration': {
@@ -83,17 +244,142 @@ def ecs_run_task(
                 'securityGroups': security_groups,
                 'assignPublicIp': assign_public_ip
             }
-        })
+        },
+        **placement)
+
+
+def on_demand_kwargs(kwargs):
+    # The same RunTask request placed on on-demand Fargate
+    kwargs = dict(kwargs)
+    kwargs['capacityProviderStrategy'] = ON_DEMAND_STRATEGY
+    return kwargs
+
+
+class LaunchError(Exception):
+    # RunTask started no task. failures are the response's failures, as
+    # launch_batch reports them per task.
+
+    def __init__(self, failures):
+        self.failures = failures
+        reasons = ', '.join(failure.get('reason') or 'unknown' for failure in failures) or 'no failures reported'
+        super(LaunchError, self).__init__("RunTask started no task: {}".format(reasons))
+
+
+def ecs_run_task(ecs, cluster, task_definition, command, subnets, security_groups, spot_fallback=True, **kwargs):
+    request = run_task_kwargs(
+        cluster=cluster,
+        task_definition=task_definition,
+        command=command,
+        subnets=subnets,
+        security_groups=security_groups,
+        **kwargs
+    )
+    with span('run_task', count=1):
+        response = ecs.run_task(count=1, **request)
+    if (not response['tasks'] and spot_fallback
+            and uses_spot(request.get('capacityProviderStrategy'))
+            and any(is_retryable_failure(failure) for failure in response.get('failures', []))):
+        print("Spot capacity unavailable, launching on {}".format(ON_DEMAND_STRATEGY[0]['capacityProvider']))
+        with span('run_task', count=1, fallback=True):
+            response = ecs.run_task(count=1, **on_demand_kwargs(request))
     tasks = response['tasks']
-    assert len(tasks) == 1
-    task = tasks[0]
-    return task
+    if not tasks:
+        raise LaunchError(response.get('failures', []))
+    return tasks[0]
+
+
+def is_retryable_failure(failure):
+    reason = failure.get('reason') or ''
+    return any(retryable in reason for retryable in RETRYABLE_FAILURES)
+
+
+def make_launch_batches(commands, max_count=MAX_RUN_TASK_COUNT):
+    # Identical commands share RunTask calls via count; returns [(indexes, command)]
+    groups = {}
+    for i, command in enumerate(commands):
+        groups.setdefault(tuple(command), []).append(i)
+    batches = []
+    for command, indexes in groups.items():
+        for start in range(0, len(indexes), max_count):
+            batches.append((indexes[start:start + max_count], list(command)))
+    return batches
+
+
+def launch_batch(ecs, kwargs, indexes, bucket, max_attempts=RUN_TASK_ATTEMPTS, spot_fallback=True):
+    # Returns [(index, task, failure)]; retries throttling and capacity
+    # failures for the part of the batch that did not start. If the strategy
+    # uses Spot, the first capacity failure moves the rest to on-demand.
+    results = []
+    pending = list(indexes)
+    failures = []
+    fallback = spot_fallback and uses_spot(kwargs.get('capacityProviderStrategy'))
+    delay = False
+    for attempt in range(max_attempts):
+        if delay:
+            time.sleep(backoff_delay(attempt - 1))
+        delay = True
+        with span('throttle'):
+            bucket.acquire()
+        try:
+            with span('run_task', count=len(pending), attempt=attempt):
+                response = ecs.run_task(count=len(pending), **kwargs)
+        except ClientError as e:
+            if any(is_boto_exception(e, code) for code in RETRYABLE_ERRORS) and attempt + 1 < max_attempts:
+                continue
+            failure = {'reason': str(e)}
+            return results + [(i, None, failure) for i in pending]
+        for task in response['tasks']:
+            results.append((pending.pop(0), task, None))
+        failures = response.get('failures', [])
+        if not pending:
+            return results
+        if not any(is_retryable_failure(failure) for failure in failures):
+            break
+        if fallback:
+            kwargs = on_demand_kwargs(kwargs)
+            fallback = False
+            delay = False
+    failure = failures[0] if failures else {'reason': 'RunTask started fewer tasks than requested'}
+    return results + [(i, None, failure) for i in pending]
+
+
+def ecs_run_tasks(
+        ecs, cluster, task_definition, commands, subnets, security_groups,
+        rate=RUN_TASK_RATE, burst=RUN_TASK_BURST, max_workers=RUN_TASK_WORKERS,
+        max_attempts=RUN_TASK_ATTEMPTS, bucket=None, spot_fallback=True, **kwargs):
+    # Launches one task per command, yielding (index, task, failure) as
+    # batches finish. Calls run concurrently under a shared token bucket.
+    if bucket is None:
+        bucket = TokenBucket(rate=rate, capacity=burst)
+    batches = make_launch_batches(commands)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                in_context(launch_batch),
+                ecs=ecs,
+                kwargs=run_task_kwargs(
+                    cluster=cluster,
+                    task_definition=task_definition,
+                    command=command,
+                    subnets=subnets,
+                    security_groups=security_groups,
+                    **kwargs
+                ),
+                indexes=indexes,
+                bucket=bucket,
+                max_attempts=max_attempts,
+                spot_fallback=spot_fallback
+            )
+            for indexes, command in batches
+        ]
+        for future in as_completed(futures):
+            for result in future.result():
+                yield result
 
 
 if __name__ == "__main__":
-    import boto3
-    session = boto3.Session()
-    ecs = session.client('ecs')
+    from aws_ecs_remote.clients import get_client
+    ecs = get_client('ecs')
     cluster = 'arn:aws:ecs:us-east-1:683880991063:cluster/columbo-fargate-cluster'
     task = ecs_run_task(
         ecs=ecs,
@@ -107,9 +393,9 @@ if __name__ == "__main__":
         assign_public_ip='ENABLED',
         started_by='aws-ecs-remote',
         group='aws-ecs-remote-group')
-    task_definition = describe_task_definition(
+    task_definition = get_task_definition(
         ecs=ecs,
-        task_definition=task['taskDefinitionArn']
+        arn=task['taskDefinitionArn']
     )
     log_streams = get_log_paths(
         task['containers'], task_definition['containerDefinitions']
@@ -119,7 +405,7 @@ if __name__ == "__main__":
         cluster=task['clusterArn'],
         task_arns=[task['taskArn']]
     )
-    logs = session.client('logs')
+    logs = get_client('logs')
     follow_log_events(
         logs=logs, log_streams=log_streams, waiter=waiter
     )
@@ -0,0 +1,195 @@
+import json
+import time
+
+from aws_ecs_remote.clients import get_client
+from aws_ecs_remote.ecs import FleetTracker, POLL_SEC, TERMINAL_STATUSES
+from aws_ecs_remote.tracing import record_task_phases, span
+
+EVENTS_NAME = 'aws-ecs-remote-task-events'
+TASK_STATE_CHANGE = 'ECS Task State Change'
+# Long poll; a message is returned as soon as it arrives
+RECEIVE_WAIT_SEC = 10
+RECEIVE_MAX_MESSAGES = 10
+# Events for tasks another follower tracks are left on the queue and become
+# visible again after this long
+RECEIVE_VISIBILITY_SEC = 5
+# Describe the remaining tasks when no event has arrived for this long
+FALLBACK_SEC = 60
+MESSAGE_RETENTION_SEC = 3600
+
+
+def task_event_pattern(cluster_arn):
+    return {
+        'source': ['aws.ecs'],
+        'detail-type': [TASK_STATE_CHANGE],
+        'detail': {
+            'clusterArn': [cluster_arn]
+        }
+    }
+
+
+def queue_policy(queue_arn, rule_arn):
+    return {
+        'Version': '2012-10-17',
+        'Statement': [
+            {
+                'Effect': 'Allow',
+                'Principal': {'Service': 'events.amazonaws.com'},
+                'Action': 'sqs:SendMessage',
+                'Resource': queue_arn,
+                'Condition': {'ArnEquals': {'aws:SourceArn': rule_arn}}
+            }
+        ]
+    }
+
+
+def ensure_task_events(events, sqs, cluster_arn, name=EVENTS_NAME, cache=None):
+    # EventBridge rule sending the cluster's task state changes to an SQS
+    # queue. Every call is idempotent; returns {QueueUrl, QueueArn, RuleArn}.
+    cluster_name = cluster_arn.split('/')[-1]
+    name = '{}-{}'.format(name, cluster_name)
+    key = 'task_events:{}'.format(name)
+    if cache is not None:
+        task_events = cache.get(key)
+        if task_events is not None:
+            return task_events
+    queue_url = sqs.create_queue(
+        QueueName=name,
+        Attributes={'MessageRetentionPeriod': str(MESSAGE_RETENTION_SEC)}
+    )['QueueUrl']
+    queue_arn = sqs.get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=['QueueArn']
+    )['Attributes']['QueueArn']
+    rule_arn = events.put_rule(
+        Name=name,
+        EventPattern=json.dumps(task_event_pattern(cluster_arn)),
+        State='ENABLED',
+        Description='aws-ecs-remote task state changes for {}'.format(cluster_name)
+    )['RuleArn']
+    sqs.set_queue_attributes(
+        QueueUrl=queue_url,
+        Attributes={'Policy': json.dumps(queue_policy(queue_arn, rule_arn))}
+    )
+    events.put_targets(
+        Rule=name,
+        Targets=[{'Id': 'sqs', 'Arn': queue_arn}]
+    )
+    task_events = {
+        'QueueUrl': queue_url,
+        'QueueArn': queue_arn,
+        'RuleArn': rule_arn
+    }
+    if cache is not None:
+        cache.put(key, task_events)
+    return task_events
+
+
+def events_clients(session, sqs_endpoint_url=None, pooled=True):
+    # sqs_endpoint_url points the queue side at a local SQS stand-in
+    return (
+        get_client('events', session=session, pooled=pooled),
+        get_client('sqs', session=session, endpoint_url=sqs_endpoint_url, pooled=pooled)
+    )
+
+
+def parse_task_event(body):
+    # The task in an ECS Task State Change has the DescribeTasks shape
+    try:
+        event = json.loads(body)
+    except ValueError:
+        return None
+    if event.get('detail-type') != TASK_STATE_CHANGE:
+        return None
+    return event.get('detail')
+
+
+class EventWaiter(FleetTracker):
+    # FleetTracker fed by task state change events. Each poll long-polls the
+    # queue instead of sleeping; DescribeTasks only runs when events stop
+    # arriving for fallback_sec. The queue is shared by every follower of the
+    # cluster: only events for this waiter's tasks (and unreadable messages)
+    # are deleted, the rest go back to the queue for their own follower.
+
+    def __init__(self, ecs, cluster, task_arns, sqs, queue_url, wait_sec=RECEIVE_WAIT_SEC,
+                 fallback_sec=FALLBACK_SEC, poll_sec=POLL_SEC, **kwargs):
+        super(EventWaiter, self).__init__(ecs=ecs, cluster=cluster, task_arns=task_arns, poll_sec=poll_sec, **kwargs)
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.wait_sec = wait_sec
+        self.fallback_sec = fallback_sec
+        self.last_update = time.monotonic()
+        self.events = 0
+        self.poll_sec = 0
+
+    def receive(self):
+        # Returns the tasks of queued events for this waiter's tasks, waiting
+        # up to wait_sec for the first. Batches of other followers' events do
+        # not end the wait early, but never extend it past wait_sec.
+        tasks = []
+        wait_sec = self.wait_sec
+        deadline = time.monotonic() + wait_sec
+        while True:
+            tracked = set(self.pending)
+            tracked.update(self.stopped)
+            response = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=RECEIVE_MAX_MESSAGES,
+                WaitTimeSeconds=wait_sec,
+                VisibilityTimeout=RECEIVE_VISIBILITY_SEC
+            )
+            messages = response.get('Messages', [])
+            consumed = []
+            ours = 0
+            for message in messages:
+                task = parse_task_event(message['Body'])
+                if task is None or 'taskArn' not in task:
+                    consumed.append(message)
+                elif task['taskArn'] in tracked:
+                    consumed.append(message)
+                    tasks.append(task)
+                    ours += 1
+            if consumed:
+                self.sqs.delete_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                        for i, message in enumerate(consumed)
+                    ]
+                )
+            if ours:
+                wait_sec = 0
+            elif not messages or not wait_sec:
+                return tasks
+            else:
+                wait_sec = int(deadline - time.monotonic())
+                if wait_sec <= 0:
+                    return tasks
+
+    def poll(self):
+        finished = []
+        pending = set(self.pending)
+        with span('receive_events'):
+            tasks = self.receive()
+        for task in tasks:
+            arn = task['taskArn']
+            if arn not in pending:
+                continue
+            self.events += 1
+            self.last_update = time.monotonic()
+            self.statuses[arn] = task.get('lastStatus')
+            if task.get('lastStatus') in TERMINAL_STATUSES and arn not in self.stopped:
+                self.stopped[arn] = task
+                finished.append(task)
+                record_task_phases(task)
+        if finished:
+            self.pending = [arn for arn in self.pending if arn not in self.stopped]
+        if self.pending and time.monotonic() - self.last_update >= self.fallback_sec:
+            # Events are late or the rule is missing; fall back to describing
+            finished.extend(super(EventWaiter, self).poll())
+            self.last_update = time.monotonic()
+        return finished
+
+    def adapt(self, transitions):
+        # Waiting happens in the long poll
+        self.poll_sec = 0
@@ -0,0 +1,516 @@
+# concurrent.futures.Executor that runs calls in ECS tasks. Calls are pickled
+# into shards in the run bucket; each task runs one shard and writes one
+# result object, which resolves the shard's futures.
+import argparse
+import itertools
+import os
+import pickle
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import BrokenExecutor, Executor, Future, ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from aws_ecs_remote.boto import is_boto_exception
+from aws_ecs_remote.clients import get_client
+from aws_ecs_remote.download import output_prefix
+from aws_ecs_remote.ecs import FleetTracker, ecs_run_tasks
+from aws_ecs_remote.package import DEFAULT_EXTRAS, pinned_bootstrap
+from aws_ecs_remote.remote import remote_command
+from aws_ecs_remote.run_task import DEFAULT_IMAGE, prepare_run, run_bootstrap
+from aws_ecs_remote.task_definition import DEFAULT_CPU, DEFAULT_MEMORY
+from aws_ecs_remote.throttle import backoff_delay, is_transient_error
+from aws_ecs_remote.tracing import in_context
+
+try:
+    import cloudpickle
+except ImportError:
+    cloudpickle = None
+
+# Items per shard when neither submit nor map says otherwise
+DEFAULT_CHUNKSIZE = 16
+# Seconds submit waits for more calls before launching a partial shard
+LINGER_SEC = 0.5
+POLL_SEC = 5
+TRANSFER_WORKERS = 16
+# Consecutive failed manager passes (throttling, dropped connections) before
+# the executor gives up and breaks
+MANAGER_ATTEMPTS = 8
+SHARD_KEY_FORMAT = '{name}/shards/{shard:06d}.pkl'
+RESULT_KEY_FORMAT = '{name}/results/{shard:06d}.pkl'
+CLOUDPICKLE_EXTRAS = DEFAULT_EXTRAS + ('cloudpickle',)
+CLOUDPICKLE_BOOTSTRAP = pinned_bootstrap(extras=CLOUDPICKLE_EXTRAS)
+
+
+class BrokenECSExecutor(BrokenExecutor):
+    # The manager thread failed; pending futures fail with this and later
+    # submits raise it, like BrokenProcessPool
+    pass
+
+
+class RemoteTraceback(Exception):
+    # Set as __cause__ of exceptions raised in a task, like ProcessPoolExecutor
+
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class RemoteError(Exception):
+    # Stands in for a remote exception that could not be pickled
+    pass
+
+
+class RemoteTaskError(Exception):
+    # The task running a shard stopped or failed to launch without a result
+    pass
+
+
+def dumps(obj):
+    # cloudpickle sends functions defined in __main__ or interactively by value
+    if cloudpickle is not None:
+        return cloudpickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def shard_key(name, shard):
+    return SHARD_KEY_FORMAT.format(name=name, shard=shard)
+
+
+def result_key(name, shard):
+    return RESULT_KEY_FORMAT.format(name=name, shard=shard)
+
+
+def check_picklable(fn):
+    if cloudpickle is None and getattr(fn, '__module__', None) == '__main__':
+        raise ValueError(
+            "{} is defined in __main__ and cannot be imported in the task. "
+            "Move it to a module under src or install cloudpickle.".format(fn))
+
+
+def call_item(fn, args, kwargs):
+    try:
+        return True, fn(*args, **kwargs)
+    except Exception as e:
+        tb = traceback.format_exc()
+        try:
+            dumps(e)
+        except Exception:
+            e = RemoteError(repr(e))
+        return False, (e, tb)
+
+
+def dump_results(results):
+    try:
+        return dumps(results)
+    except Exception:
+        pass
+    # Keep the picklable results when some are not
+    safe = []
+    for ok, value in results:
+        try:
+            dumps(value)
+            safe.append((ok, value))
+        except Exception as e:
+            safe.append((False, (RemoteError("Could not pickle result: {!r}".format(e)), '')))
+    return dumps(safe)
+
+
+def run_shard(s3, bucket, shard, result):
+    # Task side: call every item of the shard and upload the results in order
+    items = pickle.loads(s3.get_object(Bucket=bucket, Key=shard)['Body'].read())
+    results = [call_item(fn, args, kwargs) for fn, args, kwargs in items]
+    s3.put_object(Bucket=bucket, Key=result, Body=dump_results(results))
+    print("Ran {} calls from s3://{}/{}".format(len(items), bucket, shard))
+
+
+def resolve_future(future, ok, value):
+    if ok:
+        future.set_result(value)
+    else:
+        e, tb = value
+        e.__cause__ = RemoteTraceback(tb)
+        future.set_exception(e)
+
+
+class ECSExecutor(Executor):
+    # Drop-in for ProcessPoolExecutor across ECS tasks. submit() buffers calls
+    # for up to linger_sec or chunksize calls per shard; map() shards its
+    # inputs by chunksize. At most max_workers tasks run at once (unlimited by
+    # default). The source under src (the working directory by default) is
+    # uploaded so functions import in the task as they do locally; functions
+    # from __main__ need cloudpickle. The image should run the same Python
+    # version as the caller. prepare_kwargs go to prepare_run.
+
+    def __init__(
+        self,
+        cluster,
+        src=None,
+        bucket=None,
+        profile=None,
+        image=DEFAULT_IMAGE,
+        cpu=DEFAULT_CPU,
+        memory=DEFAULT_MEMORY,
+        max_workers=None,
+        chunksize=DEFAULT_CHUNKSIZE,
+        linger_sec=LINGER_SEC,
+        poll_sec=POLL_SEC,
+        bootstrap=None,
+        capacity_provider_strategy=None,
+        base_name='executor',
+        session=None,
+        quiet=True,
+        **prepare_kwargs
+    ):
+        self.cluster = cluster
+        self.src = os.path.abspath(src or os.getcwd())
+        self.bucket = bucket
+        self.profile = profile
+        self.image = image
+        self.cpu = cpu
+        self.memory = memory
+        self.max_workers = max_workers
+        self.chunksize = chunksize
+        self.linger_sec = linger_sec
+        self.poll_sec = poll_sec
+        # None installs the package wheel prepare_run uploads
+        self.bootstrap = bootstrap
+        self.capacity_provider_strategy = capacity_provider_strategy
+        self.base_name = base_name
+        self.session = session
+        self.quiet = quiet
+        self.prepare_kwargs = prepare_kwargs
+        self.run = None
+        self.tracker = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # Calls from submit() not yet in a shard: (fn, args, kwargs, future)
+        self.buffer = []
+        self.buffer_since = None
+        # Shards waiting for a task slot, shards taken by a launch that failed
+        # and will be retried as (id, items), and shards running by id
+        self.pending = deque()
+        self.retry = deque()
+        self.running = {}
+        self.shard_ids = itertools.count()
+        self.shutdown_flag = False
+        self.broken = None
+        self.manager = None
+
+    def submit(self, fn, *args, **kwargs):
+        check_picklable(fn)
+        future = Future()
+        with self.lock:
+            self.check_open()
+            if not self.buffer:
+                self.buffer_since = time.monotonic()
+            self.buffer.append((fn, args, kwargs, future))
+            if len(self.buffer) >= self.chunksize:
+                self.flush_buffer()
+            self.start_manager()
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=None):
+        # Results in input order, like Executor.map; each shard of chunksize
+        # inputs runs in one task
+        check_picklable(fn)
+        chunksize = chunksize or self.chunksize
+        end_time = None if timeout is None else time.monotonic() + timeout
+        futures = []
+        with self.lock:
+            self.check_open()
+            items = []
+            for args in zip(*iterables):
+                future = Future()
+                futures.append(future)
+                items.append((fn, args, {}, future))
+                if len(items) == chunksize:
+                    self.pending.append(items)
+                    items = []
+            if items:
+                self.pending.append(items)
+            self.start_manager()
+        self.wakeup.set()
+
+        def results():
+            try:
+                futures.reverse()
+                while futures:
+                    if end_time is None:
+                        yield futures.pop().result()
+                    else:
+                        yield futures.pop().result(end_time - time.monotonic())
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return results()
+
+    def check_open(self):
+        # Called with the lock held
+        if self.broken is not None:
+            raise BrokenECSExecutor(self.broken)
+        if self.shutdown_flag:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.lock:
+            self.shutdown_flag = True
+            if cancel_futures:
+                for items in [self.buffer] + list(self.pending):
+                    for item in items:
+                        item[3].cancel()
+                self.buffer = []
+                self.pending.clear()
+            else:
+                self.flush_buffer()
+            manager = self.manager
+        self.wakeup.set()
+        if wait and manager is not None:
+            manager.join()
+
+    def flush_buffer(self):
+        # Called with the lock held
+        if self.buffer:
+            self.pending.append(self.buffer)
+            self.buffer = []
+            self.wakeup.set()
+
+    def start_manager(self):
+        # Called with the lock held
+        if self.manager is None:
+            self.manager = threading.Thread(target=in_context(self.manage), name='ECSExecutor', daemon=True)
+            self.manager.start()
+
+    def manage(self):
+        # Launches shards as slots free up and resolves finished ones.
+        # Transient AWS errors are retried with backoff; anything else, or
+        # MANAGER_ATTEMPTS failures in a row, breaks the executor.
+        failures = 0
+        try:
+            while True:
+                with self.lock:
+                    if self.buffer and time.monotonic() - self.buffer_since >= self.linger_sec:
+                        self.flush_buffer()
+                    idle = not self.buffer and not self.pending and not self.retry and not self.running
+                    if idle and self.shutdown_flag:
+                        return
+                try:
+                    if self.pending or self.retry:
+                        self.launch_pending()
+                    if self.running:
+                        self.collect()
+                    failures = 0
+                    timeout = self.poll_sec if self.running else self.linger_sec
+                except (ClientError, BotoCoreError) as e:
+                    failures += 1
+                    if not is_transient_error(e) or failures >= MANAGER_ATTEMPTS:
+                        raise e
+                    if not self.quiet:
+                        print("Retrying after AWS error in executor: {}".format(e))
+                    timeout = backoff_delay(failures - 1)
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
+        except BaseException as e:
+            broken = BrokenECSExecutor("ECSExecutor manager failed: {!r}".format(e))
+            broken.__cause__ = e
+            with self.lock:
+                self.broken = broken
+            self.fail_all(broken)
+
+    def fail_all(self, e):
+        with self.lock:
+            shards = list(self.pending) + [items for _, items in self.retry]
+            shards += [shard['items'] for shard in self.running.values()] + [self.buffer]
+            self.pending.clear()
+            self.retry.clear()
+            self.running = {}
+            self.buffer = []
+        for items in shards:
+            for item in items:
+                if not item[3].done():
+                    item[3].set_exception(e)
+
+    def prepare(self):
+        prepare_kwargs = dict(self.prepare_kwargs)
+        if cloudpickle is not None:
+            prepare_kwargs.setdefault('package_extras', CLOUDPICKLE_EXTRAS)
+        self.run = prepare_run(
+            cluster=self.cluster,
+            script=None,
+            bucket=self.bucket,
+            src=self.src,
+            profile=self.profile,
+            base_name=self.base_name,
+            image=self.image,
+            cpu=self.cpu,
+            memory=self.memory,
+            session=self.session,
+            quiet=self.quiet,
+            **prepare_kwargs
+        )
+        self.tracker = FleetTracker(
+            ecs=self.run['ecs'],
+            cluster=self.run['cluster'],
+            task_arns=[],
+            poll_sec=self.poll_sec
+        )
+
+    def take_pending(self):
+        slots = len(self.retry) + len(self.pending)
+        if self.max_workers is not None:
+            slots = min(slots, self.max_workers - len(self.running))
+        shards = []
+        with self.lock:
+            while len(shards) < slots and self.retry:
+                shards.append(self.retry.popleft())
+            while len(shards) < slots and self.pending:
+                items = [item for item in self.pending.popleft() if item[3].set_running_or_notify_cancel()]
+                if items:
+                    shards.append((next(self.shard_ids), items))
+        return shards
+
+    def launch_pending(self):
+        if self.run is None:
+            self.prepare()
+        shards = self.take_pending()
+        if not shards:
+            return
+        name = self.run['name']
+        s3 = self.run['s3']
+
+        def upload(shard):
+            shard_id, items = shard
+            body = dumps([(fn, args, kwargs) for fn, args, kwargs, _ in items])
+            s3.put_object(Bucket=self.run['bucket'], Key=shard_key(name, shard_id), Body=body)
+
+        launched = []
+        handled = set()
+        try:
+            with ThreadPoolExecutor(max_workers=TRANSFER_WORKERS) as executor:
+                list(executor.map(upload, shards))
+            commands = [
+                remote_command(
+                    bucket=self.run['bucket'],
+                    src_key=self.run['src_key'],
+                    script=None,
+                    output_prefix=output_prefix(name, index=shard_id),
+                    bootstrap=run_bootstrap(self.run, self.bootstrap),
+                    shard_key=shard_key(name, shard_id),
+                    result_key=result_key(name, shard_id)
+                )
+                for shard_id, _ in shards
+            ]
+            for i, task, failure in ecs_run_tasks(
+                    ecs=self.run['ecs'],
+                    cluster=self.run['cluster'],
+                    task_definition=self.run['task_definition']['taskDefinitionArn'],
+                    commands=commands,
+                    subnets=self.run['subnets'],
+                    security_groups=self.run['security_groups'],
+                    capacity_provider_strategy=self.capacity_provider_strategy):
+                handled.add(i)
+                shard_id, items = shards[i]
+                if task is None:
+                    error = RemoteTaskError("Shard {} failed to launch: {}".format(shard_id, failure.get('reason')))
+                    for item in items:
+                        item[3].set_exception(error)
+                    continue
+                with self.lock:
+                    self.running[shard_id] = {'items': items, 'task_arn': task['taskArn']}
+                launched.append(task['taskArn'])
+        except BaseException:
+            # Shards without a launch outcome go back first for the next pass
+            with self.lock:
+                self.retry.extendleft(reversed([shard for i, shard in enumerate(shards) if i not in handled]))
+            raise
+        finally:
+            self.tracker.add(launched)
+        if not self.quiet:
+            print("Launched {} shards ({} running)".format(len(launched), len(self.running)))
+
+    def fetch_result(self, shard_id):
+        # Resolves the shard's futures if its result is in S3
+        try:
+            response = self.run['s3'].get_object(
+                Bucket=self.run['bucket'], Key=result_key(self.run['name'], shard_id))
+        except ClientError as e:
+            if is_boto_exception(e, 'NoSuchKey'):
+                return False
+            raise e
+        results = pickle.loads(response['Body'].read())
+        with self.lock:
+            shard = self.running.pop(shard_id, None)
+        if shard is not None:
+            for item, (ok, value) in zip(shard['items'], results):
+                resolve_future(item[3], ok, value)
+        return True
+
+    def list_results(self):
+        # Result keys are numbered, so listing starts after every shard that
+        # has already resolved
+        with self.lock:
+            shard_ids = sorted(self.running)
+        if not shard_ids:
+            return []
+        prefix = result_key(self.run['name'], 0).rsplit('/', 1)[0] + '/'
+        paginator = self.run['s3'].get_paginator('list_objects_v2')
+        kwargs = {'Bucket': self.run['bucket'], 'Prefix': prefix}
+        if shard_ids[0] > 0:
+            kwargs['StartAfter'] = result_key(self.run['name'], shard_ids[0] - 1)
+        keys = set()
+        for page in paginator.paginate(**kwargs):
+            keys.update(obj['Key'] for obj in page.get('Contents', []))
+        return [shard_id for shard_id in shard_ids if result_key(self.run['name'], shard_id) in keys]
+
+    def collect(self):
+        with ThreadPoolExecutor(max_workers=TRANSFER_WORKERS) as executor:
+            list(executor.map(self.fetch_result, self.list_results()))
+            stopped = self.tracker.poll()
+            # A stopped task has uploaded its result if it ever will
+            with self.lock:
+                by_arn = dict((shard['task_arn'], shard_id) for shard_id, shard in self.running.items())
+            missing = [
+                (by_arn[task['taskArn']], task) for task in stopped
+                if task['taskArn'] in by_arn
+            ]
+            failed = list(self.tracker.failed.items())
+            missing.extend(
+                (by_arn[arn], failure) for arn, failure in failed
+                if arn in by_arn
+            )
+            self.tracker.forget([task['taskArn'] for task in stopped] + [arn for arn, _ in failed])
+            found = list(executor.map(lambda shard: self.fetch_result(shard[0]), missing))
+        for (shard_id, task), ok in zip(missing, found):
+            if ok:
+                continue
+            with self.lock:
+                shard = self.running.pop(shard_id, None)
+            if shard is None:
+                continue
+            error = RemoteTaskError("Task {} for shard {} stopped without a result: {}".format(
+                shard['task_arn'], shard_id, task.get('stoppedReason', task.get('reason'))))
+            for item in shard['items']:
+                item[3].set_exception(error)
+
+
+def main(argv=None):
+    # Entry point for remote.py --shard
+    parser = argparse.ArgumentParser(prog='aws_ecs_remote.executor')
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--shard', required=True)
+    parser.add_argument('--result', required=True)
+    args = parser.parse_args(argv)
+    run_shard(s3=get_client('s3'), bucket=args.bucket, shard=args.shard, result=args.result)
+    return 0
+
+
+if __name__ == '__main__':
+    # Import by name so exceptions pickle as aws_ecs_remote.executor, not __main__
+    from aws_ecs_remote.executor import main as executor_main
+    sys.exit(executor_main())
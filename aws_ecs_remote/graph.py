@@ -0,0 +1,52 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from aws_ecs_remote.tracing import in_context, span
+
+
+class TaskGraph:
+    # Runs named steps on a thread pool as soon as their dependencies finish.
+    # Each step is called with its dependencies' results as keyword arguments.
+
+    def __init__(self):
+        self.nodes = {}
+
+    def add(self, name, fn, deps=()):
+        if name in self.nodes:
+            raise ValueError("Duplicate step [{}]".format(name))
+        self.nodes[name] = (fn, tuple(deps))
+
+    def validate(self):
+        for name, (_, deps) in self.nodes.items():
+            for dep in deps:
+                if dep not in self.nodes:
+                    raise ValueError("Step [{}] depends on unknown step [{}]".format(name, dep))
+
+    @staticmethod
+    def run_step(name, fn, kwargs):
+        with span('step.{}'.format(name)):
+            return fn(**kwargs)
+
+    def run(self, max_workers=None):
+        self.validate()
+        results = {}
+        remaining = dict(self.nodes)
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=max_workers or max(len(self.nodes), 1))
+        try:
+            while remaining or running:
+                ready = [
+                    name for name, (_, deps) in remaining.items()
+                    if all(dep in results for dep in deps)
+                ]
+                for name in ready:
+                    fn, deps = remaining.pop(name)
+                    future = executor.submit(in_context(self.run_step), name, fn, {dep: results[dep] for dep in deps})
+                    running[future] = name
+                if not running:
+                    raise ValueError("Dependency cycle between steps {}".format(sorted(remaining)))
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return results
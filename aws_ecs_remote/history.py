@@ -0,0 +1,260 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_ecs_remote.remote import USAGE_FILE
+from aws_ecs_remote.state import state_path
+from aws_ecs_remote.task_definition import DEFAULT_CPU, DEFAULT_MEMORY
+from aws_ecs_remote.tracing import timestamp_seconds
+
+HISTORY_FILE = 'runs.jsonl'
+# Only the most recent runs of a job inform its size
+HISTORY_WINDOW = 20
+# Requested size over the observed peak
+HEADROOM = 1.25
+# Memory multiplier after an out-of-memory kill
+OOM_STEP = 2
+# A run within this many vCPUs of its allocation counts as CPU-bound
+SATURATION_SLACK = 0.1
+OOM_REASONS = ('OutOfMemory', 'OOM')
+# us-east-1 on-demand Fargate prices; only the ratio matters for ranking sizes
+VCPU_HOUR_PRICE = 0.04048
+GB_HOUR_PRICE = 0.004445
+
+
+def memory_steps(start, stop, step):
+    return list(range(start, stop + 1, step))
+
+
+# https://docs.aws.amazon.com/AmazonECS/latest/developerguide/task_definition_parameters.html#task_size
+FARGATE_SIZES = {
+    256: [512, 1024, 2048],
+    512: memory_steps(1024, 4096, 1024),
+    1024: memory_steps(2048, 8192, 1024),
+    2048: memory_steps(4096, 16384, 1024),
+    4096: memory_steps(8192, 30720, 1024),
+    8192: memory_steps(16384, 61440, 4096),
+    16384: memory_steps(32768, 122880, 8192),
+}
+
+
+def size_cost(cpu, memory):
+    return cpu / 1024 * VCPU_HOUR_PRICE + memory / 1024 * GB_HOUR_PRICE
+
+
+def fargate_sizes():
+    # Every valid (cpu, memory) pair, cheapest first
+    sizes = [(cpu, memory) for cpu, memories in FARGATE_SIZES.items() for memory in memories]
+    return sorted(sizes, key=lambda size: (size_cost(*size), size))
+
+
+def smallest_size(min_cpu=0, min_memory=0):
+    # Cheapest valid size with at least min_cpu units and min_memory MiB, or
+    # the largest size if nothing is big enough
+    sizes = fargate_sizes()
+    for cpu, memory in sizes:
+        if cpu >= min_cpu and memory >= min_memory:
+            return cpu, memory
+    return max(sizes)
+
+
+def args_signature(args):
+    # Shape of the arguments, not their values, so every task of a sweep is
+    # the same job
+    if args is None:
+        return 'none'
+    if isinstance(args, dict):
+        return 'dict:' + ','.join(sorted(str(key) for key in args))
+    if isinstance(args, (list, tuple)):
+        return 'list:{}'.format(len(args))
+    return type(args).__name__
+
+
+def job_key(script, args=None):
+    signature = hashlib.sha256(args_signature(args).encode('utf-8')).hexdigest()[:16]
+    return '{}:{}'.format(os.path.abspath(script), signature)
+
+
+def is_oom(task, usage=None):
+    if usage is not None and usage.get('oom'):
+        return True
+    reasons = [task.get('stoppedReason', '')]
+    reasons.extend(container.get('reason', '') for container in task.get('containers', []))
+    return any(oom in reason for reason in reasons for oom in OOM_REASONS)
+
+
+def task_exit_code(task):
+    codes = [container.get('exitCode') for container in task.get('containers', [])]
+    codes = [code for code in codes if code is not None]
+    if not codes:
+        return None
+    return max(codes, key=abs)
+
+
+def task_seconds(task):
+    # Datetimes from DescribeTasks or ISO strings from task state events
+    started = timestamp_seconds(task.get('startedAt'))
+    stopped = timestamp_seconds(task.get('stoppedAt'))
+    if started is None or stopped is None:
+        return None
+    return stopped - started
+
+
+def cpu_utilisation(entry):
+    return entry['cpu_seconds'] / entry['seconds']
+
+
+def is_cpu_bound(entry):
+    return cpu_utilisation(entry) >= entry['cpu'] / 1024 - SATURATION_SLACK
+
+
+def observed_parallelism(entry):
+    # vCPUs a run kept busy while it had more to spare; None for a CPU-bound
+    # run, which might have used more
+    if is_cpu_bound(entry):
+        return None
+    return max(1, math.ceil(cpu_utilisation(entry) - SATURATION_SLACK))
+
+
+def read_usage(s3, bucket, output):
+    # Usage reported by remote.py next to the task's outputs; None when the
+    # container was killed before it could upload
+    try:
+        body = s3.get_object(Bucket=bucket, Key=output + USAGE_FILE)['Body'].read()
+    except ClientError:
+        return None
+    return json.loads(body.decode('utf-8'))
+
+
+class RunHistory:
+    # Append-only record of finished runs per job (script plus args signature):
+    # requested size, wall-clock time, exit status and the peak usage the
+    # container reported
+
+    def __init__(self, path=None):
+        self.path = path or state_path('history', HISTORY_FILE)
+        self.lock = threading.Lock()
+
+    def record(self, job, cpu, memory, seconds, exit_code, oom=False, peak_memory_mb=None, cpu_seconds=None):
+        entry = {
+            'job': job,
+            'time': time.time(),
+            'cpu': int(cpu),
+            'memory': int(memory),
+            'seconds': seconds,
+            'exit_code': exit_code,
+            'oom': oom,
+            'peak_memory_mb': peak_memory_mb,
+            'cpu_seconds': cpu_seconds
+        }
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        return entry
+
+    def record_task(self, job, task, cpu, memory, usage=None):
+        usage = usage or {}
+        seconds = usage.get('seconds')
+        if seconds is None:
+            seconds = task_seconds(task)
+        exit_code = task_exit_code(task)
+        if exit_code is None:
+            exit_code = usage.get('returncode')
+        return self.record(
+            job=job,
+            cpu=cpu,
+            memory=memory,
+            seconds=seconds,
+            exit_code=exit_code,
+            oom=is_oom(task, usage),
+            peak_memory_mb=usage.get('peak_memory_mb'),
+            cpu_seconds=usage.get('cpu_seconds')
+        )
+
+    def records(self, job, limit=HISTORY_WINDOW):
+        entries = []
+        with self.lock:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        if entry.get('job') == job:
+                            entries.append(entry)
+            except FileNotFoundError:
+                pass
+        if limit:
+            entries = entries[-limit:]
+        return entries
+
+
+class SizingAdvisor:
+    # Picks a task size from a job's history: the cheapest valid Fargate size
+    # covering peak memory with headroom and enough CPU to finish within
+    # target_seconds (or to cover the observed CPU use without a target).
+    # After an out-of-memory kill the memory steps up by oom_step.
+
+    def __init__(self, history, target_seconds=None, headroom=HEADROOM, oom_step=OOM_STEP,
+                 window=HISTORY_WINDOW):
+        self.history = history
+        self.target_seconds = target_seconds
+        self.headroom = headroom
+        self.oom_step = oom_step
+        self.window = window
+
+    def required_cpu(self, succeeded):
+        # Headroom only applies below the allocation: a CPU-bound run asks for
+        # its allocation again (or what target_seconds needs). Never more than
+        # the parallelism a run with spare vCPUs showed, so a single-threaded
+        # job does not ratchet up.
+        measured = [entry for entry in succeeded if entry.get('cpu_seconds') and entry.get('seconds')]
+        if not measured:
+            return min(entry['cpu'] for entry in succeeded)
+        if self.target_seconds:
+            vcpus = max(entry['cpu_seconds'] for entry in measured) / self.target_seconds * self.headroom
+        else:
+            vcpus = max(
+                entry['cpu'] / 1024 if is_cpu_bound(entry) else cpu_utilisation(entry) * self.headroom
+                for entry in measured
+            )
+        parallelism = [observed_parallelism(entry) for entry in measured]
+        parallelism = [vcpus for vcpus in parallelism if vcpus is not None]
+        if parallelism:
+            vcpus = min(vcpus, min(parallelism))
+        return vcpus * 1024
+
+    def required_memory(self, succeeded):
+        measured = [entry['peak_memory_mb'] for entry in succeeded if entry.get('peak_memory_mb')]
+        if not measured:
+            return min(entry['memory'] for entry in succeeded)
+        return max(measured) * self.headroom
+
+    def advise(self, job, cpu=DEFAULT_CPU, memory=DEFAULT_MEMORY):
+        # Returns (cpu, memory); the given size when there is nothing to go on
+        entries = self.history.records(job, limit=self.window)
+        if not entries:
+            return cpu, memory
+        killed = [entry for entry in entries if entry['oom']]
+        succeeded = [entry for entry in entries if not entry['oom'] and entry['exit_code'] == 0]
+        min_cpu = 0
+        min_memory = 0
+        if killed:
+            # Never go back to a size that ran out of memory
+            min_memory = max(entry['memory'] for entry in killed) + 1
+            if entries[-1]['oom']:
+                min_memory = max(min_memory, entries[-1]['memory'] * self.oom_step)
+        if succeeded:
+            min_cpu = self.required_cpu(succeeded)
+            min_memory = max(min_memory, self.required_memory(succeeded))
+        elif killed:
+            min_cpu = max(entry['cpu'] for entry in killed)
+        else:
+            return cpu, memory
+        return smallest_size(min_cpu=min_cpu, min_memory=min_memory)
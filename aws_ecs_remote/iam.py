@@ -1,11 +1,10 @@
+import hashlib
+import json
+
 from botocore.exceptions import ClientError
 from aws_ecs_remote.boto import is_boto_exception
 
-TASK_ROLE_NAME = 'aws-ecs-remote-task-role'
-TASK_ROLE = {
-    'description': 'Role for tasks running in containers',
-    'policies': ['arn:aws:iam::aws:policy/service-role/AmazonECSTaskExecutionRolePolicy'],
-    'trust': """
+ECS_TASKS_TRUST = """
 {
   "Version": "2008-10-17",
   "Statement": [
@@ -20,6 +19,24 @@ TASK_ROLE = {
   ]
 }
 """
+EXECUTION_ROLE_POLICY = 'arn:aws:iam::aws:policy/service-role/AmazonECSTaskExecutionRolePolicy'
+TASK_ROLE_NAME = 'aws-ecs-remote-task-role'
+TASK_ROLE = {
+    'description': 'Role for tasks running in containers',
+    # Bucket access is granted per run bucket by an inline policy (see bucket_policy)
+    'policies': [],
+    # Attached by earlier versions; detached when the role is reconciled
+    'retired': [
+        EXECUTION_ROLE_POLICY,
+        'arn:aws:iam::aws:policy/AmazonS3FullAccess'
+    ],
+    'trust': ECS_TASKS_TRUST
+}
+EXECUTION_ROLE_NAME = 'aws-ecs-remote-execution-role'
+EXECUTION_ROLE = {
+    'description': 'Role ECS uses to pull images and write logs for tasks',
+    'policies': [EXECUTION_ROLE_POLICY],
+    'trust': ECS_TASKS_TRUST
 }
 INSTANCE_ROLE_NAME = 'aws-ecs-remote-instance-role'
 INSTANCE_ROLE = {
@@ -55,6 +72,57 @@ def get_role(iam, role_name):
             raise e
 
 
+def bucket_policy_name(bucket):
+    return 'aws-ecs-remote-bucket-{}'.format(bucket)
+
+
+def bucket_policy(bucket):
+    # Tasks fetch source and args from, and write outputs to, the run bucket
+    return json.dumps({
+        'Version': '2012-10-17',
+        'Statement': [
+            {
+                'Effect': 'Allow',
+                'Action': [
+                    's3:GetObject',
+                    's3:PutObject',
+                    's3:AbortMultipartUpload',
+                    's3:ListMultipartUploadParts'
+                ],
+                'Resource': 'arn:aws:s3:::{}/*'.format(bucket)
+            },
+            {
+                # Without it a missing key is a 403 instead of a 404
+                'Effect': 'Allow',
+                'Action': 's3:ListBucket',
+                'Resource': 'arn:aws:s3:::{}'.format(bucket)
+            }
+        ]
+    }, sort_keys=True)
+
+
+def attached_policies(iam, role_name):
+    policies = []
+    for page in iam.get_paginator('list_attached_role_policies').paginate(RoleName=role_name):
+        policies.extend(policy['PolicyArn'] for policy in page['AttachedPolicies'])
+    return policies
+
+
+def reconcile_role(iam, role_name, policies, retired=(), inline_policies=None):
+    # Brings an existing role to the wanted policies: attaches what is
+    # missing, detaches retired policies and (re)writes inline policies.
+    # Policies attached by anyone else are left alone.
+    attached = set(attached_policies(iam=iam, role_name=role_name))
+    for policy in policies:
+        if policy not in attached:
+            iam.attach_role_policy(RoleName=role_name, PolicyArn=policy)
+    for policy in retired:
+        if policy in attached and policy not in policies:
+            iam.detach_role_policy(RoleName=role_name, PolicyArn=policy)
+    for policy_name, document in sorted((inline_policies or {}).items()):
+        iam.put_role_policy(RoleName=role_name, PolicyName=policy_name, PolicyDocument=document)
+
+
 def create_role(iam, role_name, description, policies, trust):
     response = iam.create_role(
         # Path='string',
@@ -79,7 +147,19 @@ def create_role(iam, role_name, description, policies, trust):
     return role
 
 
-def ensure_role(iam, role_name, description, policies, trust):
+def role_digest(policies, inline_policies=None):
+    state = json.dumps({'policies': sorted(policies), 'inline': inline_policies or {}}, sort_keys=True)
+    return hashlib.sha256(state.encode('utf-8')).hexdigest()[:16]
+
+
+def ensure_role(iam, role_name, description, policies, trust, retired=(), inline_policies=None, cache=None):
+    # The cache key covers the wanted policies, so a role is reconciled once
+    # per policy change (or cache expiry) rather than only when created
+    key = 'role:{}:{}'.format(role_name, role_digest(policies, inline_policies))
+    if cache is not None:
+        role = cache.get(key)
+        if role is not None:
+            return role
     role = get_role(iam=iam, role_name=role_name)
     if role is None:
         role = create_role(
@@ -89,19 +169,50 @@ def ensure_role(iam, role_name, description, policies, trust):
             policies=policies,
             trust=trust
         )
+    reconcile_role(
+        iam=iam,
+        role_name=role_name,
+        policies=policies,
+        retired=retired,
+        inline_policies=inline_policies
+    )
+    if cache is not None:
+        cache.put(key, {
+            'RoleName': role['RoleName'],
+            'Arn': role['Arn']
+        })
     return role
 
-def ensure_task_role(iam, role_name=TASK_ROLE_NAME):
-    return ensure_role(iam=iam, role_name=role_name, **TASK_ROLE)
-def ensure_instance_role(iam, role_name=INSTANCE_ROLE_NAME):
-    return ensure_role(iam=iam, role_name=role_name, **INSTANCE_ROLE)
+
+def ensure_task_role(iam, bucket, role_name=TASK_ROLE_NAME, cache=None):
+    # One role for every run; each run bucket adds its own inline policy
+    return ensure_role(
+        iam=iam,
+        role_name=role_name,
+        inline_policies={bucket_policy_name(bucket): bucket_policy(bucket)},
+        cache=cache,
+        **TASK_ROLE
+    )
+
+
+def ensure_execution_role(iam, role_name=EXECUTION_ROLE_NAME, cache=None):
+    return ensure_role(iam=iam, role_name=role_name, cache=cache, **EXECUTION_ROLE)
+
+
+def ensure_instance_role(iam, role_name=INSTANCE_ROLE_NAME, cache=None):
+    return ensure_role(iam=iam, role_name=role_name, cache=cache, **INSTANCE_ROLE)
 
 
 if __name__ == '__main__':
-    import boto3
-    session = boto3.Session()
-    iam = session.client('iam')
-    task_role = ensure_task_role(iam=iam)
+    from aws_ecs_remote.clients import get_client
+    from aws_ecs_remote.bucket import default_bucket_name
+    from aws_ecs_remote.clients import get_session
+    iam = get_client('iam')
+    session = get_session()
+    account = get_client('sts').get_caller_identity().get('Account')
+    task_role = ensure_task_role(iam=iam, bucket=default_bucket_name(region=session.region_name, account=account))
+    execution_role = ensure_execution_role(iam=iam)
     instance_role = ensure_instance_role(iam=iam)
     print("task_role: {}".format(task_role))
+    print("execution_role: {}".format(execution_role))
     print("instance_role: {}".format(instance_role))
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import time
+
+from aws_ecs_remote.state import path_key, read_json, state_path, write_json
+
+INDEX_VERSION = 1
+HASH_ALGORITHM = 'sha256'
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files modified this recently may change again within the same mtime tick
+# after hashing, so their digests are not trusted on the next run (git calls
+# these "racily clean")
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+
+def hash_file(path, algorithm=HASH_ALGORITHM, chunk_size=HASH_CHUNK_SIZE):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileIndex:
+    # Maps relative path -> [size, mtime_ns, inode, digest] for one source root,
+    # so only files whose stat changed are read and hashed again
+
+    def __init__(self, root, path, algorithm=HASH_ALGORITHM):
+        self.root = os.path.abspath(root)
+        self.path = path
+        self.algorithm = algorithm
+        self.entries = {}
+        self.dirty = False
+        self.hashed = 0
+        self.load()
+
+    @classmethod
+    def for_root(cls, root, algorithm=HASH_ALGORITHM):
+        return cls(
+            root=root,
+            path=state_path('index', '{}.json'.format(path_key(root))),
+            algorithm=algorithm
+        )
+
+    def load(self):
+        data = read_json(self.path)
+        if (
+                data
+                and data.get('version') == INDEX_VERSION
+                and data.get('root') == self.root
+                and data.get('algorithm') == self.algorithm):
+            self.entries = data['entries']
+
+    def stat_digest(self, rel_path):
+        full_path = os.path.join(self.root, rel_path)
+        st = os.stat(full_path)
+        key = [st.st_size, st.st_mtime_ns, st.st_ino]
+        entry = self.entries.get(rel_path)
+        if entry is not None and entry[:3] == key:
+            return st, entry[3]
+        digest = hash_file(full_path, algorithm=self.algorithm)
+        self.hashed += 1
+        if time.time_ns() - st.st_mtime_ns > RACY_WINDOW_NS:
+            self.entries[rel_path] = key + [digest]
+            self.dirty = True
+        elif rel_path in self.entries:
+            del self.entries[rel_path]
+            self.dirty = True
+        return st, digest
+
+    def prune(self, rel_paths):
+        keep = set(rel_paths)
+        for rel_path in list(self.entries):
+            if rel_path not in keep:
+                del self.entries[rel_path]
+                self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        write_json(self.path, {
+            'version': INDEX_VERSION,
+            'root': self.root,
+            'algorithm': self.algorithm,
+            'entries': self.entries
+        })
+        self.dirty = False
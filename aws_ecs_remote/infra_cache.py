@@ -0,0 +1,78 @@
+import threading
+import time
+
+from aws_ecs_remote.state import read_json, state_path, write_json
+
+INFRA_TTL = 24 * 60 * 60
+# Launch errors that mean a cached resource was deleted or changed, as
+# (error code, message fragment). The generic codes also cover malformed
+# requests, which resolving again would not fix, so only these messages count.
+STALE_INFRA_ERRORS = (
+    ('ClusterNotFoundException', ''),
+    ('ClientException', 'TaskDefinition is inactive'),
+    ('InvalidParameterException', 'Error retrieving security group information'),
+    ('InvalidParameterException', 'Error retrieving subnet information'),
+    ('InvalidParameterException', 'InvalidGroup.NotFound'),
+    ('InvalidParameterException', 'InvalidSubnetID.NotFound'),
+)
+
+
+def is_stale_infra_error(e):
+    error = getattr(e, 'response', None) or {}
+    error = error.get('Error', {})
+    code = error.get('Code')
+    message = (error.get('Message') or '').lower()
+    return any(code == stale_code and fragment.lower() in message for stale_code, fragment in STALE_INFRA_ERRORS)
+
+
+def is_stale_infra_failure(failure):
+    # Failed launches from ecs.ecs_run_tasks carry the ClientError text as reason
+    reason = (failure.get('reason') or '').lower()
+    return any(
+        '({})'.format(stale_code).lower() in reason and fragment.lower() in reason
+        for stale_code, fragment in STALE_INFRA_ERRORS
+    )
+
+
+class InfraCache:
+    # Resolved infrastructure (cluster, roles, network, task definitions) for
+    # one profile/account/region, so warm runs skip the describe calls
+
+    def __init__(self, path, ttl=INFRA_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = read_json(path, default={})
+
+    @classmethod
+    def for_account(cls, profile, account, region, ttl=INFRA_TTL):
+        return cls(
+            path=state_path('infra', '{}-{}-{}.json'.format(profile or 'default', account, region)),
+            ttl=ttl
+        )
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        # Entries for immutable resources are stored with expires=False
+        if entry.get('expires', True) and time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['value']
+
+    def put(self, key, value, expires=True):
+        with self.lock:
+            entry = {'time': time.time(), 'value': value}
+            if not expires:
+                entry['expires'] = False
+            self.entries[key] = entry
+            write_json(self.path, self.entries)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries = {}
+            else:
+                self.entries.pop(key, None)
+            write_json(self.path, self.entries)
@@ -0,0 +1,203 @@
+import bisect
+import threading
+import time
+
+METRIC_NAME = 'aws_ecs_remote_api_call_seconds'
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+THROTTLE_ERRORS = (
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'SlowDown',
+    'LimitExceededException',
+)
+CONTEXT_KEY = 'aws_ecs_remote_start'
+
+
+class OperationStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.latency_sum = 0.
+        self.latency_max = 0.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, latency):
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'latency_sum': self.latency_sum,
+            'latency_max': self.latency_max,
+            'latency_buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], self.buckets))
+        }
+
+
+def error_code(parsed):
+    if not isinstance(parsed, dict):
+        return None
+    return parsed.get('Error', {}).get('Code')
+
+
+class ApiMetrics:
+    # Counts AWS API calls per (service, operation) from botocore events:
+    # calls, errors, latency histogram, retried attempts and throttled
+    # attempts. Latency covers the whole call, retries included.
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.registered = []
+        # Each instance keeps its own start time in the request context, so
+        # several ApiMetrics on one client do not take each other's
+        self.context_key = '{}-{}'.format(CONTEXT_KEY, id(self))
+
+    def operation(self, model):
+        return self.operation_stats((model.service_model.service_name, model.name))
+
+    def operation_stats(self, key):
+        stats = self.stats.get(key)
+        if stats is None:
+            with self.lock:
+                stats = self.stats.setdefault(key, OperationStats())
+        return stats
+
+    def before_call(self, model, context, **kwargs):
+        # before-parameter-build: unlike before-call, no handler (such as a
+        # Stubber) can short-circuit it
+        context[self.context_key] = (time.monotonic(), (model.service_model.service_name, model.name))
+
+    def after_call(self, model, context, parsed=None, **kwargs):
+        start, _ = context.pop(self.context_key, (None, None))
+        stats = self.operation(model)
+        metadata = parsed.get('ResponseMetadata', {}) if isinstance(parsed, dict) else {}
+        with self.lock:
+            stats.calls += 1
+            stats.retries += metadata.get('RetryAttempts', 0)
+            if error_code(parsed):
+                stats.errors += 1
+            if start is not None:
+                stats.observe(time.monotonic() - start)
+
+    def after_call_error(self, context, **kwargs):
+        # Connection errors and the like: no parsed response and no model,
+        # so the operation comes from before_call
+        start, key = context.pop(self.context_key, (None, None))
+        if key is None:
+            return
+        stats = self.operation_stats(key)
+        with self.lock:
+            stats.calls += 1
+            stats.errors += 1
+            stats.observe(time.monotonic() - start)
+
+    def needs_retry(self, operation, response=None, caught_exception=None, **kwargs):
+        # Seen once per attempt; observes only, so it returns None
+        if response is None:
+            return None
+        code = error_code(response[1])
+        if code in THROTTLE_ERRORS:
+            stats = self.operation(operation)
+            with self.lock:
+                stats.throttles += 1
+        return None
+
+    def handlers(self):
+        # unique_id per instance: registering twice is a no-op. Handlers see
+        # every call on the client, so a run counting its calls gives them a
+        # client of its own (see prepare_run).
+        prefix = 'aws-ecs-remote-metrics-{}'.format(id(self))
+        return [
+            ('before-parameter-build', self.before_call, prefix + '-before'),
+            ('after-call', self.after_call, prefix + '-after'),
+            ('after-call-error', self.after_call_error, prefix + '-error'),
+            ('needs-retry', self.needs_retry, prefix + '-retry'),
+        ]
+
+    def register(self, events):
+        for event_name, handler, unique_id in self.handlers():
+            events.register(event_name, handler, unique_id=unique_id)
+        if events not in self.registered:
+            self.registered.append(events)
+
+    def detach(self):
+        # Stop counting on every session and client this was registered on
+        for events in self.registered:
+            for event_name, handler, unique_id in self.handlers():
+                events.unregister(event_name, handler, unique_id=unique_id)
+        self.registered = []
+
+    def instrument_session(self, session):
+        # Clients created from the boto3 session afterwards are counted
+        self.register(session.events)
+        return session
+
+    def instrument_client(self, client):
+        self.register(client.meta.events)
+        return client
+
+    def summary(self):
+        with self.lock:
+            return {
+                '{}.{}'.format(service, operation): stats.to_dict()
+                for (service, operation), stats in sorted(self.stats.items())
+            }
+
+    def totals(self):
+        totals = {'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0}
+        for stats in self.summary().values():
+            for key in totals:
+                totals[key] += stats[key]
+        return totals
+
+    def format_summary(self):
+        lines = ['{:<40} {:>7} {:>7} {:>7} {:>9} {:>9} {:>9}'.format(
+            'operation', 'calls', 'retries', 'throttle', 'errors', 'avg ms', 'max ms')]
+        for name, stats in self.summary().items():
+            avg = stats['latency_sum'] / stats['calls'] if stats['calls'] else 0.
+            lines.append('{:<40} {:>7} {:>7} {:>7} {:>9} {:>9.1f} {:>9.1f}'.format(
+                name, stats['calls'], stats['retries'], stats['throttles'], stats['errors'],
+                avg * 1000, stats['latency_max'] * 1000))
+        return '\n'.join(lines)
+
+    def print_summary(self):
+        print(self.format_summary())
+
+    def prometheus(self):
+        lines = [
+            '# HELP {} Latency of AWS API calls made by aws-ecs-remote'.format(METRIC_NAME),
+            '# TYPE {} histogram'.format(METRIC_NAME),
+        ]
+        counters = []
+        with self.lock:
+            items = sorted(self.stats.items())
+            for (service, operation), stats in items:
+                labels = 'service="{}",operation="{}"'.format(service, operation)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.buckets):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(METRIC_NAME, labels, bound, cumulative))
+                lines.append('{}_sum{{{}}} {:.6f}'.format(METRIC_NAME, labels, stats.latency_sum))
+                lines.append('{}_count{{{}}} {}'.format(METRIC_NAME, labels, stats.calls))
+                for counter in ('errors', 'retries', 'throttles'):
+                    counters.append((counter, labels, getattr(stats, counter)))
+        for counter in ('errors', 'retries', 'throttles'):
+            lines.append('# TYPE aws_ecs_remote_api_{}_total counter'.format(counter))
+            lines.extend(
+                'aws_ecs_remote_api_{}_total{{{}}} {}'.format(name, labels, value)
+                for name, labels, value in counters if name == counter
+            )
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,166 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+# Part size doubles every PART_GROWTH parts so very large streams stay under MAX_PARTS
+PART_GROWTH = 1000
+DEFAULT_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=8
+)
+
+
+class MultipartUploadWriter(io.BufferedIOBase):
+    # Write-only stream that uploads to S3 as parts fill up.
+    # At most max_concurrency parts are in flight, so memory stays around
+    # (max_concurrency + 1) * part size regardless of the total object size.
+    # Streams smaller than one part are sent with a single put_object.
+
+    def __init__(self, s3, bucket, key, config=None, extra_args=None):
+        super().__init__()
+        if config is None:
+            config = DEFAULT_TRANSFER_CONFIG
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.extra_args = extra_args or {}
+        self.part_size = max(config.multipart_chunksize, MIN_PART_SIZE)
+        self.max_concurrency = max(config.max_concurrency, 1)
+        self.buffer = bytearray()
+        self.position = 0
+        self.upload_id = None
+        self.part_number = 0
+        self.parts = []
+        self.futures = []
+        self.executor = None
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed MultipartUploadWriter")
+        self.check_futures()
+        n = len(data)
+        self.buffer += data
+        self.position += n
+        while len(self.buffer) >= self.current_part_size():
+            size = self.current_part_size()
+            part = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            self.submit_part(part)
+        return n
+
+    def current_part_size(self):
+        return self.part_size * (2 ** (self.part_number // PART_GROWTH))
+
+    def start(self):
+        response = self.s3.create_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            **self.extra_args
+        )
+        self.upload_id = response['UploadId']
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    def submit_part(self, data):
+        if self.upload_id is None:
+            self.start()
+        self.part_number += 1
+        if self.part_number > MAX_PARTS:
+            raise ValueError("Upload of [{}] exceeds {} parts".format(self.key, MAX_PARTS))
+        # Block until a slot frees up; this is what bounds memory
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self.upload_part, self.part_number, data)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.futures.append(future)
+
+    def upload_part(self, part_number, data):
+        try:
+            response = self.s3.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self.slots.release()
+
+    def check_futures(self):
+        pending = []
+        for future in self.futures:
+            if future.done():
+                self.parts.append(future.result())
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=bytes(self.buffer),
+                    **self.extra_args
+                )
+            else:
+                if self.buffer:
+                    self.submit_part(bytes(self.buffer))
+                for future in self.futures:
+                    self.parts.append(future.result())
+                self.futures = []
+                self.executor.shutdown()
+                self.s3.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={
+                        'Parts': sorted(self.parts, key=lambda p: p['PartNumber'])
+                    }
+                )
+            self.buffer = bytearray()
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id
+            )
+            self.upload_id = None
+        self.buffer = bytearray()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            super().close()
+        else:
+            self.close()
@@ -0,0 +1,131 @@
+# Ships this package to the container. The local aws_ecs_remote is built into
+# a wheel, uploaded content-addressed to the run bucket and installed by the
+# task's bootstrap, so client and container always run the same code.
+import base64
+import hashlib
+import io
+import os
+import shlex
+import threading
+import zipfile
+
+from aws_ecs_remote import __version__
+from aws_ecs_remote.bucket import CAS_PREFIX, object_exists
+
+PACKAGE_NAME = 'aws_ecs_remote'
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Mirrors install_requires and extras_require in setup.py
+REQUIRES = ['boto3']
+EXTRAS = {
+    'zstd': ['zstandard'],
+    'cloudpickle': ['cloudpickle']
+}
+DEFAULT_EXTRAS = ('zstd',)
+PACKAGE_PREFIX = 'packages'
+# Where the bootstrap downloads the wheel inside the container
+WHEEL_DIR = '/tmp'
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+_wheels = {}
+_wheels_lock = threading.Lock()
+
+
+def wheel_name(version=__version__):
+    return '{}-{}-py3-none-any.whl'.format(PACKAGE_NAME, version)
+
+
+def package_files(package_dir=PACKAGE_DIR):
+    files = []
+    for root, dirs, names in os.walk(package_dir):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for name in sorted(names):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, package_dir).replace(os.sep, '/')
+                files.append((path, '{}/{}'.format(PACKAGE_NAME, rel)))
+    return files
+
+
+def wheel_metadata(version=__version__):
+    lines = [
+        'Metadata-Version: 2.1',
+        'Name: aws-ecs-remote',
+        'Version: {}'.format(version),
+    ]
+    lines.extend('Requires-Dist: {}'.format(requirement) for requirement in REQUIRES)
+    for extra, requirements in sorted(EXTRAS.items()):
+        lines.append('Provides-Extra: {}'.format(extra))
+        lines.extend('Requires-Dist: {}; extra == "{}"'.format(requirement, extra) for requirement in requirements)
+    return '\n'.join(lines) + '\n'
+
+
+def record_hash(data):
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode('ascii')
+    return 'sha256={}'.format(digest)
+
+
+def build_wheel(package_dir=PACKAGE_DIR, version=__version__):
+    # Deterministic pure-Python wheel: sorted entries with fixed timestamps,
+    # so unchanged code gives identical bytes
+    dist_info = '{}-{}.dist-info'.format(PACKAGE_NAME, version)
+    entries = []
+    for path, arcname in package_files(package_dir):
+        with open(path, 'rb') as f:
+            entries.append((arcname, f.read()))
+    entries.append(('{}/METADATA'.format(dist_info), wheel_metadata(version).encode('utf-8')))
+    entries.append(('{}/WHEEL'.format(dist_info), (
+        'Wheel-Version: 1.0\n'
+        'Generator: aws-ecs-remote\n'
+        'Root-Is-Purelib: true\n'
+        'Tag: py3-none-any\n').encode('utf-8')))
+    record = ''.join('{},{},{}\n'.format(name, record_hash(data), len(data)) for name, data in entries)
+    record += '{}/RECORD,,\n'.format(dist_info)
+    entries.append(('{}/RECORD'.format(dist_info), record.encode('utf-8')))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=ZIP_DATE)
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            z.writestr(info, data)
+    return buffer.getvalue()
+
+
+def wheel_key(data, prefix=CAS_PREFIX, version=__version__):
+    digest = hashlib.sha256(data).hexdigest()
+    return '{}/{}/{}/{}'.format(prefix, PACKAGE_PREFIX, digest, wheel_name(version))
+
+
+def upload_package(s3, bucket, prefix=CAS_PREFIX):
+    # Uploads the wheel unless the same bytes are already there. Returns its key.
+    with _wheels_lock:
+        data = _wheels.get(PACKAGE_DIR)
+        if data is None:
+            data = _wheels[PACKAGE_DIR] = build_wheel()
+    key = wheel_key(data, prefix=prefix)
+    if not object_exists(s3=s3, bucket=bucket, key=key):
+        s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType='application/zip')
+    return key
+
+
+def pinned_bootstrap(extras=DEFAULT_EXTRAS, version=__version__):
+    # Installs the matching release from PyPI instead of an uploaded wheel
+    requirement = 'aws-ecs-remote'
+    if extras:
+        requirement = '{}[{}]'.format(requirement, ','.join(extras))
+    return 'pip install --quiet --no-cache-dir "{}=={}"'.format(requirement, version)
+
+
+def package_bootstrap(bucket, key, extras=DEFAULT_EXTRAS):
+    # Shell command for the task: fetch the wheel with the task role and
+    # install it. boto3 comes first since the package is not there yet.
+    path = '{}/{}'.format(WHEEL_DIR, key.rsplit('/', 1)[-1])
+    fetch = "import boto3; boto3.client('s3').download_file({!r}, {!r}, {!r})".format(bucket, key, path)
+    requirement = path
+    if extras:
+        requirement = '{}[{}]'.format(path, ','.join(extras))
+    return ' && '.join([
+        'pip install --quiet --no-cache-dir boto3',
+        'python -c {}'.format(shlex.quote(fetch)),
+        'pip install --quiet --no-cache-dir {}'.format(shlex.quote(requirement))
+    ])
@@ -0,0 +1,211 @@
+# Entry point inside the container: fetch source and args from the run bucket,
+# run the script, then upload its output directory.
+import argparse
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_ecs_remote.bucket import blob_key, CAS_PREFIX
+from aws_ecs_remote.clients import get_client
+from aws_ecs_remote.package import pinned_bootstrap
+from aws_ecs_remote.task_args import args_to_argv, download_args
+
+# Fallback when the run did not upload this package (see package.py); pinned
+# so the container never runs a different release than the client
+BOOTSTRAP_COMMAND = pinned_bootstrap()
+OUTPUT_DIR = 'output'
+OUTPUT_ENV = 'AWS_ECS_REMOTE_OUTPUT'
+ARGS_ENV = 'AWS_ECS_REMOTE_ARGS'
+# Peak usage of the script, uploaded beside its outputs for history.py
+USAGE_FILE = '.aws-ecs-remote-usage.json'
+FETCH_WORKERS = 16
+
+
+def remote_command(bucket, src_key, script, output_prefix, args_key=None, args_index=0,
+                   bootstrap=BOOTSTRAP_COMMAND, shard_key=None, result_key=None):
+    # Single shell string for the task definition's ['sh', '-c'] entry point.
+    # With shard_key the task runs an executor shard instead of a script.
+    argv = [
+        'python', '-m', 'aws_ecs_remote.remote',
+        '--bucket', bucket,
+        '--src', src_key,
+        '--output', output_prefix
+    ]
+    if shard_key:
+        argv.extend(['--shard', shard_key, '--result', result_key])
+    else:
+        argv.extend(['--script', script])
+    if args_key:
+        argv.extend(['--args', args_key, '--args-index', str(args_index)])
+    command = ' '.join(shlex.quote(arg) for arg in argv)
+    if bootstrap:
+        command = '{} && {}'.format(bootstrap, command)
+    return [command]
+
+
+def safe_path(root, name):
+    path = os.path.abspath(os.path.join(root, name))
+    if not path.startswith(os.path.abspath(root) + os.sep):
+        raise ValueError("Refusing to extract [{}] outside of [{}]".format(name, root))
+    return path
+
+
+def check_tar_member(dest, member):
+    # Names and link targets are resolved through the links extracted so far,
+    # so a link cannot carry itself or a later member outside dest
+    safe_path(dest, member.name)
+    targets = [member.name]
+    if member.issym():
+        targets.append(os.path.join(os.path.dirname(member.name), member.linkname))
+    elif member.islnk():
+        targets.append(member.linkname)
+    elif not (member.isfile() or member.isdir()):
+        raise ValueError("Refusing to extract special file [{}]".format(member.name))
+    root = os.path.realpath(dest)
+    for target in targets:
+        path = os.path.realpath(os.path.join(root, target))
+        if path != root and not path.startswith(root + os.sep):
+            raise ValueError("Refusing to extract [{}] outside of [{}]".format(member.name, dest))
+
+
+def fetch_manifest(s3, bucket, key, dest, prefix=CAS_PREFIX):
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8'))
+
+    def fetch(entry):
+        path = safe_path(dest, entry['path'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        s3.download_file(Bucket=bucket, Key=blob_key(entry['digest'], prefix=prefix), Filename=path)
+        os.chmod(path, entry['mode'])
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        list(executor.map(fetch, manifest['files']))
+
+
+def fetch_source(s3, bucket, key, dest):
+    if key.endswith('.json'):
+        fetch_manifest(s3=s3, bucket=bucket, key=key, dest=dest, prefix=key.rsplit('/manifests/', 1)[0])
+        return
+    with tempfile.TemporaryFile() as f:
+        s3.download_fileobj(Bucket=bucket, Key=key, Fileobj=f)
+        f.seek(0)
+        if key.endswith('.zip'):
+            with zipfile.ZipFile(f) as z:
+                for info in z.infolist():
+                    path = z.extract(info, dest)
+                    mode = (info.external_attr >> 16) & 0o777
+                    if mode:
+                        os.chmod(path, mode)
+        elif key.endswith('.tar.zst'):
+            import zstandard
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            with tarfile.open(fileobj=reader, mode='r|') as tar:
+                # The data filter (where tarfile has it) applies the same
+                # rules again and drops unsafe mode bits
+                kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+                for member in tar:
+                    check_tar_member(dest, member)
+                    tar.extract(member, dest, **kwargs)
+        else:
+            raise ValueError("Unknown source format [{}]".format(key))
+
+
+def upload_outputs(s3, bucket, output_dir, prefix):
+    files = []
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            files.append((path, os.path.relpath(path, output_dir).replace(os.sep, '/')))
+
+    def upload(item):
+        path, rel = item
+        s3.upload_file(Filename=path, Bucket=bucket, Key=prefix + rel)
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        list(executor.map(upload, files))
+    print("Uploaded {} output files to s3://{}/{}".format(len(files), bucket, prefix))
+
+
+def script_usage(seconds, returncode):
+    # Children's peak RSS (KiB on Linux) and CPU time, read once the script exits
+    try:
+        import resource
+    except ImportError:
+        return {'seconds': seconds, 'returncode': returncode}
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'seconds': seconds,
+        'returncode': returncode,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'peak_memory_mb': usage.ru_maxrss / 1024,
+        # SIGKILL inside the container is almost always the kernel OOM killer
+        'oom': returncode == -signal.SIGKILL
+    }
+
+
+def upload_usage(s3, bucket, prefix, usage):
+    s3.put_object(
+        Bucket=bucket,
+        Key=prefix + USAGE_FILE,
+        Body=json.dumps(usage).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='aws_ecs_remote.remote')
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--src', required=True)
+    parser.add_argument('--script', default=None)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--args', default=None)
+    parser.add_argument('--args-index', type=int, default=0)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--shard', default=None)
+    parser.add_argument('--result', default=None)
+    args = parser.parse_args(argv)
+    if not args.script and not (args.shard and args.result):
+        parser.error('--script or --shard and --result are required')
+
+    s3 = get_client('s3')
+    workdir = args.workdir or tempfile.mkdtemp(prefix='aws-ecs-remote-')
+    src_dir = os.path.join(workdir, 'src')
+    os.makedirs(src_dir, exist_ok=True)
+    fetch_source(s3=s3, bucket=args.bucket, key=args.src, dest=src_dir)
+
+    script_args = None
+    if args.args:
+        script_args = download_args(s3=s3, bucket=args.bucket, key=args.args, index=args.args_index)
+    # Fresh directory outside src_dir so source files never upload as outputs
+    output_dir = tempfile.mkdtemp(prefix=OUTPUT_DIR + '-', dir=workdir)
+    env = dict(os.environ)
+    env[OUTPUT_ENV] = output_dir
+    env[ARGS_ENV] = json.dumps(script_args)
+    if args.shard:
+        # Runs from src_dir so the shard's functions import from the source
+        command = [
+            sys.executable, '-m', 'aws_ecs_remote.executor',
+            '--bucket', args.bucket,
+            '--shard', args.shard,
+            '--result', args.result
+        ]
+    else:
+        command = [sys.executable, args.script] + args_to_argv(script_args)
+    print("Running {}".format(command))
+    start = time.time()
+    returncode = subprocess.call(command, cwd=src_dir, env=env)
+    usage = script_usage(seconds=time.time() - start, returncode=returncode)
+    upload_outputs(s3=s3, bucket=args.bucket, output_dir=output_dir, prefix=args.output)
+    upload_usage(s3=s3, bucket=args.bucket, prefix=args.output, usage=usage)
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
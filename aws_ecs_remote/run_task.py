@@ -1,44 +1,213 @@
 import inspect
 import os
-import boto3
 import uuid
+from botocore.exceptions import ClientError
 
-from .bucket import ensure_bucket, upload_as_zip
+from .archive import ArchiveFormat, archive_extension
+from .checkpoint import LogCheckpoint
+from .bucket import default_bucket_name, ensure_bucket, upload_archive, upload_content_addressed, SourceMode
+from .clients import get_client, get_session
+from .cloudwatch import ensure_log_group, follow_log_events, LogStrategy, TAIL_WORKERS
+from .cluster import ensure_cluster
+from .download import output_prefix
+from .events import EventWaiter, ensure_task_events, events_clients
+from .ecs import describe_tasks, ecs_run_task, ecs_run_tasks, get_log_paths, print_task_stopped, FleetTracker
+from .graph import TaskGraph
+from .history import SizingAdvisor, job_key, read_usage
+from .iam import ensure_execution_role, ensure_task_role
+from .infra_cache import InfraCache, INFRA_TTL, is_stale_infra_error, is_stale_infra_failure
+from .package import DEFAULT_EXTRAS, package_bootstrap, pinned_bootstrap, upload_package
+from .remote import remote_command, BOOTSTRAP_COMMAND
+from .sinks import LogDispatcher, TerminalSink
+from .task_args import args_key, upload_args_batch
+from .task_definition import DEFAULT_CPU, DEFAULT_MEMORY, ensure_task_definition, get_task_definition
+from .tracing import Tracer, get_tracer, span, use_tracer, write_trace
+from .vpc import ensure_security_group, ensure_vpc, get_subnets
 from datetime import datetime
 
-def run_task(
-    cluster,
-    bucket=None,
-    src=None,
-    script=None,
-    args=None,
-    profile=None,
-    base_name=None
-):
-    session = boto3.Session(profile_name=profile)
-    s3 = session.client('s3')
-    sts = session.client('sts')
-    ecs = session.client('ecs')
-    logs = session.client('logs')
-    region = session.region_name
-    account = sts.get_caller_identity().get('Account')
+DEFAULT_IMAGE = 'python:3.9'
 
+
+def make_run_name(base_name=None):
     if not base_name:
         base_name = "run"
     now = datetime.utcnow()
     nowstr = now.strftime("%Y%m%d-%H%M%S-%f")
     uuid1 = uuid.uuid1()
-    name = "{}-{}-{}".format(base_name, nowstr, uuid1)
+    return "{}-{}-{}".format(base_name, nowstr, uuid1)
+
+
+def resolve_script(script=None, depth=2):
+    # Defaults to the file that called run_task (or run_sweep)
     if not script:
-        script = inspect.stack()[1]
+        script = inspect.stack(0)[depth]
         script = script.filename
-        script = os.path.abspath(script)
-    if not src:
-        src = os.path.abspath(os.path.join(script, '..'))
+    return os.path.abspath(script)
+
+
+def upload_source(
+        s3, src, bucket, name,
+        src_mode=SourceMode.ZIP,
+        archive_format=ArchiveFormat.ZIP_DEFLATE,
+        workers=None,
+        transfer_config=None,
+        quiet=False):
+    # Upload src to bucket as an archive, or content-addressed to skip unchanged files
+    if src_mode == SourceMode.ZIP:
+        src_key = "{}/src.{}".format(name, archive_extension(archive_format))
+        upload_archive(
+            s3=s3,
+            path=src,
+            bucket=bucket,
+            key=src_key,
+            archive_format=archive_format,
+            workers=workers,
+            transfer_config=transfer_config,
+            quiet=quiet
+        )
+    elif src_mode in (SourceMode.CAS_ARCHIVE, SourceMode.CAS_BLOBS):
+        src_key = upload_content_addressed(
+            s3=s3,
+            path=src,
+            bucket=bucket,
+            archive=src_mode == SourceMode.CAS_ARCHIVE,
+            archive_format=archive_format,
+            workers=workers,
+            transfer_config=transfer_config,
+            quiet=quiet
+        )
+    else:
+        raise ValueError("Unknown source mode [{}]".format(src_mode))
+    return src_key
+
+
+def add_infrastructure_steps(graph, ecs, iam, logs, ec2, region, cluster, image, bucket, cpu=DEFAULT_CPU,
+                             memory=DEFAULT_MEMORY, cache=None):
+    # Independent chains (cluster, roles -> task definition -> log groups,
+    # vpc -> security group / subnets) run concurrently. The task role only
+    # reaches bucket; the execution role pulls images and writes logs.
+    graph.add('cluster', lambda: ensure_cluster(ecs=ecs, cluster_name=cluster, cache=cache))
+    graph.add('task_role', lambda: ensure_task_role(iam=iam, bucket=bucket, cache=cache))
+    graph.add('execution_role', lambda: ensure_execution_role(iam=iam, cache=cache))
+    graph.add('task_definition', lambda task_role, execution_role: ensure_task_definition(
+        ecs=ecs,
+        taskRoleArn=task_role['Arn'],
+        executionRoleArn=execution_role['Arn'],
+        image=image,
+        log_region=region,
+        cpu=cpu,
+        memory=memory,
+        cache=cache
+    ), deps=['task_role', 'execution_role'])
+
+    def log_groups(task_definition):
+        for container_definition in task_definition['containerDefinitions']:
+            ensure_log_group(
+                logs=logs,
+                log_group=container_definition['logConfiguration']['options']['awslogs-group'],
+                cache=cache
+            )
+
+    graph.add('log_groups', log_groups, deps=['task_definition'])
+    graph.add('vpc', lambda: ensure_vpc(ec2=ec2, region=region, cache=cache))
+    graph.add('security_group', lambda vpc: ensure_security_group(
+        ec2=ec2, vpc_id=vpc['VpcId'], cache=cache), deps=['vpc'])
+    graph.add('subnets', lambda vpc: get_subnets(
+        ec2=ec2, vpc_id=vpc['VpcId'], cache=cache), deps=['vpc'])
+
+
+def infrastructure_results(results):
+    return {
+        'cluster': results['cluster']['clusterArn'],
+        'task_definition': results['task_definition'],
+        'subnets': [subnet['SubnetId'] for subnet in results['subnets']],
+        'security_groups': [results['security_group']['GroupId']]
+    }
+
+
+def resolve_infrastructure(ecs, iam, logs, ec2, region, cluster, image, bucket, cpu=DEFAULT_CPU,
+                           memory=DEFAULT_MEMORY, cache=None):
+    graph = TaskGraph()
+    add_infrastructure_steps(
+        graph=graph,
+        ecs=ecs,
+        iam=iam,
+        logs=logs,
+        ec2=ec2,
+        region=region,
+        cluster=cluster,
+        image=image,
+        bucket=bucket,
+        cpu=cpu,
+        memory=memory,
+        cache=cache
+    )
+    return infrastructure_results(graph.run())
+
+
+def prepare_run(
+    cluster,
+    script,
+    bucket=None,
+    src=None,
+    profile=None,
+    base_name=None,
+    image=DEFAULT_IMAGE,
+    cpu=DEFAULT_CPU,
+    memory=DEFAULT_MEMORY,
+    src_mode=SourceMode.ZIP,
+    archive_format=ArchiveFormat.ZIP_DEFLATE,
+    workers=None,
+    transfer_config=None,
+    use_cache=True,
+    cache_ttl=INFRA_TTL,
+    use_events=False,
+    sqs_endpoint_url=None,
+    api_metrics=None,
+    session=None,
+    ship_package=True,
+    package_extras=DEFAULT_EXTRAS,
+    quiet=False
+):
+    # Uploads the source and resolves everything a launch needs. The returned
+    # dict is shared by every task launched from this upload. use_events
+    # provisions task state change events (see events.py) for follow_tasks.
+    # api_metrics (metrics.ApiMetrics) counts every call made by the run.
+    # session overrides the boto3 session built from profile. cpu (units)
+    # and memory (MiB) size the task; each distinct size is its own definition.
+    # script may be None when tasks run something other than a script (see
+    # executor.py); src is then required. ship_package uploads this package
+    # as a wheel for the task to install (package.py); otherwise the task
+    # installs the same version from PyPI. Either way with package_extras.
     if not profile:
         profile = None
+    if session is None:
+        session = get_session(profile)
+    # A run counting its calls gets clients of its own, so concurrent runs
+    # in the process are not counted with it
+    pooled = api_metrics is None
+    s3 = get_client('s3', session=session, pooled=pooled)
+    sts = get_client('sts', session=session, pooled=pooled)
+    ecs = get_client('ecs', session=session, pooled=pooled)
+    logs = get_client('logs', session=session, pooled=pooled)
+    iam = get_client('iam', session=session, pooled=pooled)
+    ec2 = get_client('ec2', session=session, pooled=pooled)
+    if api_metrics is not None:
+        for client in (s3, sts, ecs, logs, iam, ec2):
+            api_metrics.instrument_client(client)
+    region = session.region_name
+    account = sts.get_caller_identity().get('Account')
+    cache = None
+    if use_cache:
+        cache = InfraCache.for_account(profile=profile, account=account, region=region, ttl=cache_ttl)
+
+    name = make_run_name(base_name)
+    if not src:
+        if not script:
+            raise ValueError("Specify src when there is no script")
+        src = os.path.abspath(os.path.join(script, '..'))
     if not bucket:
-        bucket = 'aws-ecs-remote-{}-{}'.format(region, account)
+        bucket = default_bucket_name(region=region, account=account)
         print("no bucket specified. using default bucket {}.".format(bucket))
 
     print("name: {}".format(name))
@@ -48,16 +217,411 @@ def run_task(
     print("region: {}".format(region))
     print("bucket: {}".format(bucket))
 
-    # Ensure bucket exists
-    ensure_bucket(s3=s3, bucket=bucket, region=region)
-
-    # Upload src to bucket as a zip
-    src_key = "{}/src.zip".format(name)
+    # Bucket and upload overlap with provisioning; the launch waits for all
+    graph = TaskGraph()
+    graph.add('bucket', lambda: ensure_bucket(s3=s3, bucket=bucket, region=region, cache=cache))
+    graph.add('src_key', lambda **_: upload_source(
+        s3=s3,
+        src=src,
+        bucket=bucket,
+        name=name,
+        src_mode=src_mode,
+        archive_format=archive_format,
+        workers=workers,
+        transfer_config=transfer_config,
+        quiet=quiet
+    ), deps=['bucket'])
+    if ship_package:
+        graph.add('package_key', lambda **_: upload_package(s3=s3, bucket=bucket), deps=['bucket'])
+    add_infrastructure_steps(
+        graph=graph,
+        ecs=ecs,
+        iam=iam,
+        logs=logs,
+        ec2=ec2,
+        region=region,
+        cluster=cluster,
+        image=image,
+        bucket=bucket,
+        cpu=cpu,
+        memory=memory,
+        cache=cache
+    )
+    events = sqs = None
+    if use_events:
+        events, sqs = events_clients(session, sqs_endpoint_url=sqs_endpoint_url, pooled=pooled)
+        if api_metrics is not None:
+            api_metrics.instrument_client(events)
+            api_metrics.instrument_client(sqs)
+        graph.add('task_events', lambda cluster: ensure_task_events(
+            events=events, sqs=sqs, cluster_arn=cluster['clusterArn'], cache=cache), deps=['cluster'])
+    results = graph.run()
+    src_key = results['src_key']
     src_url = "s3://{}/{}".format(bucket, src_key)
-    upload_as_zip(s3=s3, path=src, bucket=bucket, key=src_key)
+    print("src_url: {}".format(src_url))
+    if ship_package:
+        bootstrap = package_bootstrap(bucket=bucket, key=results['package_key'], extras=package_extras)
+    else:
+        bootstrap = pinned_bootstrap(extras=package_extras)
+    print("output_url: s3://{}/{}".format(bucket, output_prefix(name)))
+
+    run = {
+        'session': session,
+        's3': s3,
+        'ecs': ecs,
+        'logs': logs,
+        'iam': iam,
+        'ec2': ec2,
+        'sqs': sqs,
+        'task_events': results.get('task_events'),
+        'infra_cache': cache,
+        'cluster_name': cluster,
+        'image': image,
+        'cpu': cpu,
+        'memory': memory,
+        'region': region,
+        'account': account,
+        'name': name,
+        'bucket': bucket,
+        'src': src,
+        'src_key': src_key,
+        'bootstrap': bootstrap,
+        'script': os.path.relpath(script, src).replace(os.sep, '/') if script else None
+    }
+    run.update(infrastructure_results(results))
+    return run
+
+
+def refresh_infrastructure(run):
+    run['infra_cache'].invalidate()
+    run.update(resolve_infrastructure(
+        ecs=run['ecs'],
+        iam=run['iam'],
+        logs=run['logs'],
+        ec2=run['ec2'],
+        region=run['region'],
+        cluster=run['cluster_name'],
+        image=run['image'],
+        bucket=run['bucket'],
+        cpu=run['cpu'],
+        memory=run['memory'],
+        cache=run['infra_cache']
+    ))
+
+
+def run_bootstrap(run, bootstrap=None):
+    # bootstrap None installs what prepare_run chose; '' installs nothing
+    if bootstrap is None:
+        return run.get('bootstrap', BOOTSTRAP_COMMAND)
+    return bootstrap
+
+
+def launch_task(run, output, args_key=None, args_index=0, bootstrap=None,
+                capacity_provider_strategy=None):
+    command = remote_command(
+        bucket=run['bucket'],
+        src_key=run['src_key'],
+        script=run['script'],
+        output_prefix=output,
+        args_key=args_key,
+        args_index=args_index,
+        bootstrap=run_bootstrap(run, bootstrap)
+    )
+
+    def launch():
+        return ecs_run_task(
+            ecs=run['ecs'],
+            cluster=run['cluster'],
+            task_definition=run['task_definition']['taskDefinitionArn'],
+            command=command,
+            subnets=run['subnets'],
+            security_groups=run['security_groups'],
+            capacity_provider_strategy=capacity_provider_strategy
+        )
+
+    try:
+        return launch()
+    except ClientError as e:
+        # Cached resources may have been deleted; resolve again and retry once
+        if run.get('infra_cache') is None or not is_stale_infra_error(e):
+            raise e
+        print("Launch failed with cached infrastructure, refreshing: {}".format(e))
+        refresh_infrastructure(run)
+        return launch()
+
+
+def launch_tasks(run, launches, bootstrap=None, **kwargs):
+    # launches is a list of (output, args_key, args_index). Yields
+    # (index, task, failure) as the concurrent RunTask calls return. Like
+    # launch_task, launches that failed on stale cached infrastructure are
+    # retried once after resolving it again.
+    commands = [
+        remote_command(
+            bucket=run['bucket'],
+            src_key=run['src_key'],
+            script=run['script'],
+            output_prefix=output,
+            args_key=key,
+            args_index=args_index,
+            bootstrap=run_bootstrap(run, bootstrap)
+        )
+        for output, key, args_index in launches
+    ]
+
+    def launch(indexes):
+        return ecs_run_tasks(
+            ecs=run['ecs'],
+            cluster=run['cluster'],
+            task_definition=run['task_definition']['taskDefinitionArn'],
+            commands=[commands[i] for i in indexes],
+            subnets=run['subnets'],
+            security_groups=run['security_groups'],
+            **kwargs
+        )
+
+    stale = []
+    for i, task, failure in launch(range(len(commands))):
+        if task is None and run.get('infra_cache') is not None and is_stale_infra_failure(failure):
+            stale.append(i)
+            continue
+        yield i, task, failure
+    if stale:
+        print("{} launches failed with cached infrastructure, refreshing".format(len(stale)))
+        refresh_infrastructure(run)
+        for j, task, failure in launch(stale):
+            yield stale[j], task, failure
+
+
+def task_log_streams(run, tasks):
+    log_streams = []
+    for task in tasks:
+        log_streams.extend(get_log_paths(
+            task['containers'], run['task_definition']['containerDefinitions']
+        ))
+    return log_streams
+
+
+def default_log_strategy(log_streams):
+    # One filter call covers up to 100 streams once there are more than a pool's worth
+    return LogStrategy.FILTER if len(log_streams) > TAIL_WORKERS else LogStrategy.GET
+
+
+def follow_log_streams(ecs, logs, cluster, task_arns, log_streams, log_strategy=None, log_sinks=None,
+                       checkpoint=None, sqs=None, task_events=None):
+    # Logs go to log_sinks (the terminal by default) from a writer thread.
+    # Positions are checkpointed so attach can resume; the checkpoints are
+    # removed once every task has stopped and its logs are read. Returns the
+    # stopped tasks by ARN.
+    on_stopped = print_task_stopped if len(task_arns) > 1 else None
+    if task_events is not None:
+        tracker = EventWaiter(
+            ecs=ecs,
+            cluster=cluster,
+            task_arns=task_arns,
+            sqs=sqs,
+            queue_url=task_events['QueueUrl']
+        )
+    else:
+        tracker = FleetTracker(
+            ecs=ecs,
+            cluster=cluster,
+            task_arns=task_arns
+        )
+    waiter = tracker.waiter(on_stopped=on_stopped)
+    if log_strategy is None:
+        log_strategy = default_log_strategy(log_streams)
+    dispatcher = LogDispatcher(log_sinks or [TerminalSink()])
+    try:
+        follow_log_events(
+            logs=logs,
+            log_streams=log_streams,
+            waiter=waiter,
+            log_handler=dispatcher,
+            strategy=log_strategy,
+            checkpoint=checkpoint
+        )
+    finally:
+        dispatcher.close()
+    if checkpoint is not None:
+        checkpoint.remove(task_arns)
+    stats = dispatcher.stats()
+    if stats['dropped'] or stats['sink_errors']:
+        print("Log events dropped: {}, sink errors: {}".format(stats['dropped'], stats['sink_errors']))
+    return tracker.stopped
+
+
+def follow_tasks(run, tasks, log_strategy=None, log_sinks=None, checkpoint=True):
+    log_streams = task_log_streams(run, tasks)
+    # Returns the stopped tasks by ARN
+    log_checkpoint = None
+    if checkpoint:
+        log_checkpoint = LogCheckpoint()
+        log_checkpoint.register(cluster=run['cluster'], log_streams=log_streams)
+        log_checkpoint.save()
+    return follow_log_streams(
+        ecs=run['ecs'],
+        logs=run['logs'],
+        cluster=run['cluster'],
+        task_arns=[task['taskArn'] for task in tasks],
+        log_streams=log_streams,
+        log_strategy=log_strategy,
+        log_sinks=log_sinks,
+        checkpoint=log_checkpoint,
+        sqs=run.get('sqs'),
+        task_events=run.get('task_events')
+    )
+
+
+def attach(task_arns, cluster=None, profile=None, log_strategy=None, log_sinks=None):
+    # Follows tasks launched by another process, resuming their logs from the
+    # last checkpoint. Tasks without one are described and read from the start;
+    # their task definitions come from the local store when already seen.
+    if not profile:
+        profile = None
+    ecs = get_client('ecs', profile=profile)
+    logs = get_client('logs', profile=profile)
+    checkpoint = LogCheckpoint.load(task_arns)
+    if cluster is None:
+        clusters = set(checkpoint.cluster(task_arn) for task_arn in checkpoint.tasks)
+        if len(clusters) != 1:
+            raise ValueError("Specify the cluster of the tasks to attach to")
+        cluster = clusters.pop()
+    missing = [task_arn for task_arn in task_arns if task_arn not in checkpoint.tasks]
+    if missing:
+        tasks, _ = describe_tasks(ecs=ecs, cluster=cluster, task_arns=missing)
+        container_definitions = {}
+        for task in tasks:
+            arn = task['taskDefinitionArn']
+            if arn not in container_definitions:
+                task_definition = get_task_definition(ecs, arn)
+                container_definitions[arn] = task_definition['containerDefinitions'] if task_definition else None
+            if container_definitions[arn] is None:
+                print("Task definition {} not found, following {} without logs".format(arn, task['taskArn']))
+                continue
+            checkpoint.register(
+                cluster=cluster,
+                log_streams=get_log_paths(task['containers'], container_definitions[arn])
+            )
+    print("Attaching to {} tasks ({} resumed)".format(len(task_arns), len(task_arns) - len(missing)))
+    follow_log_streams(
+        ecs=ecs,
+        logs=logs,
+        cluster=cluster,
+        task_arns=list(task_arns),
+        log_streams=checkpoint.log_streams(task_arns),
+        log_strategy=log_strategy,
+        log_sinks=log_sinks,
+        checkpoint=checkpoint
+    )
+
+
+def advise_size(history, job, cpu=None, memory=None, target_seconds=None):
+    # An explicit size wins; without one the job's history picks it
+    if cpu is not None or memory is not None or history is None:
+        return cpu or DEFAULT_CPU, memory or DEFAULT_MEMORY
+    cpu, memory = SizingAdvisor(history, target_seconds=target_seconds).advise(job)
+    print("size: {} cpu, {} MiB".format(cpu, memory))
+    return cpu, memory
+
+
+def record_history(run, history, job, task, output):
+    usage = read_usage(s3=run['s3'], bucket=run['bucket'], output=output)
+    history.record_task(job=job, task=task, cpu=run['cpu'], memory=run['memory'], usage=usage)
+
+
+def run_task(
+    cluster,
+    bucket=None,
+    src=None,
+    script=None,
+    args=None,
+    profile=None,
+    base_name=None,
+    image=DEFAULT_IMAGE,
+    cpu=None,
+    memory=None,
+    src_mode=SourceMode.ZIP,
+    archive_format=ArchiveFormat.ZIP_DEFLATE,
+    workers=None,
+    transfer_config=None,
+    bootstrap=None,
+    wait=True,
+    use_cache=True,
+    quiet=False,
+    log_sinks=None,
+    use_events=False,
+    tracer=None,
+    trace_dir=None,
+    api_metrics=None,
+    session=None,
+    capacity_provider_strategy=None,
+    history=None,
+    target_seconds=None
+):
+    # Phases are timed as spans on tracer (see tracing.py). With trace_dir, a
+    # JSON timeline and Prometheus file are written there for the run.
+    # capacity_provider_strategy (cluster.fargate_strategy) can place the task
+    # on Spot; it falls back to on-demand when Spot has no capacity.
+    # With history (history.RunHistory), cpu and memory left unset are sized
+    # from earlier runs of the same script and args signature, aiming to
+    # finish within target_seconds, and the run is recorded once it stops.
+    script = resolve_script(script)
+    job = job_key(script, args)
+    cpu, memory = advise_size(history, job, cpu=cpu, memory=memory, target_seconds=target_seconds)
+    if tracer is None:
+        tracer = Tracer() if trace_dir else get_tracer()
+    run = None
+    with use_tracer(tracer):
+        try:
+            with span('prepare'):
+                run = prepare_run(
+                    cluster=cluster,
+                    script=script,
+                    bucket=bucket,
+                    src=src,
+                    profile=profile,
+                    base_name=base_name,
+                    image=image,
+                    cpu=cpu,
+                    memory=memory,
+                    src_mode=src_mode,
+                    archive_format=archive_format,
+                    workers=workers,
+                    transfer_config=transfer_config,
+                    use_cache=use_cache,
+                    use_events=use_events and wait,
+                    api_metrics=api_metrics,
+                    session=session,
+                    quiet=quiet
+                )
 
-    # Upload args to bucket as json
-    # Ensure cluster exists
-    # Ensure task definition exists
-    # Run task on ECS
+            # Upload args to bucket as json
+            key = None
+            if args is not None:
+                key = args_key(run['name'], 0)
+                with span('upload_args'):
+                    upload_args_batch(s3=run['s3'], bucket=run['bucket'], key=key, args_list=[args])
 
+            # Run task on ECS
+            with span('launch'):
+                task = launch_task(
+                    run=run,
+                    output=output_prefix(run['name']),
+                    args_key=key,
+                    bootstrap=bootstrap,
+                    capacity_provider_strategy=capacity_provider_strategy
+                )
+            print("task: {}".format(task['taskArn']))
+            if wait:
+                with span('follow'):
+                    stopped = follow_tasks(run=run, tasks=[task], log_sinks=log_sinks)
+                task = stopped.get(task['taskArn'], task)
+                if history is not None:
+                    record_history(run=run, history=history, job=job, task=task, output=output_prefix(run['name']))
+        finally:
+            if trace_dir and run is not None:
+                write_trace(tracer, trace_dir, run['name'])
+            if api_metrics is not None:
+                api_metrics.print_summary()
+                api_metrics.detach()
+    return task
@@ -0,0 +1,428 @@
+import json
+import sqlite3
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_ecs_remote.clients import get_client
+from aws_ecs_remote.download import output_prefix
+from aws_ecs_remote.ecs import FleetTracker, POLL_SEC
+from aws_ecs_remote.history import task_exit_code
+from aws_ecs_remote.run_task import DEFAULT_IMAGE, launch_tasks, prepare_run, resolve_script
+from aws_ecs_remote.state import state_path
+from aws_ecs_remote.task_args import args_key, upload_args_batch
+from aws_ecs_remote.task_definition import DEFAULT_CPU, DEFAULT_MEMORY
+from aws_ecs_remote.throttle import backoff_delay
+
+SCHEDULER_DIR = 'scheduler'
+# Jobs handed to one launch_tasks call
+DISPATCH_BATCH = 500
+MAX_LAUNCH_ATTEMPTS = 5
+# Used when the Service Quotas lookup fails
+DEFAULT_MAX_VCPUS = 6
+FARGATE_VCPU_QUOTA = 'L-3032A538'
+FARGATE_SPOT_VCPU_QUOTA = 'L-36FBB829'
+# RunTask failures that mean the account is at its vCPU quota
+QUOTA_FAILURES = ('limit on the number of vCPUs', 'vCPU limit')
+QUOTA_BACKOFF_SEC = 30
+# Seconds to wait for another process holding the queue's write lock
+BUSY_TIMEOUT_SEC = 30
+# Seconds a claimed job may stay LAUNCHING before another scheduler may
+# reclaim it; covers uploading the args batch and RunTask retries
+LAUNCH_LEASE_SEC = 600
+
+
+class JobState:
+    QUEUED = 'queued'
+    LAUNCHING = 'launching'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+def queue_path(name):
+    return state_path(SCHEDULER_DIR, '{}.sqlite'.format(name))
+
+
+def fargate_vcpu_quota(session=None, spot=False, default=DEFAULT_MAX_VCPUS):
+    # Running vCPU quota for Fargate (or Fargate Spot) in the session's region
+    try:
+        response = get_client('service-quotas', session=session).get_service_quota(
+            ServiceCode='fargate',
+            QuotaCode=FARGATE_SPOT_VCPU_QUOTA if spot else FARGATE_VCPU_QUOTA
+        )
+        return response['Quota']['Value']
+    except ClientError as e:
+        print("Could not read the Fargate vCPU quota, using {}: {}".format(default, e))
+        return default
+
+
+def is_quota_failure(failure):
+    reason = '{} {}'.format(failure.get('reason', ''), failure.get('detail', ''))
+    return any(quota in reason for quota in QUOTA_FAILURES)
+
+
+def job_from_row(row):
+    job = dict(row)
+    job['args'] = json.loads(job['args'])
+    return job
+
+
+class JobQueue:
+    # Persistent job queue in SQLite. Any number of processes may submit and
+    # dispatch; take claims each job for one scheduler until it launches or
+    # its lease runs out. Jobs are launched at least once: a crash between
+    # RunTask and recording its ARN launches that job again.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SEC, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                priority INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                args TEXT,
+                vcpus REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0,
+                task_arn TEXT,
+                exit_code INTEGER,
+                reason TEXT,
+                submitted REAL NOT NULL,
+                updated REAL NOT NULL
+            )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (state, priority DESC, id)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_task ON jobs (task_arn)')
+
+    @classmethod
+    def open(cls, name):
+        return cls(queue_path(name))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def transaction(self, statements):
+        # statements is a list of (sql, params); IMMEDIATE takes the write
+        # lock up front so concurrent submitters wait instead of failing
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, params in statements:
+                    self.db.execute(sql, params)
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def submit(self, args_list, priority=0, vcpus=DEFAULT_CPU / 1024.):
+        # Higher priorities dispatch first, then submission order. Returns the
+        # number of jobs queued.
+        now = time.time()
+        rows = [
+            (priority, JobState.QUEUED, json.dumps(args), vcpus, now, now)
+            for args in args_list
+        ]
+        self.transaction([
+            ('INSERT INTO jobs (priority, state, args, vcpus, submitted, updated) VALUES (?, ?, ?, ?, ?, ?)', row)
+            for row in rows
+        ])
+        return len(rows)
+
+    def take(self, limit):
+        # Moves up to limit ready jobs to LAUNCHING and returns them
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.db.execute(
+                    'SELECT * FROM jobs WHERE state = ? AND not_before <= ? ORDER BY priority DESC, id LIMIT ?',
+                    (JobState.QUEUED, now, limit)).fetchall()
+                self.db.executemany(
+                    'UPDATE jobs SET state = ?, updated = ? WHERE id = ?',
+                    [(JobState.LAUNCHING, now, row['id']) for row in rows])
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return [job_from_row(row) for row in rows]
+
+    def started(self, launched, vcpus):
+        # launched is a list of (job id, task ARN). vcpus is the size the
+        # tasks launched at, which is what they hold against the budget.
+        now = time.time()
+        self.transaction([
+            ('UPDATE jobs SET state = ?, task_arn = ?, vcpus = ?, attempts = attempts + 1, updated = ? WHERE id = ?',
+             (JobState.RUNNING, task_arn, vcpus, now, job_id))
+            for job_id, task_arn in launched
+        ])
+
+    def requeue(self, job_id, reason, delay=0, attempt=True):
+        now = time.time()
+        self.transaction([(
+            'UPDATE jobs SET state = ?, reason = ?, not_before = ?, attempts = attempts + ?, updated = ? WHERE id = ?',
+            (JobState.QUEUED, reason, now + delay, 1 if attempt else 0, now, job_id)
+        )])
+
+    def finish(self, job_id, state, reason=None, exit_code=None):
+        self.transaction([(
+            'UPDATE jobs SET state = ?, reason = ?, exit_code = ?, updated = ? WHERE id = ?',
+            (state, reason, exit_code, time.time(), job_id)
+        )])
+
+    def finish_tasks(self, results):
+        # results is a list of (task ARN, state, reason, exit code)
+        now = time.time()
+        self.transaction([
+            ('UPDATE jobs SET state = ?, reason = ?, exit_code = ?, updated = ? WHERE task_arn = ? AND state = ?',
+             (state, reason, exit_code, now, task_arn, JobState.RUNNING))
+            for task_arn, state, reason, exit_code in results
+        ])
+
+    def recover(self, lease_sec=LAUNCH_LEASE_SEC):
+        # Jobs claimed more than lease_sec ago and never launched (their
+        # scheduler crashed mid-launch) go back to the queue. Younger claims
+        # may belong to a scheduler in another process that is still
+        # launching them. Returns the number of jobs requeued.
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                'UPDATE jobs SET state = ?, updated = ? WHERE state = ? AND updated <= ?',
+                (JobState.QUEUED, now, JobState.LAUNCHING, now - lease_sec))
+        return cursor.rowcount
+
+    def running(self):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT id, task_arn, vcpus FROM jobs WHERE state = ?', (JobState.RUNNING,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def next_ready(self):
+        # Seconds until the next queued job may launch, None if none are queued
+        with self.lock:
+            row = self.db.execute(
+                'SELECT MIN(not_before) FROM jobs WHERE state = ?', (JobState.QUEUED,)).fetchone()
+        if row[0] is None:
+            return None
+        return max(0., row[0] - time.time())
+
+    def counts(self):
+        with self.lock:
+            rows = self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return dict((row[0], row[1]) for row in rows)
+
+    def jobs(self, state=None):
+        with self.lock:
+            if state is None:
+                rows = self.db.execute('SELECT * FROM jobs ORDER BY id').fetchall()
+            else:
+                rows = self.db.execute('SELECT * FROM jobs WHERE state = ? ORDER BY id', (state,)).fetchall()
+        return [job_from_row(row) for row in rows]
+
+
+class Scheduler:
+    # Dispatches a named JobQueue onto ECS within a running-vCPU budget.
+    # Jobs hold only their args; the source, image and size come from the
+    # scheduler that dispatches them. Job i writes to {name}/output/{i:05d}/,
+    # so outputs stay put when the dispatching process restarts.
+
+    def __init__(
+        self,
+        name,
+        cluster,
+        script=None,
+        bucket=None,
+        src=None,
+        profile=None,
+        image=DEFAULT_IMAGE,
+        cpu=DEFAULT_CPU,
+        memory=DEFAULT_MEMORY,
+        max_vcpus=None,
+        max_attempts=MAX_LAUNCH_ATTEMPTS,
+        batch_size=DISPATCH_BATCH,
+        poll_sec=POLL_SEC,
+        bootstrap=None,
+        capacity_provider_strategy=None,
+        session=None,
+        quiet=False,
+        **prepare_kwargs
+    ):
+        # max_vcpus defaults to the account's Fargate vCPU quota.
+        # prepare_kwargs go to prepare_run (src_mode, archive_format, ...).
+        self.name = name
+        self.cluster = cluster
+        self.script = resolve_script(script)
+        self.bucket = bucket
+        self.src = src
+        self.profile = profile
+        self.image = image
+        self.cpu = cpu
+        self.memory = memory
+        self.vcpus = int(cpu) / 1024.
+        self.max_vcpus = max_vcpus
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.poll_sec = poll_sec
+        self.bootstrap = bootstrap
+        self.capacity_provider_strategy = capacity_provider_strategy
+        self.session = session
+        self.quiet = quiet
+        self.prepare_kwargs = prepare_kwargs
+        self.queue = JobQueue.open(name)
+        self.run = None
+        self.tracker = None
+        self.jobs_by_arn = {}
+        self.batches = 0
+        self.quota_until = 0
+
+    def submit(self, args=None, priority=0):
+        return self.submit_many([args], priority=priority)
+
+    def submit_many(self, args_list, priority=0):
+        return self.queue.submit(args_list, priority=priority, vcpus=self.vcpus)
+
+    def prepare(self):
+        # Uploads the source once per process and picks up tasks launched
+        # before a restart
+        self.queue.recover()
+        self.run = prepare_run(
+            cluster=self.cluster,
+            script=self.script,
+            bucket=self.bucket,
+            src=self.src,
+            profile=self.profile,
+            base_name=self.name,
+            image=self.image,
+            cpu=self.cpu,
+            memory=self.memory,
+            session=self.session,
+            quiet=self.quiet,
+            **self.prepare_kwargs
+        )
+        if self.max_vcpus is None:
+            self.max_vcpus = fargate_vcpu_quota(
+                session=self.run['session'],
+                spot=self.capacity_provider_strategy is not None
+            )
+        running = self.queue.running()
+        self.jobs_by_arn = dict((job['task_arn'], job) for job in running)
+        self.tracker = FleetTracker(
+            ecs=self.run['ecs'],
+            cluster=self.run['cluster'],
+            task_arns=list(self.jobs_by_arn),
+            poll_sec=self.poll_sec
+        )
+        if running:
+            print("Resuming {} running jobs".format(len(running)))
+
+    def running_vcpus(self):
+        return sum(job['vcpus'] for job in self.jobs_by_arn.values())
+
+    def dispatch(self):
+        # Launches as many ready jobs as the vCPU budget allows. Returns the
+        # number launched.
+        if time.time() < self.quota_until:
+            return 0
+        launched = 0
+        while True:
+            slots = int((self.max_vcpus - self.running_vcpus()) // self.vcpus)
+            if slots <= 0:
+                return launched
+            jobs = self.queue.take(min(slots, self.batch_size))
+            if not jobs:
+                return launched
+            started = self.launch(jobs)
+            launched += started
+            if started < len(jobs):
+                return launched
+
+    def launch(self, jobs):
+        key = args_key(self.run['name'], self.batches)
+        self.batches += 1
+        upload_args_batch(s3=self.run['s3'], bucket=self.run['bucket'], key=key,
+                          args_list=[job['args'] for job in jobs])
+        launches = [
+            (output_prefix(self.name, index=job['id']), key, i)
+            for i, job in enumerate(jobs)
+        ]
+        started = []
+        for i, task, failure in launch_tasks(
+                run=self.run,
+                launches=launches,
+                bootstrap=self.bootstrap,
+                capacity_provider_strategy=self.capacity_provider_strategy):
+            job = jobs[i]
+            if task is not None:
+                started.append((job['id'], task['taskArn']))
+                self.jobs_by_arn[task['taskArn']] = dict(job, vcpus=self.vcpus)
+                continue
+            reason = failure.get('reason')
+            if is_quota_failure(failure):
+                # Over quota (other workloads share it) is not the job's
+                # fault; pause until a task stops or the backoff passes
+                self.queue.requeue(job['id'], reason=reason, attempt=False)
+                self.quota_until = time.time() + QUOTA_BACKOFF_SEC
+            elif job['attempts'] + 1 >= self.max_attempts:
+                print("job {} failed to launch: {}".format(job['id'], reason))
+                self.queue.finish(job['id'], JobState.FAILED, reason=reason)
+            else:
+                self.queue.requeue(job['id'], reason=reason, delay=backoff_delay(job['attempts']))
+        if started:
+            self.queue.started(started, vcpus=self.vcpus)
+            self.tracker.add([task_arn for _, task_arn in started])
+            if not self.quiet:
+                print("Launched {} jobs ({:g}/{:g} vCPUs)".format(
+                    len(started), self.running_vcpus(), self.max_vcpus))
+        return len(started)
+
+    def collect(self):
+        # Records tasks that stopped since the last poll
+        results = []
+        stopped = self.tracker.poll()
+        failed = list(self.tracker.failed.items())
+        for task in stopped:
+            job = self.jobs_by_arn.pop(task['taskArn'], None)
+            if job is None:
+                continue
+            exit_code = task_exit_code(task)
+            state = JobState.SUCCEEDED if exit_code == 0 else JobState.FAILED
+            if not self.quiet or state == JobState.FAILED:
+                print("job {} {}: {} (exit code {})".format(
+                    job['id'], state, task.get('stoppedReason', ''), exit_code))
+            results.append((task['taskArn'], state, task.get('stoppedReason'), exit_code))
+        for task_arn, failure in failed:
+            if self.jobs_by_arn.pop(task_arn, None) is not None:
+                results.append((task_arn, JobState.FAILED, failure.get('reason'), None))
+        if results:
+            self.queue.finish_tasks(results)
+            self.quota_until = 0
+        self.tracker.forget([task['taskArn'] for task in stopped] + [task_arn for task_arn, _ in failed])
+        return len(results)
+
+    def run_queue(self, forever=False):
+        # Dispatches until the queue is empty and every job has stopped, or
+        # with forever=True keeps waiting for new submissions. Returns the
+        # job counts by state.
+        if self.run is None:
+            self.prepare()
+        while True:
+            self.queue.recover()
+            self.dispatch()
+            self.collect()
+            counts = self.queue.counts()
+            if not forever and not counts.get(JobState.QUEUED) and not self.jobs_by_arn:
+                return counts
+            if self.jobs_by_arn:
+                delay = self.tracker.poll_sec
+            else:
+                ready = self.queue.next_ready()
+                delay = self.poll_sec if ready is None else min(ready, self.poll_sec)
+            time.sleep(delay)
+
+    def close(self):
+        self.queue.close()
@@ -0,0 +1,211 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from aws_ecs_remote.cloudwatch import LOG_FORMAT, format_log_event
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_SEC = 0.5
+MB = 1024 * 1024
+MAX_FILE_BYTES = 100 * MB
+BACKUP_COUNT = 5
+
+
+class Overflow:
+    # What LogDispatcher does when its queue is full
+    BLOCK = 'block'
+    DROP = 'drop'
+
+
+class TerminalSink:
+
+    def __init__(self, log_format=LOG_FORMAT, stream=None):
+        self.log_format = log_format
+        self.stream = stream
+
+    def write(self, events):
+        stream = self.stream or sys.stdout
+        stream.write(''.join(format_log_event(event, log_format=self.log_format) + '\n' for event in events))
+        stream.flush()
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    # Appends formatted events to path, rotating to path.1 .. path.N at max_bytes
+
+    def __init__(self, path, log_format=LOG_FORMAT, max_bytes=MAX_FILE_BYTES, backup_count=BACKUP_COUNT):
+        self.path = path
+        self.log_format = log_format
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        self.f = open(path, 'a', encoding='utf-8')
+
+    def format(self, event):
+        return format_log_event(event, log_format=self.log_format)
+
+    def write(self, events):
+        self.f.write(''.join(self.format(event) + '\n' for event in events))
+        self.f.flush()
+        if self.max_bytes and self.f.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.f.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = '{}.{}'.format(self.path, i)
+                if os.path.exists(src):
+                    os.replace(src, '{}.{}'.format(self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+            self.f = open(self.path, 'a', encoding='utf-8')
+        else:
+            self.f = open(self.path, 'w', encoding='utf-8')
+
+    def close(self):
+        self.f.close()
+
+
+class JsonlSink(FileSink):
+    # One raw event per line, with the logGroupName and logStreamName the
+    # follower attaches to every event
+
+    def format(self, event):
+        return json.dumps(event, sort_keys=True)
+
+
+class CallbackSink:
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, events):
+        self.callback(events)
+
+    def close(self):
+        pass
+
+
+class LogDispatcher:
+    # Log handler that hands events to a writer thread through a bounded
+    # queue, so slow sinks do not hold up polling. When the queue is full it
+    # blocks the poller (backpressure) or drops the event, per overflow.
+    # flush() waits until the sinks have everything queued so far, so a log
+    # checkpoint is only saved past events that were written.
+
+    def __init__(self, sinks, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_sec=FLUSH_SEC,
+                 overflow=Overflow.BLOCK):
+        if overflow not in (Overflow.BLOCK, Overflow.DROP):
+            raise ValueError("Unknown overflow [{}]".format(overflow))
+        self.sinks = list(sinks)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_sec = flush_sec
+        self.overflow = overflow
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.max_lag = 0
+        self.blocked_sec = 0.
+        self.sink_errors = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='aws-ecs-remote-log-dispatcher', daemon=True)
+        self.thread.start()
+
+    def __call__(self, event):
+        self.received += 1
+        if self.overflow == Overflow.DROP:
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+        else:
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                start = time.monotonic()
+                self.queue.put(event)
+                self.blocked_sec += time.monotonic() - start
+        self.max_lag = max(self.max_lag, self.queue.qsize())
+
+    @property
+    def lag(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'written': self.written,
+            'dropped': self.dropped,
+            'lag': self.lag,
+            'max_lag': self.max_lag,
+            'blocked_sec': self.blocked_sec,
+            'sink_errors': self.sink_errors
+        }
+
+    def flush(self):
+        if self.closed:
+            return
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait()
+
+    def run(self):
+        done = False
+        while not done:
+            try:
+                item = self.queue.get(timeout=self.flush_sec)
+            except queue.Empty:
+                continue
+            batch = []
+            flushed = None
+            while True:
+                if item is None:
+                    done = True
+                    break
+                if isinstance(item, threading.Event):
+                    flushed = item
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self.write(batch)
+            if flushed is not None:
+                flushed.set()
+
+    def write(self, batch):
+        for sink in self.sinks:
+            try:
+                sink.write(batch)
+            except Exception as e:
+                self.sink_errors += 1
+                print("Log sink {} failed: {}".format(type(sink).__name__, e), file=sys.stderr)
+        self.written += len(batch)
+
+    def close(self):
+        # Writes everything queued, then closes the sinks
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
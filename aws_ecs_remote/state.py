@@ -0,0 +1,42 @@
+import hashlib
+import json
+import os
+import tempfile
+
+STATE_DIR_ENV = 'AWS_ECS_REMOTE_HOME'
+DEFAULT_STATE_DIR = os.path.join('~', '.aws-ecs-remote')
+
+
+def state_dir():
+    return os.path.expanduser(os.environ.get(STATE_DIR_ENV) or DEFAULT_STATE_DIR)
+
+
+def state_path(*parts):
+    path = os.path.join(state_dir(), *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def path_key(path):
+    return hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    # Write then rename, so readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
@@ -0,0 +1,134 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from .archive import ArchiveFormat
+from .bucket import SourceMode
+from .download import output_prefix
+from .history import job_key
+from .run_task import (DEFAULT_IMAGE, advise_size, follow_tasks, launch_tasks, prepare_run, record_history,
+                       resolve_script)
+from .task_args import ARGS_BATCH_SIZE, args_key, upload_args_batch
+
+
+def iter_batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_sweep(
+    cluster,
+    args_list,
+    bucket=None,
+    src=None,
+    script=None,
+    profile=None,
+    base_name=None,
+    image=DEFAULT_IMAGE,
+    cpu=None,
+    memory=None,
+    src_mode=SourceMode.ZIP,
+    archive_format=ArchiveFormat.ZIP_DEFLATE,
+    workers=None,
+    transfer_config=None,
+    bootstrap=None,
+    batch_size=ARGS_BATCH_SIZE,
+    wait=False,
+    use_cache=True,
+    quiet=False,
+    log_sinks=None,
+    use_events=False,
+    api_metrics=None,
+    session=None,
+    history=None,
+    target_seconds=None,
+    history_workers=16,
+    **launch_kwargs
+):
+    # Uploads the source once and launches one task per argument set.
+    # args_list may be a generator; it is consumed batch by batch, so each
+    # batch of args is one S3 object. Task i writes to {name}/output/{i:05d}/.
+    # launch_kwargs (rate, burst, max_workers, max_attempts) tune ecs_run_tasks;
+    # capacity_provider_strategy=fargate_strategy(...) runs the sweep on Spot,
+    # moving tasks Spot cannot place to on-demand Fargate. With history, the
+    # sweep is sized from the first task's job and every task is recorded.
+    script = resolve_script(script)
+    args_list = iter(args_list)
+    first = list(itertools.islice(args_list, 1))
+    args_list = itertools.chain(first, args_list)
+    cpu, memory = advise_size(
+        history,
+        job_key(script, first[0] if first else None),
+        cpu=cpu,
+        memory=memory,
+        target_seconds=target_seconds
+    )
+    run = prepare_run(
+        cluster=cluster,
+        script=script,
+        bucket=bucket,
+        src=src,
+        profile=profile,
+        base_name=base_name or 'sweep',
+        image=image,
+        cpu=cpu,
+        memory=memory,
+        src_mode=src_mode,
+        archive_format=archive_format,
+        workers=workers,
+        transfer_config=transfer_config,
+        use_cache=use_cache,
+        use_events=use_events and wait,
+        api_metrics=api_metrics,
+        session=session,
+        quiet=quiet
+    )
+    tasks = {}
+    jobs = {}
+    failures = {}
+    start = 0
+    for batch, args_batch in enumerate(iter_batches(args_list, batch_size)):
+        key = args_key(run['name'], batch)
+        upload_args_batch(s3=run['s3'], bucket=run['bucket'], key=key, args_list=args_batch)
+        if history is not None:
+            jobs.update((start + i, job_key(script, args)) for i, args in enumerate(args_batch))
+        launches = [
+            (output_prefix(run['name'], index=start + i), key, i)
+            for i in range(len(args_batch))
+        ]
+        for i, task, failure in launch_tasks(run=run, launches=launches, bootstrap=bootstrap, **launch_kwargs):
+            index = start + i
+            if task is None:
+                print("task {} failed to launch: {}".format(index, failure.get('reason')))
+                failures[index] = failure
+                continue
+            if not quiet:
+                print("task {}: {}".format(index, task['taskArn']))
+            tasks[index] = task
+        start += len(args_batch)
+    print("Launched {} tasks for sweep {}".format(len(tasks), run['name']))
+    if failures:
+        print("{} tasks failed to launch: {}".format(len(failures), sorted(failures)))
+    if wait and tasks:
+        stopped = follow_tasks(run=run, tasks=[tasks[index] for index in sorted(tasks)], log_sinks=log_sinks)
+        tasks = dict((index, stopped.get(task['taskArn'], task)) for index, task in tasks.items())
+        if history is not None:
+            def record(index):
+                record_history(
+                    run=run,
+                    history=history,
+                    job=jobs[index],
+                    task=tasks[index],
+                    output=output_prefix(run['name'], index=index)
+                )
+
+            with ThreadPoolExecutor(max_workers=history_workers) as executor:
+                list(executor.map(record, sorted(tasks)))
+    tasks = [tasks[index] for index in sorted(tasks)]
+    if api_metrics is not None:
+        api_metrics.print_summary()
+        api_metrics.detach()
+    return tasks
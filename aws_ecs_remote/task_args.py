@@ -0,0 +1,57 @@
+import gzip
+import json
+
+# Argument sets are written this many to an object, so a sweep of N configs
+# costs N / ARGS_BATCH_SIZE PUTs instead of N
+ARGS_BATCH_SIZE = 1000
+ARGS_KEY_FORMAT = '{name}/args/{batch:05d}.json.gz'
+
+
+def args_key(name, batch):
+    return ARGS_KEY_FORMAT.format(name=name, batch=batch)
+
+
+def encode_args_batch(args_list):
+    data = json.dumps(list(args_list), separators=(',', ':'))
+    return gzip.compress(data.encode('utf-8'), mtime=0)
+
+
+def decode_args_batch(data):
+    return json.loads(gzip.decompress(data).decode('utf-8'))
+
+
+def upload_args_batch(s3, bucket, key, args_list):
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=encode_args_batch(args_list),
+        ContentType='application/json',
+        ContentEncoding='gzip'
+    )
+
+
+def download_args(s3, bucket, key, index):
+    body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    return decode_args_batch(body)[index]
+
+
+def args_to_argv(args):
+    # dict -> ['--key', 'value', ...]; True adds a bare flag, False and None
+    # are dropped and lists repeat the flag. Lists pass through as argv.
+    if args is None:
+        return []
+    if isinstance(args, (list, tuple)):
+        return [str(arg) for arg in args]
+    argv = []
+    for key, value in args.items():
+        flag = '--{}'.format(key)
+        if value is True:
+            argv.append(flag)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                argv.extend([flag, str(item)])
+        else:
+            argv.extend([flag, str(value)])
+    return argv
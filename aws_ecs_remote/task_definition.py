@@ -1,13 +1,20 @@
 import itertools
 import hashlib
+import json
+import threading
 import time
 from botocore.exceptions import ClientError
 from aws_ecs_remote.cloudwatch import follow_log_events
 import warnings
 from aws_ecs_remote.boto import is_boto_exception
+from aws_ecs_remote.state import read_json, state_path, write_json
 
 CONTAINER_NAME = 'container'
 TASK_NAME_FORMAT = 'aws-ecs-remote-task-{launch_type}-{hexdigest}'
+FINGERPRINT_TAG = 'aws-ecs-remote-fingerprint'
+TASK_DEFINITIONS_FILE = 'task_definitions.json'
+DEFAULT_CPU = 512
+DEFAULT_MEMORY = 2048
 
 
 class NetworkMode:
@@ -35,12 +42,13 @@ class LaunchType:
 
 def describe_task_definition(ecs, task_definition):
     try:
-        return ecs.describe_task_definition(
+        response = ecs.describe_task_definition(
             taskDefinition=task_definition,
             include=[
                 'TAGS'
             ]
-        )['taskDefinition']
+        )
+        return dict(response['taskDefinition'], tags=response.get('tags', []))
     except ClientError as e:
         if is_boto_exception(e, 'ClientException'):
             # Task definition does not exist
@@ -49,14 +57,112 @@ def describe_task_definition(ecs, task_definition):
             raise e
 
 
-def make_task_definition_name(launch_type, image, fmt=TASK_NAME_FORMAT):
-    hexdigest = hashlib.md5(image.encode('utf-8')).hexdigest()
-    return TASK_NAME_FORMAT.format(
-        hexdigest=hexdigest,
+def task_definition_spec(
+        taskRoleArn,
+        executionRoleArn,
+        image,
+        log_region,
+        log_prefix='ecs',
+        log_group=None,
+        cpu=DEFAULT_CPU,
+        memory=DEFAULT_MEMORY,
+        networkMode=NetworkMode.AWSVPC,
+        launch_type=LaunchType.FARGATE,
+        container_name=CONTAINER_NAME):
+    # Everything that goes into a registration. Sizes are normalized so that
+    # 512 and '512' are the same definition.
+    return {
+        'taskRoleArn': taskRoleArn,
+        'executionRoleArn': executionRoleArn,
+        'image': image,
+        'log_region': log_region,
+        'log_prefix': log_prefix,
+        'log_group': log_group,
+        'cpu': int(cpu),
+        'memory': int(memory),
+        'networkMode': networkMode,
+        'launch_type': launch_type,
+        'container_name': container_name
+    }
+
+
+def spec_fingerprint(spec):
+    data = json.dumps(spec, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+
+def make_task_definition_name(launch_type, fingerprint, fmt=TASK_NAME_FORMAT):
+    # One family per distinct spec, so its revisions never differ
+    return fmt.format(
+        hexdigest=fingerprint,
         launch_type=launch_type
     )
 
 
+def cached_definition(definition):
+    return {
+        'taskDefinitionArn': definition['taskDefinitionArn'],
+        'family': definition['family'],
+        'revision': definition['revision'],
+        'containerDefinitions': definition['containerDefinitions']
+    }
+
+
+class TaskDefinitionStore:
+    # Task definitions by revision ARN, in memory and on disk. A revision
+    # never changes once registered, so entries do not expire.
+
+    def __init__(self, path=None):
+        # Without a path the store follows the current state directory
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded_path = None
+        self.definitions = {}
+
+    def load(self):
+        path = self.path or state_path(TASK_DEFINITIONS_FILE)
+        if path != self.loaded_path:
+            self.definitions = read_json(path, default={})
+            self.loaded_path = path
+        return path
+
+    def get(self, arn):
+        with self.lock:
+            self.load()
+            return self.definitions.get(arn)
+
+    def put(self, definition):
+        definition = cached_definition(definition)
+        with self.lock:
+            path = self.load()
+            self.definitions[definition['taskDefinitionArn']] = definition
+            write_json(path, self.definitions)
+        return definition
+
+
+_store = TaskDefinitionStore()
+# Serializes registration of each spec within the process
+_spec_locks = {}
+_spec_locks_lock = threading.Lock()
+
+
+def spec_lock(fingerprint):
+    with _spec_locks_lock:
+        return _spec_locks.setdefault(fingerprint, threading.Lock())
+
+
+def get_task_definition(ecs, arn, store=None):
+    # Container definitions of a revision, described once per machine
+    store = store or _store
+    definition = store.get(arn)
+    if definition is None:
+        definition = describe_task_definition(ecs=ecs, task_definition=arn)
+        if definition is None:
+            return None
+        definition = store.put(definition)
+    return definition
+
+
 def ensure_task_definition(
         ecs,
         taskRoleArn,
@@ -66,33 +172,77 @@ def ensure_task_definition(
         log_prefix='ecs',
         log_group=None,
         definition_name=None,
+        cpu=DEFAULT_CPU,
+        memory=DEFAULT_MEMORY,
         networkMode=NetworkMode.AWSVPC,
         launch_type=LaunchType.FARGATE,
-        container_name=CONTAINER_NAME):
+        container_name=CONTAINER_NAME,
+        cache=None,
+        store=None):
+    # Returns the revision registered for this exact spec, registering it on
+    # first use. Resolved revisions are cached without expiry in cache (per
+    # account) and store (by ARN); only a cold miss describes the family.
+    spec = task_definition_spec(
+        taskRoleArn=taskRoleArn,
+        executionRoleArn=executionRoleArn,
+        image=image,
+        log_region=log_region,
+        log_prefix=log_prefix,
+        log_group=log_group,
+        cpu=cpu,
+        memory=memory,
+        networkMode=networkMode,
+        launch_type=launch_type,
+        container_name=container_name
+    )
+    fingerprint = spec_fingerprint(spec)
     if definition_name is None:
         definition_name = make_task_definition_name(
             launch_type=launch_type,
-            image=image
-        )
-    definition = describe_task_definition(
-        ecs=ecs, task_definition=definition_name)
-    if definition is None:
-        definition = create_task_definition(
-            ecs=ecs,
-            definition_name=definition_name,
-            taskRoleArn=taskRoleArn,
-            executionRoleArn=executionRoleArn,
-            image=image,
-            log_region=log_region,
-            log_prefix=log_prefix,
-            log_group=log_group,
-            networkMode=NetworkMode.AWSVPC,
-            requiresCompatibilities=LaunchType.FARGATE,
-            container_name=CONTAINER_NAME
+            fingerprint=fingerprint
         )
+    store = store or _store
+    key = 'task_definition:{}:{}'.format(definition_name, fingerprint)
+    with spec_lock(key):
+        if cache is not None:
+            definition = cache.get(key)
+            if definition is not None:
+                return definition
+        definition = describe_task_definition(
+            ecs=ecs, task_definition=definition_name)
+        if definition is not None and definition_fingerprint(definition) != fingerprint:
+            # An explicit definition_name that was registered with another spec
+            definition = None
+        if definition is None:
+            definition = create_task_definition(
+                ecs=ecs,
+                definition_name=definition_name,
+                taskRoleArn=taskRoleArn,
+                executionRoleArn=executionRoleArn,
+                image=image,
+                log_region=log_region,
+                log_prefix=log_prefix,
+                cpu=cpu,
+                memory=memory,
+                log_group=log_group,
+                networkMode=networkMode,
+                requiresCompatibilities=launch_type,
+                container_name=container_name,
+                fingerprint=fingerprint
+            )
+        definition = store.put(definition)
+        if cache is not None:
+            cache.put(key, definition, expires=False)
     return definition
 
 
+def definition_fingerprint(definition):
+    for tag in definition.get('tags', []):
+        if tag['key'] == FINGERPRINT_TAG:
+            return tag['value']
+    return None
+
+
 # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ecs.html#ECS.Client.register_task_definition
 def create_task_definition(
         ecs,
@@ -102,18 +252,36 @@ def create_task_definition(
         image,
         log_region,
         log_prefix='ecs',
-        cpu=512,
-        memory=2048,
+        cpu=DEFAULT_CPU,
+        memory=DEFAULT_MEMORY,
         log_group=None,
         networkMode=NetworkMode.AWSVPC,
         requiresCompatibilities=LaunchType.FARGATE,
-        container_name=CONTAINER_NAME):
-    print("Registering task definition [{}] for image [{}]".format(
+        container_name=CONTAINER_NAME,
+        fingerprint=None):
+    print("Registering task definition [{}] for image [{}] ({} cpu, {} MiB)".format(
         definition_name,
-        image
+        image,
+        cpu,
+        memory
     ))
     if log_group is None:
         log_group = '/ecs/aws-ecs-remote/{}'.format(definition_name)
+    tags = [
+        {
+            'key': 'aws-ecs-remote-image',
+            'value': image
+        },
+        {
+            'key': 'Source',
+            'value': 'aws-ecs-remote'
+        }
+    ]
+    if fingerprint is not None:
+        tags.append({
+            'key': FINGERPRINT_TAG,
+            'value': fingerprint
+        })
     response = ecs.register_task_definition(
         family=definition_name,
         taskRoleArn=taskRoleArn,
@@ -136,7 +304,7 @@ def create_task_definition(
                 'privileged': False,
                 'readonlyRootFilesystem': False,
                 'interactive': False,
-                'memory': memory,
+                'memory': int(memory),
                 'logConfiguration': {
                     'logDriver': LogDriver.AWSLOGS,
                     'options': {
@@ -148,33 +316,25 @@ def create_task_definition(
             },
         ],
         requiresCompatibilities=[requiresCompatibilities],
-        tags=[
-            {
-                'key': 'aws-ecs-remote-image',
-                'value': image
-            },
-            {
-                'key': 'Source',
-                'value': 'aws-ecs-remote'
-            }
-        ]
+        tags=tags
     )
-    return response
+    return response['taskDefinition']
 
 
 if __name__ == "__main__":
-    import boto3
-    from aws_ecs_remote.iam import ensure_task_role, ensure_instance_role
-    session = boto3.Session()
-    ecs = session.client('ecs')
-    iam = session.client('iam')
-    log_region = session.region_name
-    task_role = ensure_task_role(iam=iam)
-    instance_role = ensure_instance_role(iam=iam)
+    from aws_ecs_remote.clients import get_client, get_session
+    from aws_ecs_remote.bucket import default_bucket_name
+    from aws_ecs_remote.iam import ensure_execution_role, ensure_task_role
+    ecs = get_client('ecs')
+    iam = get_client('iam')
+    log_region = get_session().region_name
+    account = get_client('sts').get_caller_identity().get('Account')
+    task_role = ensure_task_role(iam=iam, bucket=default_bucket_name(region=log_region, account=account))
+    execution_role = ensure_execution_role(iam=iam)
     task_definition = ensure_task_definition(
         ecs=ecs,
         taskRoleArn=task_role['Arn'],
-        executionRoleArn=instance_role['Arn'],
+        executionRoleArn=execution_role['Arn'],
         image='683880991063.dkr.ecr.us-east-1.amazonaws.com/columbo-compute',
         log_region=log_region,
         launch_type=LaunchType.FARGATE)
@@ -0,0 +1,57 @@
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+from aws_ecs_remote.metrics import THROTTLE_ERRORS
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+SERVER_ERRORS = (
+    'InternalError',
+    'InternalFailure',
+    'ServerException',
+    'ServiceUnavailable',
+    'RequestTimeout',
+)
+
+
+class TokenBucket:
+    # Client-side rate limiter shared by threads: rate tokens per second,
+    # bursting up to capacity
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # "Full jitter": uniform over the exponential window, so retrying clients spread out
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def is_transient_error(e):
+    # Throttling, server-side errors and dropped connections: worth retrying
+    if isinstance(e, (ConnectionError, HTTPClientError)):
+        return True
+    if not isinstance(e, ClientError):
+        return False
+    code = e.response.get('Error', {}).get('Code')
+    status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+    return code in THROTTLE_ERRORS or code in SERVER_ERRORS or status >= 500
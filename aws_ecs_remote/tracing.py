@@ -0,0 +1,214 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from datetime import datetime
+
+from aws_ecs_remote.state import write_json
+
+METRIC_NAME = 'aws_ecs_remote_span_seconds'
+# Task timestamps that bound the phases ECS spends on a task
+TASK_PHASES = (
+    ('task.provisioning', 'createdAt', 'pullStartedAt'),
+    ('task.image_pull', 'pullStartedAt', 'pullStoppedAt'),
+    ('task.pending', 'createdAt', 'startedAt'),
+    ('task.runtime', 'startedAt', 'executionStoppedAt'),
+    ('task.stopping', 'executionStoppedAt', 'stoppedAt'),
+)
+
+
+class Span:
+
+    def __init__(self, name, start, end, attributes=None, parent=None, thread=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attributes = attributes or {}
+        self.parent = parent
+        self.thread = thread
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.duration,
+            'parent': self.parent,
+            'thread': self.thread,
+            'attributes': self.attributes
+        }
+
+
+class NullTracer:
+    # Default tracer: spans cost a context manager and nothing else
+
+    enabled = False
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        yield attributes
+
+    def record(self, name, start, end, **attributes):
+        pass
+
+
+class Tracer:
+    # Collects spans from every thread. Times are wall-clock seconds so spans
+    # line up with AWS timestamps. hooks are called with each finished Span.
+
+    enabled = True
+
+    def __init__(self, hooks=(), labels=None):
+        self.hooks = list(hooks)
+        self.labels = dict(labels or {})
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        # The yielded dict can be updated with attributes known only at the end
+        stack = self.local.__dict__.setdefault('stack', [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        start = time.time()
+        try:
+            yield attributes
+        finally:
+            stack.pop()
+            self.finish(Span(name, start, time.time(), attributes, parent=parent,
+                             thread=threading.current_thread().name))
+
+    def record(self, name, start, end, **attributes):
+        # Span measured elsewhere, e.g. from task timestamps
+        self.finish(Span(name, start, end, attributes))
+
+    def finish(self, span):
+        with self.lock:
+            self.spans.append(span)
+        for hook in self.hooks:
+            hook(span)
+
+    def summary(self):
+        # {name: {count, sum, max}}
+        summary = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            entry = summary.setdefault(span.name, {'count': 0, 'sum': 0., 'max': 0.})
+            entry['count'] += 1
+            entry['sum'] += span.duration
+            entry['max'] = max(entry['max'], span.duration)
+        return summary
+
+    def timeline(self):
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return {
+            'labels': self.labels,
+            'spans': [span.to_dict() for span in spans],
+            'summary': self.summary()
+        }
+
+    def prometheus(self):
+        labels = ''.join(',{}="{}"'.format(key, escape_label(value)) for key, value in sorted(self.labels.items()))
+        lines = [
+            '# HELP {} Duration of aws-ecs-remote phases'.format(METRIC_NAME),
+            '# TYPE {} summary'.format(METRIC_NAME),
+        ]
+        summary = self.summary()
+        for name in sorted(summary):
+            lines.append('{}_sum{{span="{}"{}}} {:.6f}'.format(
+                METRIC_NAME, escape_label(name), labels, summary[name]['sum']))
+            lines.append('{}_count{{span="{}"{}}} {}'.format(
+                METRIC_NAME, escape_label(name), labels, summary[name]['count']))
+        lines.append('# HELP {}_max Longest span of each phase'.format(METRIC_NAME))
+        lines.append('# TYPE {}_max gauge'.format(METRIC_NAME))
+        for name in sorted(summary):
+            lines.append('{}_max{{span="{}"{}}} {:.6f}'.format(
+                METRIC_NAME, escape_label(name), labels, summary[name]['max']))
+        return '\n'.join(lines) + '\n'
+
+    def write_timeline(self, path):
+        write_json(path, self.timeline())
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+
+
+# Per context rather than per process, so concurrent runs (threads or
+# asyncio tasks) each trace to their own tracer. Pools started by a run pick
+# it up through in_context.
+_tracer = contextvars.ContextVar('aws_ecs_remote_tracer', default=NullTracer())
+
+
+def get_tracer():
+    return _tracer.get()
+
+
+@contextlib.contextmanager
+def use_tracer(tracer):
+    token = _tracer.set(tracer if tracer is not None else NullTracer())
+    try:
+        yield tracer
+    finally:
+        _tracer.reset(token)
+
+
+def in_context(fn):
+    # Wraps fn to run in a copy of the caller's context (and so with its
+    # tracer) from worker threads, which otherwise start from an empty one
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def span(name, **attributes):
+    return _tracer.get().span(name, **attributes)
+
+
+def write_trace(tracer, trace_dir, name):
+    # {trace_dir}/{name}.trace.json and {name}.prom
+    if not tracer.enabled:
+        return
+    os.makedirs(trace_dir, exist_ok=True)
+    tracer.labels.setdefault('run', name)
+    tracer.write_timeline(os.path.join(trace_dir, '{}.trace.json'.format(name)))
+    tracer.write_prometheus(os.path.join(trace_dir, '{}.prom'.format(name)))
+
+
+def escape_label(value):
+    # Prometheus text format: backslash, double quote and newline are escaped
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def timestamp_seconds(value):
+    # boto3 returns datetimes; EventBridge events carry ISO 8601 strings
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.timestamp()
+
+
+def record_task_phases(task):
+    tracer = _tracer.get()
+    if not tracer.enabled:
+        return
+    for name, start_field, end_field in TASK_PHASES:
+        start = timestamp_seconds(task.get(start_field))
+        end = timestamp_seconds(task.get(end_field))
+        if start is not None and end is not None:
+            tracer.record(name, start, end, task=task['taskArn'])
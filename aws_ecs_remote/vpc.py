@@ -13,7 +13,13 @@ AVAILABLE = 'available'
 def ensure_security_group(
         ec2, vpc_id,
         security_group_name=SECURITY_GROUP_NAME,
-        description=SECURITY_GROUP_DESCRIPTION):
+        description=SECURITY_GROUP_DESCRIPTION,
+        cache=None):
+    key = 'security_group:{}:{}'.format(vpc_id, security_group_name)
+    if cache is not None:
+        security_group = cache.get(key)
+        if security_group is not None:
+            return security_group
     security_group = get_security_group(
         ec2=ec2,
         vpc_id=vpc_id,
@@ -26,6 +32,10 @@ def ensure_security_group(
             security_group_name=security_group_name,
             description=description
         )
+    if cache is not None:
+        cache.put(key, {
+            'GroupId': security_group['GroupId']
+        })
     return security_group
 
 
@@ -197,8 +207,13 @@ def await_vpc(ec2, vpc, poll_sec=6, poll_iter=10):
 
 
 def ensure_vpc(
-    ec2, region, vpc_name=VPC_NAME, cidr=VPC_CIDR
+    ec2, region, vpc_name=VPC_NAME, cidr=VPC_CIDR, cache=None
 ):
+    key = 'vpc:{}'.format(vpc_name)
+    if cache is not None:
+        vpc = cache.get(key)
+        if vpc is not None:
+            return vpc
     vpc = get_vpc(
         ec2=ec2,
         vpc_name=vpc_name
@@ -210,6 +225,11 @@ def ensure_vpc(
             cidr=cidr,
             region=region
         )
+    if cache is not None and vpc['State'] == AVAILABLE:
+        cache.put(key, {
+            'VpcId': vpc['VpcId'],
+            'State': vpc['State']
+        })
     return vpc
 
 
@@ -301,10 +321,32 @@ def create_subnet(ec2, vpc_id, availability_zone_id, cidr):
     return subnet
 
 
+def get_subnets(ec2, vpc_id, cache=None):
+    key = 'subnets:{}'.format(vpc_id)
+    if cache is not None:
+        subnets = cache.get(key)
+        if subnets:
+            return subnets
+    response = ec2.describe_subnets(
+        Filters=[
+            {
+                'Name': 'vpc-id',
+                'Values': [vpc_id]
+            },
+        ])
+    subnets = response['Subnets']
+    if cache is not None and subnets:
+        cache.put(key, [
+            {'SubnetId': subnet['SubnetId']}
+            for subnet in subnets
+        ])
+    return subnets
+
+
 if __name__ == "__main__":
-    import boto3
-    session = boto3.Session()
-    ec2 = session.client('ec2')
+    from aws_ecs_remote.clients import get_client, get_session
+    session = get_session()
+    ec2 = get_client('ec2')
     vpc = ensure_vpc(ec2=ec2, region=session.region_name)
     vpc_id = vpc['VpcId']
     sg = ensure_security_group(
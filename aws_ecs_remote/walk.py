@@ -0,0 +1,182 @@
+import os
+import re
+
+IGNORE_FILES = ('.gitignore', '.ecsremoteignore')
+DEFAULT_IGNORE = [
+    '.git/',
+    '.hg/',
+    '.svn/',
+    '__pycache__/',
+    '*.py[cod]',
+    '.venv/',
+    '.tox/',
+    '.nox/',
+    '.mypy_cache/',
+    '.pytest_cache/',
+    '.ipynb_checkpoints/',
+]
+# A directory holding this file is a virtualenv, whatever it is called
+VIRTUALENV_MARKER = 'pyvenv.cfg'
+
+
+def translate_pattern(pattern):
+    # gitignore glob to regex over '/'-separated paths relative to the ignore file
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    i = 0
+    n = len(pattern)
+    parts = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i) and i + 2 == n:
+            parts.append('.*')
+            i += 2
+        elif c == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif c == '?':
+            parts.append('[^/]')
+            i += 1
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                parts.append(re.escape(c))
+                i += 1
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append('[{}]'.format(body.replace('\\', '\\\\')))
+                i = j + 1
+        elif c == '\\' and i + 1 < n:
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(c))
+            i += 1
+    regex = ''.join(parts)
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return regex
+
+
+class IgnoreRules:
+    # Rules from one ignore file; base is its directory relative to the walk root
+
+    def __init__(self, patterns, base=''):
+        self.base = base
+        self.rules = []
+        for line in patterns:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            elif line.startswith('\\'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            self.rules.append((re.compile(translate_pattern(line) + r'\Z'), negate, dir_only))
+        # Without negations the last-match-wins order does not matter, so one
+        # alternation answers each query
+        self.combined = not any(negate for _, negate, _ in self.rules)
+        self.files_regex = self.combine(rule for rule in self.rules if not rule[2])
+        self.dirs_regex = self.combine(self.rules)
+
+    @staticmethod
+    def combine(rules):
+        patterns = ['(?:{})'.format(regex.pattern) for regex, _, _ in rules]
+        if not patterns:
+            return None
+        return re.compile('|'.join(patterns))
+
+    @classmethod
+    def from_file(cls, path, base=''):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return cls(f.readlines(), base=base)
+
+    def match(self, rel_path, is_dir):
+        # True to ignore, False to keep, None if no rule applies
+        if self.base:
+            if not rel_path.startswith(self.base + '/'):
+                return None
+            rel_path = rel_path[len(self.base) + 1:]
+        if self.combined:
+            regex = self.dirs_regex if is_dir else self.files_regex
+            if regex is not None and regex.match(rel_path):
+                return True
+            return None
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return None
+
+
+def is_ignored(rules_chain, rel_path, is_dir):
+    for rules in reversed(rules_chain):
+        result = rules.match(rel_path, is_dir)
+        if result is not None:
+            return result
+    return False
+
+
+def walk_files(path, ignore_files=IGNORE_FILES, default_ignore=DEFAULT_IGNORE, include_hidden=False):
+    # Yields '/'-separated paths of files under path. Ignored directories are
+    # pruned without being listed. Nested ignore files apply below their directory.
+    root_rules = [IgnoreRules(default_ignore)] if default_ignore else []
+    stack = [(path, '', root_rules)]
+    while stack:
+        dir_path, dir_rel, rules_chain = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except (PermissionError, FileNotFoundError):
+            continue
+        names = set(entry.name for entry in entries)
+        if dir_rel and VIRTUALENV_MARKER in names:
+            continue
+        for ignore_file in ignore_files:
+            if ignore_file in names:
+                rules_chain = rules_chain + [IgnoreRules.from_file(
+                    os.path.join(dir_path, ignore_file), base=dir_rel)]
+        subdirs = []
+        for entry in entries:
+            if not include_hidden and entry.name.startswith('.'):
+                continue
+            rel = entry.name if not dir_rel else '{}/{}'.format(dir_rel, entry.name)
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if is_ignored(rules_chain, rel, is_dir):
+                continue
+            if is_dir:
+                subdirs.append((entry.path, rel, rules_chain))
+            else:
+                yield rel
+        # Reverse so directories pop in name order
+        stack.extend(sorted(subdirs, key=lambda subdir: subdir[1], reverse=True))
+
+
+def list_files(path, ignore_files=IGNORE_FILES, default_ignore=DEFAULT_IGNORE, include_hidden=False):
+    return sorted(walk_files(
+        path,
+        ignore_files=ignore_files,
+        default_ignore=default_ignore,
+        include_hidden=include_hidden
+    ))
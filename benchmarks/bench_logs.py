@@ -0,0 +1,78 @@
+from aws_ecs_remote.cloudwatch import LogStrategy, LogTailer, handle_log_events
+
+from benchmarks.common import best_of, make_parser, results_document, write_results
+from benchmarks.fakes import FakeLogs
+
+GROUP = '/ecs/bench'
+
+
+def make_logs(streams, events, latency):
+    logs = FakeLogs(latency=latency)
+    log_streams = []
+    for i in range(streams):
+        name = 'ecs/container/{:032x}'.format(i)
+        logs.add_stream(GROUP, name, events)
+        log_streams.append({'group': GROUP, 'stream': name, 'taskArn': 'task/{}'.format(i)})
+    return logs, log_streams
+
+
+def drain_handle_log_events(logs, log_streams):
+    # The original follower: one get_log_events per stream per poll
+    count = [0]
+
+    def handler(event):
+        count[0] += 1
+    tokens = None
+    polls = 0
+    while True:
+        before = count[0]
+        tokens = handle_log_events(logs=logs, log_streams=log_streams, tokens=tokens, log_handler=handler)
+        polls += 1
+        if count[0] == before:
+            return count[0], polls
+
+
+def drain_tailer(logs, log_streams, strategy):
+    count = [0]
+
+    def handler(event):
+        count[0] += 1
+    tailer = LogTailer(logs=logs, log_streams=log_streams, strategy=strategy, log_handler=handler)
+    polls = 0
+    while True:
+        polls += 1
+        if not tailer.poll():
+            return count[0], polls
+
+
+def main(argv=None):
+    parser = make_parser('Read large fake log streams to the end')
+    parser.add_argument('--streams', type=int, default=100)
+    parser.add_argument('--events', type=int, default=5000, help='Events per stream')
+    args = parser.parse_args(argv)
+    latency = args.latency_ms / 1000.
+    cases = [
+        ('handle_log_events', drain_handle_log_events),
+        ('tailer-get', lambda logs, streams: drain_tailer(logs, streams, LogStrategy.GET)),
+        ('tailer-filter', lambda logs, streams: drain_tailer(logs, streams, LogStrategy.FILTER)),
+    ]
+    results = []
+    for name, drain in cases:
+        def run():
+            logs, log_streams = make_logs(args.streams, args.events, latency)
+            events, polls = drain(logs, log_streams)
+            return logs, events, polls
+        seconds, (logs, events, polls) = best_of(args.repeat, run)
+        results.append({
+            'case': name,
+            'seconds': seconds,
+            'events': events,
+            'events_per_sec': events / seconds,
+            'polls': polls,
+            'calls': dict(logs.calls)
+        })
+    write_results(results_document('logs', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import os
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+from aws_ecs_remote import ecs as ecs_module
+from aws_ecs_remote.run_task import run_task
+
+from benchmarks.common import make_parser, quiet_stdout, results_document, state_directory, \
+    temporary_directory, write_results
+from benchmarks.fakes import FakeSession
+
+SCRIPT = 'print("hello")\n'
+
+
+@contextmanager
+def no_poll_sleep():
+    # Fake tasks stop after a couple of describes; waiting between them is not
+    # overhead. Only ecs sees the stub, so fake API latency still sleeps.
+    with mock.patch.object(ecs_module, 'time', SimpleNamespace(sleep=lambda seconds: None, time=time.time)):
+        yield
+
+
+def main(argv=None):
+    parser = make_parser('Full run_task against fake AWS clients')
+    parser.add_argument('--files', type=int, default=100, help='Files in the source tree')
+    args = parser.parse_args(argv)
+    latency = args.latency_ms / 1000.
+    results = []
+    with temporary_directory() as src, state_directory(), no_poll_sleep():
+        for i in range(args.files):
+            with open(os.path.join(src, 'module{:04d}.py'.format(i)), 'w') as f:
+                f.write(SCRIPT)
+        script = os.path.join(src, 'module0000.py')
+        # One session: the first run provisions everything, later runs hit the infra cache
+        session = FakeSession(latency=latency)
+        for i in range(max(args.repeat, 2)):
+            case = 'cold' if i == 0 else 'warm'
+            before = session.calls()
+            start = time.perf_counter()
+            with quiet_stdout():
+                run_task(cluster='bench', script=script, session=session, wait=True, quiet=True)
+            seconds = time.perf_counter() - start
+            calls = {op: count - before.get(op, 0) for op, count in session.calls().items()}
+            results.append({
+                'case': case,
+                'seconds': seconds,
+                'api_calls': sum(calls.values()),
+                'calls': {op: count for op, count in calls.items() if count}
+            })
+    write_results(results_document('run_task', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+from aws_ecs_remote.ecs import FleetTracker, tasks_stopped
+
+from benchmarks.common import best_of, make_parser, results_document, write_results
+from benchmarks.fakes import FakeECS
+
+CLUSTER = 'bench'
+
+
+def main(argv=None):
+    parser = make_parser('Poll the status of many fake tasks')
+    parser.add_argument('--tasks', type=int, default=5000)
+    parser.add_argument('--stop-after', type=int, default=5, help='Describes until a task stops')
+    args = parser.parse_args(argv)
+    latency = args.latency_ms / 1000.
+    results = []
+
+    def run_stopped():
+        ecs = FakeECS(latency=latency, stop_after=1)
+        arns = ecs.add_tasks(args.tasks)
+        return ecs, tasks_stopped(ecs=ecs, cluster=CLUSTER, task_arns=arns)
+    seconds, (ecs, stopped) = best_of(args.repeat, run_stopped)
+    results.append({'case': 'tasks_stopped', 'seconds': seconds, 'stopped': stopped, 'calls': dict(ecs.calls)})
+
+    def run_tracker():
+        ecs = FakeECS(latency=latency, stop_after=args.stop_after)
+        arns = ecs.add_tasks(args.tasks)
+        tracker = FleetTracker(ecs=ecs, cluster=CLUSTER, task_arns=arns)
+        polls = 0
+        while not tracker.done:
+            tracker.poll()
+            polls += 1
+        return ecs, polls
+    # Polls back to back: the interval between them is not what is measured
+    seconds, (ecs, polls) = best_of(args.repeat, run_tracker)
+    results.append({
+        'case': 'fleet_tracker',
+        'seconds': seconds,
+        'polls': polls,
+        'seconds_per_poll': seconds / polls,
+        'calls': dict(ecs.calls)
+    })
+    write_results(results_document('status', vars(args), results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import os
+
+from aws_ecs_remote.archive import ArchiveFormat
+from aws_ecs_remote.bucket import upload_archive, upload_as_zip, upload_content_addressed
+
+from benchmarks.common import best_of, make_parser, quiet_stdout, results_document, state_directory, \
+    temporary_directory, write_results
+from benchmarks.fakes import FakeS3
+
+MB = 1024 * 1024
+ARCHIVE_FORMATS = [ArchiveFormat.ZIP_STORED]
+try:
+    import zstandard  # noqa: F401
+    ARCHIVE_FORMATS.append(ArchiveFormat.TAR_ZSTD)
+except ImportError:
+    pass
+# Repeating one random block makes data that compresses like typical binaries
+BLOCK_SIZE = 64 * 1024
+
+
+def write_tree(root, small_files, small_size, large_files, large_size):
+    os.makedirs(root, exist_ok=True)
+    block = os.urandom(BLOCK_SIZE)
+    text = (b'import os\nprint("hello world")\n' * (small_size // 32 + 1))[:small_size]
+    for i in range(small_files):
+        directory = os.path.join(root, 'pkg{:03d}'.format(i // 100))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'module{:05d}.py'.format(i)), 'wb') as f:
+            f.write(text)
+    for i in range(large_files):
+        with open(os.path.join(root, 'data{}.bin'.format(i)), 'wb') as f:
+            remaining = large_size
+            while remaining > 0:
+                chunk = block[:min(BLOCK_SIZE, remaining)]
+                f.write(chunk)
+                remaining -= len(chunk)
+
+
+def tree_bytes(root):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(root)
+        for name in names
+    )
+
+
+def measure(name, repeat, root, upload, latency=0.):
+    def run():
+        s3 = FakeS3(latency=latency)
+        with quiet_stdout():
+            upload(s3)
+        return s3
+    seconds, s3 = best_of(repeat, run)
+    source_bytes = tree_bytes(root)
+    return {
+        'case': name,
+        'seconds': seconds,
+        'source_bytes': source_bytes,
+        'source_mb_per_sec': source_bytes / MB / seconds,
+        'uploaded_bytes': s3.bytes_uploaded,
+        'calls': dict(s3.calls)
+    }
+
+
+def main(argv=None):
+    parser = make_parser('Package and upload synthetic source trees to a fake S3')
+    parser.add_argument('--small-files', type=int, default=10000)
+    parser.add_argument('--small-size', type=int, default=2048, help='Bytes per small file')
+    parser.add_argument('--large-files', type=int, default=2)
+    parser.add_argument('--large-size-mb', type=int, default=2048, help='MB per large file')
+    parser.add_argument('--workers', type=int, default=None, help='Compression processes')
+    args = parser.parse_args(argv)
+    latency = args.latency_ms / 1000.
+    params = vars(args)
+    results = []
+    with temporary_directory() as root, state_directory():
+        small = os.path.join(root, 'small')
+        large = os.path.join(root, 'large')
+        write_tree(small, args.small_files, args.small_size, 0, 0)
+        write_tree(large, 0, 0, args.large_files, args.large_size_mb * MB)
+        for tree_name, tree in (('small', small), ('large', large)):
+            results.append(measure('{}/upload_as_zip'.format(tree_name), args.repeat, tree, lambda s3: upload_as_zip(
+                s3=s3, path=tree, bucket='bench', key='src.zip', workers=args.workers, quiet=True), latency))
+            for archive_format in ARCHIVE_FORMATS:
+                results.append(measure(
+                    '{}/{}'.format(tree_name, archive_format), args.repeat, tree, lambda s3: upload_archive(
+                        s3=s3, path=tree, bucket='bench', key='src', archive_format=archive_format,
+                        workers=args.workers, quiet=True), latency))
+            # Cold: nothing hashed or uploaded yet. Warm: index and blobs already present.
+            s3 = FakeS3(latency=latency)
+            for case in ('cold', 'warm'):
+                before = dict(s3.calls)
+                with quiet_stdout():
+                    seconds, _ = best_of(1, lambda: upload_content_addressed(
+                        s3=s3, path=tree, bucket='bench', quiet=True))
+                results.append({
+                    'case': '{}/cas-blobs-{}'.format(tree_name, case),
+                    'seconds': seconds,
+                    'source_bytes': tree_bytes(tree),
+                    'calls': {op: count - before.get(op, 0) for op, count in s3.calls.items()}
+                })
+    write_results(results_document('upload', params, results), args.output)
+
+
+if __name__ == '__main__':
+    main()
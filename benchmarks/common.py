@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+RESULTS_VERSION = 1
+
+
+def make_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', default=None, help='Write results JSON here (default: stdout)')
+    parser.add_argument('--latency-ms', type=float, default=0.,
+                        help='Simulated round trip of every fake AWS call (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the best is reported')
+    return parser
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def results_document(benchmark, params, results):
+    return {
+        'version': RESULTS_VERSION,
+        'benchmark': benchmark,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': environment(),
+        'params': params,
+        'results': results
+    }
+
+
+def write_results(document, output=None):
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def best_of(repeat, fn):
+    # Runs fn repeat times; returns (best seconds, result of the best run)
+    best = None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, result)
+    return best
+
+
+@contextmanager
+def quiet_stdout():
+    # The library prints progress; keep it out of the results
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+@contextmanager
+def temporary_directory(prefix='aws-ecs-remote-bench-'):
+    path = tempfile.mkdtemp(prefix=prefix)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def state_directory():
+    # Keep index and infra caches out of the user's real state directory
+    from aws_ecs_remote.state import STATE_DIR_ENV
+    previous = os.environ.get(STATE_DIR_ENV)
+    with temporary_directory(prefix='aws-ecs-remote-bench-state-') as path:
+        os.environ[STATE_DIR_ENV] = path
+        try:
+            yield path
+        finally:
+            if previous is None:
+                os.environ.pop(STATE_DIR_ENV, None)
+            else:
+                os.environ[STATE_DIR_ENV] = previous
@@ -0,0 +1,501 @@
+import io
+import itertools
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import botocore.session
+from botocore import xform_name
+from botocore.exceptions import ClientError
+from botocore.validate import validate_parameters
+
+# In-memory stand-ins for the AWS clients aws-ecs-remote uses. Each call
+# sleeps for latency seconds (to model a round trip) and is counted.
+
+REGION = 'us-east-1'
+ACCOUNT = '123456789012'
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class FakeClient:
+
+    def __init__(self, latency=0.):
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def call(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class ModelCheckedClient:
+    # Validates the requests to and responses from a fake client against the
+    # botocore service model, so the fakes cannot drift from the real API
+
+    def __init__(self, client, service_name):
+        self.client = client
+        self.model = botocore.session.get_session().get_service_model(service_name)
+        self.operations = dict((xform_name(name), name) for name in self.model.operation_names)
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name not in self.operations:
+            return attr
+        operation_model = self.model.operation_model(self.operations[name])
+
+        def call(**kwargs):
+            if operation_model.input_shape is not None:
+                validate_parameters(kwargs, operation_model.input_shape)
+            response = attr(**kwargs)
+            if operation_model.output_shape is not None:
+                validate_parameters(response or {}, operation_model.output_shape)
+            return response
+        return call
+
+
+class FakePaginator:
+
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        return [self.method(**kwargs)]
+
+
+class FakeS3(FakeClient):
+    # Keeps object sizes and ETags only; bodies are read and discarded unless
+    # keep_bodies is set, for tests that read objects back
+
+    def __init__(self, latency=0., keep_bodies=False):
+        super(FakeS3, self).__init__(latency=latency)
+        self.keep_bodies = keep_bodies
+        self.buckets = set()
+        self.objects = {}
+        self.bodies = {}
+        self.uploads = {}
+        self.bytes_uploaded = 0
+
+    def store(self, key, data_size, etag):
+        with self.lock:
+            self.objects[key] = {'Size': data_size, 'ETag': etag}
+            self.bytes_uploaded += data_size
+
+    @staticmethod
+    def body_size(body):
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            return len(body)
+        size = 0
+        for chunk in iter(lambda: body.read(1024 * 1024), b''):
+            size += len(chunk)
+        return size
+
+    def head_bucket(self, Bucket):
+        self.call('HeadBucket')
+        if Bucket not in self.buckets:
+            raise client_error('404', 'HeadBucket')
+
+    def create_bucket(self, Bucket, **kwargs):
+        self.call('CreateBucket')
+        self.buckets.add(Bucket)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.call('HeadObject')
+        if Key not in self.objects:
+            raise client_error('404', 'HeadObject')
+        return {'ContentLength': self.objects[Key]['Size'], 'ETag': self.objects[Key]['ETag']}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.call('PutObject')
+        if self.keep_bodies:
+            data = bytes(Body) if isinstance(Body, (bytes, bytearray, memoryview)) else Body.read()
+            with self.lock:
+                self.bodies[Key] = data
+            self.store(Key, len(data), '"{}"'.format(uuid.uuid4().hex))
+        else:
+            self.store(Key, self.body_size(Body), '"{}"'.format(uuid.uuid4().hex))
+        return {'ETag': self.objects[Key]['ETag']}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.call('GetObject')
+        if Key not in self.objects:
+            raise client_error('NoSuchKey', 'GetObject')
+        if Key not in self.bodies:
+            raise ValueError("FakeS3 kept no body for [{}]; use keep_bodies=True".format(Key))
+        obj = self.objects[Key]
+        return {'Body': io.BytesIO(self.bodies[Key]), 'ContentLength': obj['Size'], 'ETag': obj['ETag']}
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', **kwargs):
+        self.call('ListObjectsV2')
+        with self.lock:
+            contents = [
+                {'Key': key, 'Size': obj['Size'], 'ETag': obj['ETag']}
+                for key, obj in sorted(self.objects.items())
+                if key.startswith(Prefix) and key > StartAfter
+            ]
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+    def get_paginator(self, operation_name):
+        # Every listing here fits on one page
+        assert operation_name == 'list_objects_v2'
+        return FakePaginator(self.list_objects_v2)
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        self.call('UploadFile')
+        self.store(Key, os.path.getsize(Filename), '"{}"'.format(uuid.uuid4().hex))
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.call('CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.call('UploadPart')
+        if self.keep_bodies:
+            part = bytes(Body)
+        else:
+            part = self.body_size(Body)
+        with self.lock:
+            self.uploads[UploadId][PartNumber] = part
+        return {'ETag': '"{}-{}"'.format(UploadId, PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self.call('CompleteMultipartUpload')
+        with self.lock:
+            parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        if numbers != sorted(parts):
+            raise client_error('InvalidPartOrder', 'CompleteMultipartUpload')
+        etag = '"{}-{}"'.format(uuid.uuid4().hex, len(parts))
+        if self.keep_bodies:
+            data = b''.join(parts[number] for number in numbers)
+            with self.lock:
+                self.bodies[Key] = data
+            self.store(Key, len(data), etag)
+        else:
+            self.store(Key, sum(parts.values()), etag)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.call('AbortMultipartUpload')
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+
+
+class FakeLogs(FakeClient):
+    # Streams are lists of events; tokens are offsets
+
+    def __init__(self, latency=0.):
+        super(FakeLogs, self).__init__(latency=latency)
+        self.groups = set()
+        self.streams = {}
+
+    def add_stream(self, group, stream, events, start=0):
+        self.streams[(group, stream)] = [
+            {
+                'timestamp': start + i,
+                'message': 'line {} of {}'.format(i, stream),
+                'ingestionTime': start + i
+            }
+            for i in range(events)
+        ]
+
+    def create_log_group(self, logGroupName):
+        self.call('CreateLogGroup')
+        if logGroupName in self.groups:
+            raise client_error('ResourceAlreadyExistsException', 'CreateLogGroup')
+        self.groups.add(logGroupName)
+
+    def get_log_events(self, logGroupName, logStreamName, limit=10000, startFromHead=True, nextToken=None):
+        self.call('GetLogEvents')
+        events = self.streams.get((logGroupName, logStreamName))
+        if events is None:
+            raise client_error('ResourceNotFoundException', 'GetLogEvents')
+        start = int(nextToken[2:]) if nextToken else 0
+        page = events[start:start + limit]
+        return {
+            'events': page,
+            'nextForwardToken': 'f/{}'.format(start + len(page)),
+            'nextBackwardToken': 'b/{}'.format(start)
+        }
+
+    def filter_log_events(self, logGroupName, logStreamNames, startTime=0, nextToken=None, limit=10000, **kwargs):
+        self.call('FilterLogEvents')
+        events = sorted(
+            (
+                # Only filter_log_events gives events an id
+                dict(event, logStreamName=stream, eventId='{}-{}'.format(stream, i))
+                for stream in logStreamNames
+                for i, event in enumerate(self.streams.get((logGroupName, stream), []))
+                if event['timestamp'] >= startTime
+            ),
+            key=lambda event: (event['timestamp'], event['eventId'])
+        )
+        start = int(nextToken) if nextToken else 0
+        response = {'events': events[start:start + limit], 'searchedLogStreams': []}
+        if start + limit < len(events):
+            response['nextToken'] = str(start + limit)
+        return response
+
+
+class FakeECS(FakeClient):
+    # Tasks move PROVISIONING -> RUNNING -> STOPPED over stop_after describes
+
+    def __init__(self, latency=0., stop_after=2):
+        super(FakeECS, self).__init__(latency=latency)
+        self.stop_after = stop_after
+        self.clusters = {}
+        self.definitions = {}
+        self.tags = {}
+        self.tasks = {}
+        self.revisions = itertools.count(1)
+
+    def describe_clusters(self, clusters, include=None):
+        self.call('DescribeClusters')
+        return {'clusters': [self.clusters[name] for name in clusters if name in self.clusters]}
+
+    def create_cluster(self, clusterName, **kwargs):
+        self.call('CreateCluster')
+        cluster = {
+            'clusterName': clusterName,
+            'clusterArn': 'arn:aws:ecs:{}:{}:cluster/{}'.format(REGION, ACCOUNT, clusterName)
+        }
+        self.clusters[clusterName] = cluster
+        return {'cluster': cluster}
+
+    def describe_task_definition(self, taskDefinition, include=None):
+        self.call('DescribeTaskDefinition')
+        family = taskDefinition.split('/')[-1].split(':')[0]
+        if family not in self.definitions:
+            raise client_error('ClientException', 'DescribeTaskDefinition')
+        response = {'taskDefinition': self.definitions[family]}
+        if include and 'TAGS' in include:
+            response['tags'] = self.tags[family]
+        return response
+
+    def register_task_definition(self, family, tags=(), **kwargs):
+        self.call('RegisterTaskDefinition')
+        revision = next(self.revisions)
+        definition = dict(
+            kwargs,
+            family=family,
+            revision=revision,
+            status='ACTIVE',
+            taskDefinitionArn='arn:aws:ecs:{}:{}:task-definition/{}:{}'.format(REGION, ACCOUNT, family, revision)
+        )
+        self.definitions[family] = definition
+        self.tags[family] = list(tags)
+        return {'taskDefinition': definition, 'tags': list(tags)}
+
+    def make_task(self, cluster, task_definition, overrides):
+        arn = 'arn:aws:ecs:{}:{}:task/{}/{}'.format(REGION, ACCOUNT, cluster.split('/')[-1], uuid.uuid4().hex)
+        containers = [
+            {'name': override['name'], 'taskArn': arn}
+            for override in overrides.get('containerOverrides', [])
+        ]
+        return {
+            'taskArn': arn,
+            'clusterArn': cluster,
+            'taskDefinitionArn': task_definition,
+            'lastStatus': 'PROVISIONING',
+            'containers': containers,
+            'createdAt': datetime.now(timezone.utc)
+        }
+
+    def run_task(self, cluster, taskDefinition, overrides=None, count=1, **kwargs):
+        self.call('RunTask')
+        tasks = [self.make_task(cluster, taskDefinition, overrides or {}) for _ in range(count)]
+        with self.lock:
+            for task in tasks:
+                self.tasks[task['taskArn']] = dict(task, polls=0)
+        return {'tasks': tasks, 'failures': []}
+
+    def add_tasks(self, count, cluster='arn:aws:ecs:{}:{}:cluster/bench'.format(REGION, ACCOUNT)):
+        # Tasks launched elsewhere, for status benchmarks
+        return [
+            task['taskArn']
+            for task in self.run_task(cluster, 'bench:1', {'containerOverrides': [{'name': 'container'}]},
+                                      count=count)['tasks']
+        ]
+
+    def describe_tasks(self, cluster, tasks, **kwargs):
+        self.call('DescribeTasks')
+        if len(tasks) > 100:
+            raise client_error('InvalidParameterException', 'DescribeTasks')
+        described = []
+        failures = []
+        with self.lock:
+            for arn in tasks:
+                task = self.tasks.get(arn)
+                if task is None:
+                    failures.append({'arn': arn, 'reason': 'MISSING'})
+                    continue
+                task['polls'] += 1
+                if task['polls'] >= self.stop_after and task['lastStatus'] != 'STOPPED':
+                    now = datetime.now(timezone.utc)
+                    task.update(
+                        lastStatus='STOPPED',
+                        stoppedReason='Essential container in task exited',
+                        startedAt=task['createdAt'] + timedelta(seconds=1),
+                        executionStoppedAt=now,
+                        stoppedAt=now
+                    )
+                    for container in task['containers']:
+                        container['exitCode'] = 0
+                elif task['lastStatus'] == 'PROVISIONING':
+                    task['lastStatus'] = 'RUNNING'
+                described.append({key: value for key, value in task.items() if key != 'polls'})
+        return {'tasks': described, 'failures': failures}
+
+
+class FakeIAM(FakeClient):
+
+    def __init__(self, latency=0.):
+        super(FakeIAM, self).__init__(latency=latency)
+        self.roles = {}
+        self.attached = {}
+        self.inline = {}
+
+    def get_role(self, RoleName):
+        self.call('GetRole')
+        if RoleName not in self.roles:
+            raise client_error('NoSuchEntity', 'GetRole')
+        return {'Role': self.roles[RoleName]}
+
+    def create_role(self, RoleName, **kwargs):
+        self.call('CreateRole')
+        role = {
+            'Path': '/',
+            'RoleName': RoleName,
+            'RoleId': 'AROA{}'.format(uuid.uuid4().hex[:16].upper()),
+            'Arn': 'arn:aws:iam::{}:role/{}'.format(ACCOUNT, RoleName),
+            'CreateDate': datetime.now(timezone.utc)
+        }
+        self.roles[RoleName] = role
+        self.attached[RoleName] = []
+        return {'Role': role}
+
+    def attach_role_policy(self, RoleName, PolicyArn):
+        self.call('AttachRolePolicy')
+        if PolicyArn not in self.attached[RoleName]:
+            self.attached[RoleName].append(PolicyArn)
+
+    def detach_role_policy(self, RoleName, PolicyArn):
+        self.call('DetachRolePolicy')
+        self.attached[RoleName].remove(PolicyArn)
+
+    def put_role_policy(self, RoleName, PolicyName, PolicyDocument):
+        self.call('PutRolePolicy')
+        self.inline.setdefault(RoleName, {})[PolicyName] = PolicyDocument
+
+    def get_paginator(self, operation_name):
+        # Every listing here fits on one page
+        assert operation_name == 'list_attached_role_policies'
+        return FakePaginator(self.list_attached_role_policies)
+
+    def list_attached_role_policies(self, RoleName):
+        self.call('ListAttachedRolePolicies')
+        return {'AttachedPolicies': [{'PolicyArn': arn} for arn in self.attached[RoleName]]}
+
+
+class FakeEC2(FakeClient):
+
+    def __init__(self, latency=0.):
+        super(FakeEC2, self).__init__(latency=latency)
+        self.vpcs = []
+        self.security_groups = []
+        self.subnets = []
+        self.gateways = []
+
+    def describe_vpcs(self, Filters=None, VpcIds=None):
+        self.call('DescribeVpcs')
+        return {'Vpcs': list(self.vpcs)}
+
+    def create_vpc(self, **kwargs):
+        self.call('CreateVpc')
+        vpc = {'VpcId': 'vpc-{}'.format(len(self.vpcs)), 'State': 'available'}
+        self.vpcs.append(vpc)
+        return {'Vpc': vpc}
+
+    def describe_internet_gateways(self, Filters=None):
+        self.call('DescribeInternetGateways')
+        return {'InternetGateways': list(self.gateways)}
+
+    def create_internet_gateway(self, **kwargs):
+        self.call('CreateInternetGateway')
+        gateway = {'InternetGatewayId': 'igw-{}'.format(len(self.gateways))}
+        self.gateways.append(gateway)
+        return {'InternetGateway': gateway}
+
+    def attach_internet_gateway(self, **kwargs):
+        self.call('AttachInternetGateway')
+
+    def describe_availability_zones(self, Filters=None):
+        self.call('DescribeAvailabilityZones')
+        return {'AvailabilityZones': [{'ZoneId': 'use1-az1'}, {'ZoneId': 'use1-az2'}]}
+
+    def create_subnet(self, **kwargs):
+        self.call('CreateSubnet')
+        subnet = {'SubnetId': 'subnet-{}'.format(len(self.subnets))}
+        self.subnets.append(subnet)
+        return {'Subnet': subnet}
+
+    def describe_subnets(self, Filters=None):
+        self.call('DescribeSubnets')
+        return {'Subnets': list(self.subnets)}
+
+    def describe_security_groups(self, Filters=None):
+        self.call('DescribeSecurityGroups')
+        return {'SecurityGroups': list(self.security_groups)}
+
+    def create_security_group(self, **kwargs):
+        self.call('CreateSecurityGroup')
+        group = {'GroupId': 'sg-{}'.format(len(self.security_groups))}
+        self.security_groups.append(group)
+        return group
+
+
+class FakeSTS(FakeClient):
+
+    def get_caller_identity(self):
+        self.call('GetCallerIdentity')
+        return {'Account': ACCOUNT}
+
+
+class FakeSession:
+    # Stands in for boto3.Session: one shared fake per service
+
+    def __init__(self, latency=0., stop_after=2, region_name=REGION, check_model=False):
+        # check_model validates every call against the service model (slow;
+        # for tests rather than benchmarks)
+        self.region_name = region_name
+        self.profile_name = None
+        self.check_model = check_model
+        self.clients = {
+            's3': FakeS3(latency=latency),
+            'sts': FakeSTS(latency=latency),
+            'ecs': FakeECS(latency=latency, stop_after=stop_after),
+            'logs': FakeLogs(latency=latency),
+            'iam': FakeIAM(latency=latency),
+            'ec2': FakeEC2(latency=latency),
+        }
+
+    def client(self, service_name, **kwargs):
+        if self.check_model:
+            return ModelCheckedClient(self.clients[service_name], service_name)
+        return self.clients[service_name]
+
+    def calls(self):
+        return {
+            '{}.{}'.format(service, operation): count
+            for service, client in sorted(self.clients.items())
+            for operation, count in sorted(client.calls.items())
+        }
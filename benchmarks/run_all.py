@@ -0,0 +1,45 @@
+import argparse
+import json
+import os
+
+from benchmarks import bench_logs, bench_run_task, bench_status, bench_upload
+from benchmarks.common import quiet_stdout
+
+BENCHMARKS = {
+    'upload': bench_upload,
+    'logs': bench_logs,
+    'status': bench_status,
+    'run_task': bench_run_task,
+}
+# Small sizes for a quick check that everything runs
+QUICK_ARGS = {
+    'upload': ['--small-files', '500', '--large-files', '1', '--large-size-mb', '32', '--repeat', '1'],
+    'logs': ['--streams', '20', '--events', '500', '--repeat', '1'],
+    'status': ['--tasks', '500', '--repeat', '1'],
+    'run_task': ['--files', '20', '--repeat', '2'],
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run every benchmark; write one JSON file each')
+    parser.add_argument('--output-dir', default='bench-results')
+    parser.add_argument('--quick', action='store_true', help='Small sizes for a smoke run')
+    parser.add_argument('--latency-ms', type=float, default=0.)
+    parser.add_argument('only', nargs='*', help='Benchmarks to run (default: all)')
+    args = parser.parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name in args.only or list(BENCHMARKS):
+        output = os.path.join(args.output_dir, '{}.json'.format(name))
+        bench_args = ['--output', output, '--latency-ms', str(args.latency_ms)]
+        if args.quick:
+            bench_args += QUICK_ARGS[name]
+        print("Running {}".format(name))
+        with quiet_stdout():
+            BENCHMARKS[name].main(bench_args)
+        with open(output, encoding='utf-8') as f:
+            for result in json.load(f)['results']:
+                print("  {:<32} {:>10.4f}s".format(result['case'], result['seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+import os
+
+from aws_ecs_remote.executor import ECSExecutor
+
+from work import count_primes
+
+
+def main():
+    # Each task counts primes in 8 ranges; work.py is uploaded with this directory
+    starts = range(0, 10000000, 100000)
+    with ECSExecutor(cluster='cluster', src=os.path.dirname(os.path.abspath(__file__))) as executor:
+        counts = executor.map(count_primes, starts, [start + 100000 for start in starts], chunksize=8)
+        print("primes below 10M: {}".format(sum(counts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+import math
+
+
+def count_primes(start, stop):
+    return sum(
+        1 for n in range(max(start, 2), stop)
+        if all(n % d for d in range(2, int(math.sqrt(n)) + 1))
+    )
@@ -0,0 +1,26 @@
+import argparse
+
+from aws_ecs_remote.sweep import run_sweep
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ecs-run', action='store_true')
+    parser.add_argument('--lr', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.ecs_run:
+        run_sweep(
+            cluster='cluster',
+            args_list=(
+                {'lr': lr, 'seed': seed}
+                for lr in [0.1, 0.01, 0.001]
+                for seed in range(4)
+            )
+        )
+    else:
+        print("lr={} seed={}".format(args.lr, args.seed))
+
+
+if __name__ == '__main__':
+    main()
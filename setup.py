@@ -1,12 +1,33 @@
+import os
+import re
+
 from setuptools import find_packages, setup
 
+
+def read_version():
+    # Single source of truth in aws_ecs_remote/__init__.py; the remote bootstrap pins to it
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aws_ecs_remote', '__init__.py')
+    with open(path, encoding='utf-8') as f:
+        return re.search(r"^__version__ = '([^']+)'", f.read(), re.M).group(1)
+
+
+
 setup(name='aws-ecs-remote',
-      version='0.0.1',
+      version=read_version(),
       author='Ben Striner',
       url='https://github.com/bstriner/aws-ecs-remote',
       install_requires=[
           'boto3'
       ],
-      packages=find_packages())
+      extras_require={
+          'zstd': ['zstandard'],
+          'cloudpickle': ['cloudpickle']
+      },
+      entry_points={
+          'console_scripts': [
+              'aws-ecs-remote=aws_ecs_remote.cli:main'
+          ]
+      },
+      packages=find_packages(exclude=['benchmarks']))
 
 # python setup.py bdist_wheel sdist && twine upload dist\*
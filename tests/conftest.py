@@ -0,0 +1,15 @@
+import pytest
+
+from aws_ecs_remote.state import STATE_DIR_ENV
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    # Caches, indexes and checkpoints go to a fresh directory per test
+    path = tmp_path / 'state'
+    monkeypatch.setenv(STATE_DIR_ENV, str(path))
+    # Stubbed boto3 clients still sign requests
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    return path
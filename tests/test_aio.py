@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from aws_ecs_remote.aio import async_follow_tasks, async_wait_tasks
+from aws_ecs_remote.run_task import launch_task, prepare_run, task_log_streams
+from benchmarks.fakes import FakeSession
+
+
+def follow_run(tmp_path, stop_after, events):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'job.py').write_text('print("hello")\n')
+    session = FakeSession(stop_after=stop_after)
+    run = prepare_run(cluster='test', script=str(src / 'job.py'), session=session, quiet=True)
+    task = launch_task(run, output='output')
+    for log_stream in task_log_streams(run, [task]):
+        session.clients['logs'].add_stream(log_stream['group'], log_stream['stream'], events=events)
+    return run, task, session.clients['ecs']
+
+
+def other_tasks():
+    return asyncio.all_tasks() - {asyncio.current_task()}
+
+
+def test_follow_tasks_returns_stopped_tasks(tmp_path, capsys):
+    run, task, ecs = follow_run(tmp_path, stop_after=1, events=3)
+    events = []
+    stopped = asyncio.run(async_follow_tasks(run, [task], log_handler=events.append))
+    assert list(stopped) == [task['taskArn']]
+    assert stopped[task['taskArn']]['lastStatus'] == 'STOPPED'
+    assert [event['message'].split(' of ')[0] for event in events] == ['line 0', 'line 1', 'line 2']
+
+
+def test_wait_tasks(tmp_path, capsys):
+    run, task, ecs = follow_run(tmp_path, stop_after=1, events=0)
+    stopped = asyncio.run(async_wait_tasks(run['ecs'], run['cluster'], [task['taskArn']]))
+    assert list(stopped) == [task['taskArn']]
+    assert stopped[task['taskArn']]['lastStatus'] == 'STOPPED'
+    assert ecs.calls['DescribeTasks'] == 1
+
+
+def test_log_handler_error_stops_task_polling(tmp_path, capsys):
+    run, task, ecs = follow_run(tmp_path, stop_after=10 ** 6, events=1)
+
+    def log_handler(event):
+        raise RuntimeError('handler failed')
+
+    async def follow():
+        with pytest.raises(RuntimeError, match='handler failed'):
+            await async_follow_tasks(run, [task], log_handler=log_handler)
+        # The task waiter was cancelled and awaited, not left polling
+        return other_tasks()
+
+    assert asyncio.run(follow()) == set()
+
+
+def test_cancel_stops_task_polling(tmp_path, capsys):
+    run, task, ecs = follow_run(tmp_path, stop_after=10 ** 6, events=0)
+
+    async def follow():
+        following = asyncio.ensure_future(async_follow_tasks(run, [task]))
+        while not ecs.calls.get('DescribeTasks'):
+            await asyncio.sleep(0.01)
+        following.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await following
+        calls = ecs.calls['DescribeTasks']
+        await asyncio.sleep(0.1)
+        return other_tasks(), ecs.calls['DescribeTasks'] - calls
+
+    assert asyncio.run(follow()) == (set(), 0)
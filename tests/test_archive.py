@@ -0,0 +1,138 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from aws_ecs_remote import archive
+from aws_ecs_remote.archive import ArchiveFormat, write_archive
+
+
+def make_tree(root, files):
+    for name, data in files.items():
+        path = os.path.join(root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return sorted(files)
+
+
+def build(root, files, archive_format=ArchiveFormat.ZIP_DEFLATE, workers=1):
+    stream = io.BytesIO()
+    write_archive(stream, str(root), files, archive_format=archive_format, workers=workers, quiet=True)
+    return stream.getvalue()
+
+
+def read_zip(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        return dict((info.filename, z.read(info)) for info in z.infolist())
+
+
+FILES = {
+    'main.py': b'print("hello")\n',
+    'empty.txt': b'',
+    'pkg/__init__.py': b'',
+    'pkg/data.bin': bytes(range(256)) * 64,
+    'pkg/deep/notes.txt': b'lorem ipsum ' * 1000,
+    'unicode/café.txt': 'café'.encode('utf-8'),
+}
+
+
+@pytest.mark.parametrize('archive_format', [ArchiveFormat.ZIP_DEFLATE, ArchiveFormat.ZIP_STORED])
+def test_zip_round_trip(tmp_path, archive_format):
+    files = make_tree(tmp_path, FILES)
+    data = build(tmp_path, files, archive_format=archive_format)
+    assert read_zip(data) == FILES
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        method = zipfile.ZIP_DEFLATED if archive_format == ArchiveFormat.ZIP_DEFLATE else zipfile.ZIP_STORED
+        assert set(info.compress_type for info in z.infolist()) == {method}
+
+
+def test_zip_modes_and_timestamps_are_normalized(tmp_path):
+    files = make_tree(tmp_path, {'run.sh': b'#!/bin/sh\n', 'data.txt': b'x'})
+    os.chmod(os.path.join(tmp_path, 'run.sh'), 0o775)
+    os.chmod(os.path.join(tmp_path, 'data.txt'), 0o600)
+    with zipfile.ZipFile(io.BytesIO(build(tmp_path, files))) as z:
+        modes = dict((info.filename, (info.external_attr >> 16) & 0o777) for info in z.infolist())
+        dates = set(info.date_time for info in z.infolist())
+    assert modes == {'run.sh': 0o755, 'data.txt': 0o644}
+    assert dates == {(1980, 1, 1, 0, 0, 0)}
+
+
+@pytest.mark.parametrize('archive_format', [ArchiveFormat.ZIP_DEFLATE, ArchiveFormat.ZIP_STORED])
+def test_zip_data_descriptor(tmp_path, monkeypatch, archive_format):
+    # Files over POOL_FILE_LIMIT are streamed with a trailing data descriptor
+    monkeypatch.setattr(archive, 'POOL_FILE_LIMIT', 1024)
+    files = make_tree(tmp_path, FILES)
+    data = build(tmp_path, files, archive_format=archive_format)
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        flags = dict((info.filename, info.flag_bits) for info in z.infolist())
+    assert flags['pkg/data.bin'] & archive.ZIP_FLAG_DATA_DESCRIPTOR
+    assert not flags['main.py'] & archive.ZIP_FLAG_DATA_DESCRIPTOR
+    assert read_zip(data) == FILES
+
+
+@pytest.mark.parametrize('pool_file_limit', [32 * 1024 * 1024, 1024])
+def test_zip64(tmp_path, monkeypatch, pool_file_limit):
+    # A tiny ZIP64_LIMIT puts sizes, offsets and the central directory in
+    # zip64 records, for both in-memory and streamed entries
+    monkeypatch.setattr(archive, 'ZIP64_LIMIT', 100)
+    monkeypatch.setattr(archive, 'POOL_FILE_LIMIT', pool_file_limit)
+    files = make_tree(tmp_path, FILES)
+    data = build(tmp_path, files)
+    assert b'PK\x06\x06' in data and b'PK\x06\x07' in data
+    assert read_zip(data) == FILES
+
+
+def test_zip64_entry_count(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'ZIP_MAX_ENTRIES', 4)
+    files = make_tree(tmp_path, FILES)
+    assert read_zip(build(tmp_path, files)) == FILES
+
+
+def test_zip_process_pool_matches_serial(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'POOL_MIN_BYTES', 0)
+    monkeypatch.setattr(archive, 'POOL_FILE_LIMIT', 8 * 1024)
+    monkeypatch.setattr(archive, 'POOL_BATCH_FILES', 2)
+    files = make_tree(tmp_path, dict(FILES, **{
+        'pkg/many/{:03d}.txt'.format(i): ('file {}\n'.format(i) * (i + 1)).encode('utf-8') for i in range(40)
+    }))
+    serial = build(tmp_path, files, workers=1)
+    pooled = build(tmp_path, files, workers=2)
+    assert pooled == serial
+    assert read_zip(pooled) == dict((name, open(os.path.join(tmp_path, name), 'rb').read()) for name in files)
+
+
+def test_pool_context_does_not_fork():
+    assert archive.pool_context().get_start_method() in ('forkserver', 'spawn')
+
+
+def test_zip_is_deterministic(tmp_path):
+    first = tmp_path / 'first'
+    second = tmp_path / 'second'
+    files = make_tree(first, FILES)
+    make_tree(second, FILES)
+    os.utime(os.path.join(second, 'main.py'), (0, 0))
+    # Input order does not matter either
+    assert build(first, files) == build(second, list(reversed(files)))
+
+
+def test_tar_zstd_round_trip(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    files = make_tree(tmp_path, FILES)
+    data = build(tmp_path, files, archive_format=ArchiveFormat.TAR_ZSTD)
+    assert data == build(tmp_path, files, archive_format=ArchiveFormat.TAR_ZSTD, workers=4)
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            contents = {}
+            for member in tar:
+                assert member.mtime == 0 and member.uid == 0 and member.uname == ''
+                contents[member.name] = tar.extractfile(member).read()
+    assert contents == FILES
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        build(tmp_path, [], archive_format='rar')
@@ -0,0 +1,92 @@
+import boto3
+from botocore.stub import Stubber
+
+from aws_ecs_remote.checkpoint import LogCheckpoint
+from aws_ecs_remote.cloudwatch import LogStrategy, LogTailer
+
+LOG_STREAM = {'group': '/ecs/job', 'stream': 'ecs/job/abc', 'taskArn': 'arn:aws:ecs:us-east-1:123456789012:task/c/abc'}
+
+
+def get_log_events_response(events, token):
+    # OutputLogEvent: timestamp, message and ingestionTime only
+    return {
+        'events': [{'timestamp': t, 'message': m, 'ingestionTime': t + 1} for t, m in events],
+        'nextForwardToken': token,
+        'nextBackwardToken': 'b/0'
+    }
+
+
+def get_log_events_params(token=None):
+    params = {
+        'logGroupName': LOG_STREAM['group'],
+        'logStreamName': LOG_STREAM['stream'],
+        'limit': 10000,
+        'startFromHead': True
+    }
+    if token:
+        params['nextToken'] = token
+    return params
+
+
+def test_get_strategy_checkpoint_without_event_ids():
+    logs = boto3.client('logs')
+    checkpoint = LogCheckpoint()
+    checkpoint.register('cluster', [LOG_STREAM])
+    handled = []
+    with Stubber(logs) as stubber:
+        stubber.add_response('get_log_events', get_log_events_response([(10, 'a'), (12, 'b'), (12, 'c')], 'f/3'),
+                             get_log_events_params())
+        stubber.add_response('get_log_events', get_log_events_response([], 'f/3'), get_log_events_params('f/3'))
+        tailer = LogTailer(logs, [LOG_STREAM], strategy=LogStrategy.GET, log_handler=handled.append,
+                           checkpoint=checkpoint)
+        assert tailer.poll() == 3
+        stubber.assert_no_pending_responses()
+    assert [event['message'] for event in handled] == ['a', 'b', 'c']
+    assert handled[0]['logStreamName'] == LOG_STREAM['stream']
+    position = LogCheckpoint.load([LOG_STREAM['taskArn']]).position(LOG_STREAM)
+    assert position['token'] == 'f/3'
+    assert position['timestamp'] == 12
+    assert position['event_ids'] == []
+
+
+def test_get_strategy_resumes_from_saved_token():
+    logs = boto3.client('logs')
+    checkpoint = LogCheckpoint()
+    checkpoint.register('cluster', [LOG_STREAM])
+    checkpoint.update(LOG_STREAM, token='f/3', events=[{'timestamp': 12, 'message': 'c', 'ingestionTime': 13}])
+    checkpoint.save()
+    handled = []
+    with Stubber(logs) as stubber:
+        stubber.add_response('get_log_events', get_log_events_response([(20, 'd')], 'f/4'),
+                             get_log_events_params('f/3'))
+        stubber.add_response('get_log_events', get_log_events_response([], 'f/4'), get_log_events_params('f/4'))
+        tailer = LogTailer(logs, [LOG_STREAM], strategy=LogStrategy.GET, log_handler=handled.append,
+                           checkpoint=LogCheckpoint.load([LOG_STREAM['taskArn']]))
+        assert tailer.poll() == 1
+        stubber.assert_no_pending_responses()
+    assert [event['message'] for event in handled] == ['d']
+
+
+def test_filter_strategy_skips_checkpointed_events():
+    logs = boto3.client('logs')
+    checkpoint = LogCheckpoint()
+    checkpoint.register('cluster', [LOG_STREAM])
+    checkpoint.update(LOG_STREAM, events=[{'timestamp': 12, 'message': 'b', 'eventId': 'e2'}])
+    events = [
+        {'timestamp': 10, 'message': 'a', 'eventId': 'e1', 'logStreamName': LOG_STREAM['stream']},
+        {'timestamp': 12, 'message': 'b', 'eventId': 'e2', 'logStreamName': LOG_STREAM['stream']},
+        {'timestamp': 12, 'message': 'c', 'eventId': 'e3', 'logStreamName': LOG_STREAM['stream']},
+    ]
+    handled = []
+    with Stubber(logs) as stubber:
+        stubber.add_response('filter_log_events', {'events': events}, {
+            'logGroupName': LOG_STREAM['group'],
+            'logStreamNames': [LOG_STREAM['stream']],
+            'startTime': 12
+        })
+        tailer = LogTailer(logs, [LOG_STREAM], strategy=LogStrategy.FILTER, log_handler=handled.append,
+                           checkpoint=checkpoint)
+        assert tailer.poll() == 1
+    assert [event['message'] for event in handled] == ['c']
+    assert handled[0]['logGroupName'] == LOG_STREAM['group']
+    assert checkpoint.position(LOG_STREAM)['event_ids'] == ['e2', 'e3']
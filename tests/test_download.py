@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from aws_ecs_remote import download as download_module
+from aws_ecs_remote.download import DOWNLOAD_STATE, PART_STATE_SUFFIX, PART_SUFFIX, DownloadStatus, \
+    RangedDownload, download_prefix
+
+PREFIX = 'run/output/'
+RANGE_SIZE = 16
+
+
+class FakeS3:
+    # Objects in memory; get_object honours Range and IfMatch like S3
+
+    def __init__(self, objects):
+        self.objects = {}
+        self.ranges = []
+        self.fail_ranges = set()
+        for key, data in objects.items():
+            self.put(key, data)
+
+    def put(self, key, data):
+        self.objects[key] = (data, '"{}"'.format(hashlib.md5(data).hexdigest()))
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [
+            {'Key': key, 'Size': len(data), 'ETag': etag}
+            for key, (data, etag) in sorted(self.objects.items()) if key.startswith(Prefix)
+        ]}
+
+    def get_object(self, Bucket, Key, IfMatch=None, Range=None):
+        data, etag = self.objects[Key]
+        if IfMatch is not None and IfMatch != etag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': 'At least one of the '
+                                         'pre-conditions you specified did not hold'}}, 'GetObject')
+        if Range is not None:
+            start, end = (int(x) for x in Range[len('bytes='):].split('-'))
+            self.ranges.append(start)
+            if start in self.fail_ranges:
+                self.fail_ranges.discard(start)
+                raise ConnectionError('connection reset')
+            data = data[start:end + 1]
+        return {'Body': io.BytesIO(data)}
+
+
+def download(s3, dest):
+    return download_prefix(s3, 'bucket', PREFIX, str(dest), max_workers=4,
+                           range_threshold=RANGE_SIZE, range_size=RANGE_SIZE, quiet=True)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+BIG = bytes(range(256)) * 2
+SMALL = b'small'
+
+
+def test_download_and_skip_unchanged(tmp_path):
+    s3 = FakeS3({PREFIX + 'big.bin': BIG, PREFIX + 'sub/small.txt': SMALL})
+    assert download(s3, tmp_path) == {
+        PREFIX + 'big.bin': DownloadStatus.DOWNLOADED,
+        PREFIX + 'sub/small.txt': DownloadStatus.DOWNLOADED
+    }
+    assert read(tmp_path / 'big.bin') == BIG
+    assert read(tmp_path / 'sub' / 'small.txt') == SMALL
+    assert len(s3.ranges) == len(BIG) // RANGE_SIZE
+    assert set(download(s3, tmp_path).values()) == {DownloadStatus.SKIPPED}
+    assert os.path.exists(tmp_path / DOWNLOAD_STATE)
+
+
+def test_resume_partial_download(tmp_path):
+    s3 = FakeS3({PREFIX + 'big.bin': BIG})
+    s3.fail_ranges = {3 * RANGE_SIZE, 7 * RANGE_SIZE}
+    assert download(s3, tmp_path) == {PREFIX + 'big.bin': DownloadStatus.FAILED}
+    assert not os.path.exists(tmp_path / 'big.bin')
+    assert os.path.exists(str(tmp_path / 'big.bin') + PART_SUFFIX)
+    s3.ranges = []
+    assert download(s3, tmp_path) == {PREFIX + 'big.bin': DownloadStatus.DOWNLOADED}
+    # Only the ranges that failed are fetched again
+    assert sorted(s3.ranges) == [3 * RANGE_SIZE, 7 * RANGE_SIZE]
+    assert read(tmp_path / 'big.bin') == BIG
+    assert not os.path.exists(str(tmp_path / 'big.bin') + PART_STATE_SUFFIX)
+
+
+def test_resume_with_every_range_done(tmp_path, monkeypatch):
+    # The process stopped after the last range was recorded but before the rename
+    s3 = FakeS3({PREFIX + 'big.bin': BIG})
+    finish = RangedDownload.finish
+
+    def crash(self):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(RangedDownload, 'finish', crash)
+    with pytest.raises(KeyboardInterrupt):
+        download(s3, tmp_path)
+    monkeypatch.setattr(RangedDownload, 'finish', finish)
+    assert not os.path.exists(tmp_path / 'big.bin')
+    s3.ranges = []
+    assert download(s3, tmp_path) == {PREFIX + 'big.bin': DownloadStatus.DOWNLOADED}
+    assert s3.ranges == []
+    assert read(tmp_path / 'big.bin') == BIG
+    assert not os.path.exists(str(tmp_path / 'big.bin') + PART_SUFFIX)
+
+
+def test_changed_object_restarts_ranges(tmp_path):
+    s3 = FakeS3({PREFIX + 'big.bin': BIG})
+    s3.fail_ranges = {5 * RANGE_SIZE}
+    download(s3, tmp_path)
+    changed = bytes(reversed(BIG))
+    s3.put(PREFIX + 'big.bin', changed)
+    s3.ranges = []
+    assert download(s3, tmp_path) == {PREFIX + 'big.bin': DownloadStatus.DOWNLOADED}
+    # Ranges of the old version are not reused
+    assert len(s3.ranges) == len(BIG) // RANGE_SIZE
+    assert read(tmp_path / 'big.bin') == changed
+
+
+def test_object_replaced_during_download_fails(tmp_path, monkeypatch):
+    # IfMatch pins every range to the listed version; S3 answers 412 once it changes
+    s3 = FakeS3({PREFIX + 'big.bin': BIG})
+    list_objects = download_module.list_objects
+
+    def list_then_replace(**kwargs):
+        objects = list(list_objects(**kwargs))
+        s3.put(PREFIX + 'big.bin', b'x' * len(BIG))
+        return objects
+
+    monkeypatch.setattr(download_module, 'list_objects', list_then_replace)
+    assert download(s3, tmp_path) == {PREFIX + 'big.bin': DownloadStatus.FAILED}
+    assert not os.path.exists(tmp_path / 'big.bin')
+    monkeypatch.setattr(download_module, 'list_objects', list_objects)
+    assert download(s3, tmp_path) == {PREFIX + 'big.bin': DownloadStatus.DOWNLOADED}
+    assert read(tmp_path / 'big.bin') == b'x' * len(BIG)
+
+
+def test_keys_outside_dest_fail(tmp_path):
+    s3 = FakeS3({PREFIX + '../escape.txt': SMALL, PREFIX + 'ok.txt': SMALL})
+    dest = tmp_path / 'dest'
+    assert download(s3, dest) == {
+        PREFIX + '../escape.txt': DownloadStatus.FAILED,
+        PREFIX + 'ok.txt': DownloadStatus.DOWNLOADED
+    }
+    assert not os.path.exists(tmp_path / 'escape.txt')
@@ -0,0 +1,64 @@
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+from aws_ecs_remote.cluster import ON_DEMAND_STRATEGY
+from aws_ecs_remote.ecs import LaunchError, ecs_run_task
+
+CLUSTER = 'arn:aws:ecs:us-east-1:123456789012:cluster/test'
+TASK = {'taskArn': 'arn:aws:ecs:us-east-1:123456789012:task/test/abc', 'lastStatus': 'PROVISIONING'}
+SPOT_STRATEGY = [{'capacityProvider': 'FARGATE_SPOT', 'weight': 1}]
+
+
+def run_task(ecs, **kwargs):
+    return ecs_run_task(ecs=ecs, cluster=CLUSTER, task_definition='family:1', command=['echo hi'],
+                        subnets=['subnet-1'], security_groups=['sg-1'], **kwargs)
+
+
+def params(**kwargs):
+    return dict({
+        'cluster': CLUSTER,
+        'taskDefinition': 'family:1',
+        'count': 1,
+        'overrides': ANY,
+        'startedBy': ANY,
+        'group': ANY,
+        'platformVersion': ANY,
+        'networkConfiguration': ANY,
+    }, **kwargs)
+
+
+def test_ecs_run_task_returns_the_task():
+    ecs = boto3.client('ecs')
+    with Stubber(ecs) as stubber:
+        stubber.add_response('run_task', {'tasks': [TASK], 'failures': []}, params(launchType='FARGATE'))
+        assert run_task(ecs) == TASK
+
+
+def test_ecs_run_task_raises_launch_error_with_failures():
+    ecs = boto3.client('ecs')
+    failures = [{'arn': 'arn:aws:ecs:us-east-1:123456789012:container-instance/x', 'reason': 'RESOURCE:MEMORY'}]
+    with Stubber(ecs) as stubber:
+        stubber.add_response('run_task', {'tasks': [], 'failures': failures}, params(launchType='FARGATE'))
+        with pytest.raises(LaunchError) as raised:
+            run_task(ecs)
+    assert raised.value.failures == failures
+    assert 'RESOURCE:MEMORY' in str(raised.value)
+
+
+def test_ecs_run_task_falls_back_from_spot():
+    ecs = boto3.client('ecs')
+    capacity = [{'reason': 'Capacity is unavailable at this time. Please try again later or in a different '
+                           'availability zone'}]
+    with Stubber(ecs) as stubber:
+        stubber.add_response('run_task', {'tasks': [], 'failures': capacity},
+                             params(capacityProviderStrategy=SPOT_STRATEGY))
+        stubber.add_response('run_task', {'tasks': [TASK], 'failures': []},
+                             params(capacityProviderStrategy=ON_DEMAND_STRATEGY))
+        assert run_task(ecs, capacity_provider_strategy=SPOT_STRATEGY) == TASK
+        stubber.assert_no_pending_responses()
+    with Stubber(ecs) as stubber:
+        stubber.add_response('run_task', {'tasks': [], 'failures': capacity},
+                             params(capacityProviderStrategy=SPOT_STRATEGY))
+        with pytest.raises(LaunchError):
+            run_task(ecs, capacity_provider_strategy=SPOT_STRATEGY, spot_fallback=False)
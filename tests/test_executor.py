@@ -0,0 +1,187 @@
+import concurrent.futures
+import shlex
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from aws_ecs_remote.executor import BrokenECSExecutor, ECSExecutor, RemoteTaskError, RemoteTraceback, run_shard
+from benchmarks.fakes import FakeS3, FakeSession
+
+
+class ShardTasks:
+    # Stands in for the tasks' side: each launched shard runs in-process and
+    # uploads its result, straight away or, with hold, on release()
+
+    def __init__(self, session, hold=False):
+        self.s3 = session.clients['s3']
+        self.ecs = session.clients['ecs']
+        self.run_task = self.ecs.run_task
+        self.ecs.run_task = self.launch
+        self.hold = hold
+        self.lock = threading.Lock()
+        self.launched = []
+        self.held = []
+
+    def launch(self, **kwargs):
+        command = kwargs['overrides']['containerOverrides'][0]['command'][0]
+        argv = shlex.split(command.split(' && ')[-1])
+        shard = dict((name, argv[argv.index(name) + 1]) for name in ('--bucket', '--shard', '--result'))
+        response = self.run_task(**kwargs)
+        with self.lock:
+            self.launched.append(shard)
+            if self.hold:
+                self.held.append(shard)
+                return response
+        self.complete(shard)
+        return response
+
+    def complete(self, shard):
+        run_shard(self.s3, bucket=shard['--bucket'], shard=shard['--shard'], result=shard['--result'])
+
+    def release(self):
+        with self.lock:
+            held, self.held = self.held, []
+            self.hold = False
+        for shard in held:
+            self.complete(shard)
+
+
+def wait_for(condition, timeout=10):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def src(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    return str(src)
+
+
+def make_session(stop_after=1):
+    session = FakeSession(stop_after=stop_after)
+    session.clients['s3'] = FakeS3(keep_bodies=True)
+    return session
+
+
+def make_executor(src, session, **kwargs):
+    kwargs.setdefault('linger_sec', 0.01)
+    return ECSExecutor(cluster='test', src=src, session=session, poll_sec=0.01, **kwargs)
+
+
+def test_futures_resolve(src, capsys):
+    session = make_session()
+    tasks = ShardTasks(session)
+    with make_executor(src, session) as executor:
+        futures = [executor.submit(pow, 2, i) for i in range(5)]
+        failed = executor.submit(int, 'x')
+        assert list(executor.map(divmod, [7, 9, 11], [2, 4, 3], chunksize=2)) == [(3, 1), (2, 1), (3, 2)]
+        assert [future.result(timeout=10) for future in futures] == [1, 2, 4, 8, 16]
+        e = failed.exception(timeout=10)
+    assert isinstance(e, ValueError)
+    # The task's traceback comes along as the cause, like ProcessPoolExecutor
+    assert isinstance(e.__cause__, RemoteTraceback)
+    assert 'invalid literal' in str(e.__cause__)
+    # One shard for the submits, two for map
+    assert len(tasks.launched) == 3
+
+
+def test_task_without_result_fails_its_futures(src, capsys):
+    session = make_session(stop_after=1)
+    ShardTasks(session, hold=True)
+    with make_executor(src, session) as executor:
+        future = executor.submit(pow, 2, 3)
+        with pytest.raises(RemoteTaskError, match='stopped without a result'):
+            future.result(timeout=10)
+
+
+def test_launch_failure_fails_its_futures(src, capsys):
+    session = make_session()
+    session.clients['ecs'].run_task = lambda **kwargs: {'tasks': [], 'failures': [{'reason': 'ATTRIBUTE'}]}
+    with make_executor(src, session) as executor:
+        future = executor.submit(pow, 2, 3)
+        with pytest.raises(RemoteTaskError, match='failed to launch: ATTRIBUTE'):
+            future.result(timeout=10)
+
+
+def test_manager_error_breaks_executor(src, capsys):
+    session = make_session()
+    s3 = session.clients['s3']
+
+    def put_object(**kwargs):
+        raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'PutObject')
+
+    executor = make_executor(src, session)
+    # prepare_run uploads the source first; fail only the shard upload
+    executor.prepare()
+    s3.put_object = put_object
+    future = executor.submit(pow, 2, 3)
+    with pytest.raises(BrokenECSExecutor):
+        future.result(timeout=10)
+    assert isinstance(future.exception().__cause__, ClientError)
+    with pytest.raises(BrokenECSExecutor):
+        executor.submit(pow, 2, 3)
+    executor.shutdown()
+
+
+def test_shutdown_wait_launches_buffered_calls(src, capsys):
+    session = make_session()
+    tasks = ShardTasks(session)
+    executor = make_executor(src, session, linger_sec=60, chunksize=100)
+    futures = [executor.submit(pow, 3, i) for i in range(3)]
+    # Still lingering for more calls
+    assert tasks.launched == []
+    executor.shutdown(wait=True)
+    assert all(future.done() for future in futures)
+    assert [future.result() for future in futures] == [1, 3, 9]
+    assert not executor.manager.is_alive()
+    with pytest.raises(RuntimeError):
+        executor.submit(pow, 3, 3)
+
+
+def test_shutdown_without_wait(src, capsys):
+    session = make_session(stop_after=10 ** 6)
+    tasks = ShardTasks(session, hold=True)
+    executor = make_executor(src, session)
+    future = executor.submit(pow, 2, 10)
+    wait_for(lambda: tasks.launched)
+    executor.shutdown(wait=False)
+    assert not future.done()
+    assert executor.manager.is_alive()
+    # Futures already handed out still resolve
+    tasks.release()
+    assert future.result(timeout=10) == 1024
+    executor.manager.join(10)
+    assert not executor.manager.is_alive()
+
+
+def test_shutdown_cancels_pending_futures(src, capsys):
+    session = make_session(stop_after=10 ** 6)
+    tasks = ShardTasks(session, hold=True)
+    executor = make_executor(src, session, max_workers=1, chunksize=1)
+    futures = [executor.submit(pow, 2, i) for i in range(3)]
+    wait_for(lambda: tasks.launched)
+    executor.shutdown(wait=False, cancel_futures=True)
+    # The running shard keeps its future; the ones waiting for a slot are cancelled
+    assert [future.cancelled() for future in futures] == [False, True, True]
+    tasks.release()
+    executor.shutdown(wait=True)
+    assert futures[0].result() == 1
+    assert len(tasks.launched) == 1
+
+
+def test_map_timeout_cancels_unread_futures(src, capsys):
+    session = make_session(stop_after=10 ** 6)
+    tasks = ShardTasks(session, hold=True)
+    executor = make_executor(src, session, max_workers=1)
+    results = executor.map(pow, [2, 2, 2], [1, 2, 3], timeout=0.2, chunksize=1)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        next(results)
+    tasks.release()
+    executor.shutdown(wait=True)
+    # Only the shard that had already launched ran
+    assert len(tasks.launched) == 1
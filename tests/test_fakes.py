@@ -0,0 +1,49 @@
+import pytest
+from botocore.exceptions import ParamValidationError
+
+from aws_ecs_remote.cloudwatch import LogStrategy
+from aws_ecs_remote.run_task import follow_tasks, launch_task, prepare_run, run_task, task_log_streams
+from aws_ecs_remote.sinks import CallbackSink
+from benchmarks.fakes import FakeLogs, FakeSession, ModelCheckedClient
+
+
+@pytest.fixture
+def script(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'job.py').write_text('print("hello")\n')
+    return str(src / 'job.py')
+
+
+def test_model_check_rejects_drift():
+    logs = ModelCheckedClient(FakeLogs(), 'logs')
+    logs.client.streams[('group', 'stream')] = [{'timestamp': 1, 'message': 'x', 'ingestionTime': 1, 'eventId': '1'}]
+    with pytest.raises(ParamValidationError):
+        logs.get_log_events(logGroupName='group', logStreamName='stream')
+    with pytest.raises(ParamValidationError):
+        logs.get_log_events(logGroupName='group', logStreamName='stream', limit='10')
+
+
+def test_run_task_against_model_checked_fakes(script, capsys):
+    # Cold run provisions everything, warm run reads it back from the cache
+    session = FakeSession(stop_after=1, check_model=True)
+    for _ in range(2):
+        task = run_task(cluster='test', script=script, session=session, wait=True, quiet=True)
+        assert task['lastStatus'] == 'STOPPED'
+    calls = session.calls()
+    assert calls['ecs.RunTask'] == 2
+    assert calls['ecs.RegisterTaskDefinition'] == 1
+
+
+@pytest.mark.parametrize('log_strategy', [LogStrategy.GET, LogStrategy.FILTER])
+def test_follow_tasks_logs_against_model_checked_fakes(script, log_strategy, capsys):
+    session = FakeSession(stop_after=1, check_model=True)
+    run = prepare_run(cluster='test', script=script, session=session, quiet=True)
+    task = launch_task(run, output='output')
+    for log_stream in task_log_streams(run, [task]):
+        session.clients['logs'].add_stream(log_stream['group'], log_stream['stream'], events=3)
+    events = []
+    stopped = follow_tasks(run, [task], log_strategy=log_strategy, log_sinks=[CallbackSink(events.extend)])
+    assert list(stopped) == [task['taskArn']]
+    assert [event['message'].split(' of ')[0] for event in events] == ['line 0', 'line 1', 'line 2']
+    assert all('logStreamName' in event and 'logGroupName' in event for event in events)
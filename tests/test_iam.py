@@ -0,0 +1,60 @@
+import json
+
+from aws_ecs_remote.iam import EXECUTION_ROLE_NAME, EXECUTION_ROLE_POLICY, TASK_ROLE_NAME, bucket_policy, \
+    bucket_policy_name, ensure_execution_role, ensure_task_role
+from aws_ecs_remote.infra_cache import InfraCache
+from benchmarks.fakes import FakeIAM, ModelCheckedClient
+
+S3_FULL_ACCESS = 'arn:aws:iam::aws:policy/AmazonS3FullAccess'
+OTHER_POLICY = 'arn:aws:iam::123456789012:policy/team-policy'
+
+
+def checked(iam):
+    return ModelCheckedClient(iam, 'iam')
+
+
+def test_task_role_is_scoped_to_the_bucket():
+    iam = FakeIAM()
+    role = ensure_task_role(checked(iam), bucket='run-bucket')
+    assert role['RoleName'] == TASK_ROLE_NAME
+    assert iam.attached[TASK_ROLE_NAME] == []
+    document = json.loads(iam.inline[TASK_ROLE_NAME][bucket_policy_name('run-bucket')])
+    resources = set(statement['Resource'] for statement in document['Statement'])
+    assert resources == {'arn:aws:s3:::run-bucket', 'arn:aws:s3:::run-bucket/*'}
+    assert document == json.loads(bucket_policy('run-bucket'))
+
+
+def test_existing_role_is_reconciled():
+    # A role made by an earlier version still has broad managed policies
+    iam = FakeIAM()
+    iam.create_role(RoleName=TASK_ROLE_NAME)
+    for policy in (EXECUTION_ROLE_POLICY, S3_FULL_ACCESS, OTHER_POLICY):
+        iam.attach_role_policy(RoleName=TASK_ROLE_NAME, PolicyArn=policy)
+    ensure_task_role(checked(iam), bucket='run-bucket')
+    # Retired policies go; policies attached by someone else stay
+    assert iam.attached[TASK_ROLE_NAME] == [OTHER_POLICY]
+    assert list(iam.inline[TASK_ROLE_NAME]) == [bucket_policy_name('run-bucket')]
+
+
+def test_reconcile_is_cached_per_policy_set(tmp_path):
+    iam = FakeIAM()
+    cache = InfraCache(str(tmp_path / 'infra.json'))
+    ensure_task_role(checked(iam), bucket='bucket-a', cache=cache)
+    calls = dict(iam.calls)
+    ensure_task_role(checked(iam), bucket='bucket-a', cache=cache)
+    assert iam.calls == calls
+    # Another bucket is another policy set; the role gains its policy too
+    ensure_task_role(checked(iam), bucket='bucket-b', cache=cache)
+    assert iam.calls['PutRolePolicy'] == calls['PutRolePolicy'] + 1
+    assert sorted(iam.inline[TASK_ROLE_NAME]) == [bucket_policy_name('bucket-a'), bucket_policy_name('bucket-b')]
+    assert iam.calls.get('CreateRole') == 1
+
+
+def test_execution_role():
+    iam = FakeIAM()
+    role = ensure_execution_role(checked(iam))
+    assert role['RoleName'] == EXECUTION_ROLE_NAME
+    assert iam.attached[EXECUTION_ROLE_NAME] == [EXECUTION_ROLE_POLICY]
+    assert EXECUTION_ROLE_NAME not in iam.inline
+    ensure_execution_role(checked(iam))
+    assert iam.calls['AttachRolePolicy'] == 1
@@ -0,0 +1,117 @@
+import os
+import time
+
+import pytest
+
+from aws_ecs_remote.bucket import build_manifest, upload_content_addressed
+from aws_ecs_remote.index import FileIndex, hash_file
+from benchmarks.fakes import FakeS3
+
+# Comfortably outside the racy window
+OLD_NS = time.time_ns() - 3600 * 1000 * 1000 * 1000
+
+
+def write(path, data, mtime_ns=OLD_NS):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / 'src'
+    write(root / 'a.py', b'a = 1\n')
+    write(root / 'pkg' / 'b.py', b'b = 2\n')
+    return root
+
+
+def open_index(root):
+    return FileIndex(str(root), str(root.parent / 'index.json'))
+
+
+def test_unchanged_stat_reuses_the_digest(root):
+    index = open_index(root)
+    st, digest = index.stat_digest('a.py')
+    assert digest == hash_file(str(root / 'a.py'))
+    assert st.st_size == 6
+    assert index.hashed == 1
+    assert index.stat_digest('a.py')[1] == digest
+    assert index.hashed == 1
+    # And across runs, once saved
+    index.save()
+    index = open_index(root)
+    assert index.stat_digest('a.py')[1] == digest
+    assert index.hashed == 0
+    assert not index.dirty
+
+
+def test_changed_stat_rehashes(root):
+    index = open_index(root)
+    index.stat_digest('a.py')
+    # Same size, different content and mtime
+    write(root / 'a.py', b'a = 2\n', mtime_ns=OLD_NS + 1000)
+    st, digest = index.stat_digest('a.py')
+    assert digest == hash_file(str(root / 'a.py'))
+    assert index.hashed == 2
+
+
+def test_racy_mtime_forces_a_rehash(root):
+    # Written within the racy window: the same mtime tick could still hide a
+    # later write, so the digest is not kept
+    write(root / 'a.py', b'a = 3\n', mtime_ns=time.time_ns())
+    index = open_index(root)
+    _, digest = index.stat_digest('a.py')
+    assert 'a.py' not in index.entries
+    assert index.stat_digest('a.py')[1] == digest
+    assert index.hashed == 2
+    # A file rewritten inside the window loses the entry it had
+    index.stat_digest('pkg/b.py')
+    assert 'pkg/b.py' in index.entries
+    write(root / 'pkg' / 'b.py', b'b = 9\n', mtime_ns=time.time_ns())
+    assert index.stat_digest('pkg/b.py')[1] == hash_file(str(root / 'pkg' / 'b.py'))
+    assert 'pkg/b.py' not in index.entries
+
+
+def test_prune_drops_deleted_paths(root):
+    index = open_index(root)
+    for rel_path in ('a.py', 'pkg/b.py'):
+        index.stat_digest(rel_path)
+    index.save()
+    os.remove(root / 'pkg' / 'b.py')
+    index = open_index(root)
+    index.prune(['a.py'])
+    assert list(index.entries) == ['a.py']
+    assert index.dirty
+    index.save()
+    assert list(open_index(root).entries) == ['a.py']
+
+
+def test_index_is_ignored_for_another_root_or_algorithm(root, tmp_path):
+    index = open_index(root)
+    index.stat_digest('a.py')
+    index.save()
+    assert FileIndex(str(tmp_path), index.path).entries == {}
+    assert FileIndex(str(root), index.path, algorithm='md5').entries == {}
+    assert open_index(root).entries.keys() == {'a.py'}
+
+
+def test_build_manifest_rejects_an_index_with_another_algorithm(root):
+    index = FileIndex(str(root), str(root.parent / 'index.json'), algorithm='md5')
+    with pytest.raises(ValueError, match=r'Index uses \[md5\] but the manifest uses \[sha256\]'):
+        build_manifest(str(root), index=index)
+
+
+def test_build_manifest_with_index_matches_without(root):
+    files = ['a.py', 'pkg/b.py']
+    index = open_index(root)
+    assert build_manifest(str(root), files=files, index=index) == build_manifest(str(root), files=files)
+    assert index.hashed == 2
+
+
+def test_second_upload_hashes_nothing(root, capsys):
+    s3 = FakeS3()
+    key = upload_content_addressed(s3, str(root), 'bucket', quiet=True)
+    assert 'Hashed 2 of 2 files' in capsys.readouterr().out
+    assert upload_content_addressed(s3, str(root), 'bucket', quiet=True) == key
+    out = capsys.readouterr().out
+    assert 'Hashed 0 of 2 files' in out and 'Source unchanged' in out
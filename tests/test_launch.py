@@ -0,0 +1,129 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from aws_ecs_remote.ecs import LaunchError
+from aws_ecs_remote.iam import EXECUTION_ROLE_NAME, TASK_ROLE_NAME
+from aws_ecs_remote.package import build_wheel, package_bootstrap, wheel_key
+from aws_ecs_remote.run_task import launch_task, launch_tasks, prepare_run, run_bootstrap
+from benchmarks.fakes import FakeSession
+
+
+@pytest.fixture
+def run(tmp_path, capsys):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'job.py').write_text('print("hello")\n')
+    session = FakeSession(stop_after=1, check_model=True)
+    run = prepare_run(cluster='test', script=str(src / 'job.py'), session=session, quiet=True)
+    run['fake_session'] = session
+    return run
+
+
+def replace_run_task(run, run_task):
+    ecs = run['fake_session'].clients['ecs']
+    original = ecs.run_task
+    requests = []
+
+    def record(**kwargs):
+        requests.append(kwargs)
+        return run_task(original, **kwargs)
+
+    ecs.run_task = record
+    return requests
+
+
+def stale_error():
+    return ClientError({'Error': {'Code': 'ClusterNotFoundException', 'Message': 'Cluster not found.'}}, 'RunTask')
+
+
+def test_prepare_run_ships_the_package(run):
+    # Tasks install the wheel uploaded with this run, not a release from PyPI
+    key = wheel_key(build_wheel())
+    assert key in run['fake_session'].clients['s3'].objects
+    assert run['bootstrap'] == package_bootstrap(run['bucket'], key)
+    assert run_bootstrap(run) == run['bootstrap']
+    assert run_bootstrap(run, 'pip install other') == 'pip install other'
+    assert run_bootstrap(run, '') == ''
+    # The task pulls images and writes logs as the execution role, not the task role
+    definition, = run['fake_session'].clients['ecs'].definitions.values()
+    assert definition['executionRoleArn'].endswith(':role/' + EXECUTION_ROLE_NAME)
+    assert definition['taskRoleArn'].endswith(':role/' + TASK_ROLE_NAME)
+
+
+def test_launch_task_request(run):
+    requests = replace_run_task(run, lambda original, **kwargs: original(**kwargs))
+    task = launch_task(run, output='run/output/', args_key='run/args/00000.json.gz', args_index=2)
+    request, = requests
+    assert task['taskArn']
+    assert request['cluster'] == run['cluster']
+    assert request['taskDefinition'] == run['task_definition']['taskDefinitionArn']
+    assert request['launchType'] == 'FARGATE'
+    network = request['networkConfiguration']['awsvpcConfiguration']
+    assert network['subnets'] == run['subnets'] and network['securityGroups'] == run['security_groups']
+    command, = request['overrides']['containerOverrides'][0]['command']
+    assert command.startswith(run['bootstrap'] + ' && python -m aws_ecs_remote.remote ')
+    assert '--args run/args/00000.json.gz --args-index 2' in command
+
+
+def test_launch_task_refreshes_stale_infrastructure(run, capsys):
+    failed = []
+
+    def run_task(original, **kwargs):
+        if not failed:
+            failed.append(kwargs)
+            raise stale_error()
+        return original(**kwargs)
+
+    requests = replace_run_task(run, run_task)
+    calls = run['fake_session'].calls()
+    task = launch_task(run, output='run/output/')
+    assert task['taskArn'] and len(requests) == 2
+    # The cluster was described again before the retry
+    assert run['fake_session'].calls()['ecs.DescribeClusters'] == calls['ecs.DescribeClusters'] + 1
+
+
+def test_launch_task_does_not_retry_other_errors(run):
+    def run_task(original, **kwargs):
+        raise ClientError({'Error': {'Code': 'InvalidParameterException', 'Message': 'bad cpu'}}, 'RunTask')
+
+    requests = replace_run_task(run, run_task)
+    with pytest.raises(ClientError):
+        launch_task(run, output='run/output/')
+    assert len(requests) == 1
+
+
+def test_launch_tasks_retries_only_stale_launches(run, capsys):
+    def run_task(original, **kwargs):
+        command, = kwargs['overrides']['containerOverrides'][0]['command']
+        if '--args-index 1' in command and not stale:
+            stale.append(1)
+            raise stale_error()
+        return original(**kwargs)
+
+    stale = []
+    requests = replace_run_task(run, run_task)
+    launches = [('run/output/{:05d}/'.format(i), 'run/args/00000.json.gz', i) for i in range(3)]
+    results = sorted(launch_tasks(run, launches, max_attempts=1), key=lambda result: result[0])
+    assert [i for i, task, failure in results] == [0, 1, 2]
+    assert all(task is not None and failure is None for i, task, failure in results)
+    # Three first attempts and one relaunch of the stale one
+    assert len(requests) == 4
+
+
+def test_launch_tasks_yields_failures(run):
+    def run_task(original, **kwargs):
+        return {'tasks': [], 'failures': [{'reason': 'RESOURCE:MEMORY'}]}
+
+    replace_run_task(run, run_task)
+    results = list(launch_tasks(run, [('run/output/', None, 0)], max_attempts=1))
+    assert results == [(0, None, {'reason': 'RESOURCE:MEMORY'})]
+
+
+def test_launch_task_failure_raises_launch_error(run):
+    def run_task(original, **kwargs):
+        return {'tasks': [], 'failures': [{'reason': 'RESOURCE:MEMORY'}]}
+
+    replace_run_task(run, run_task)
+    with pytest.raises(LaunchError) as raised:
+        launch_task(run, output='run/output/')
+    assert raised.value.failures == [{'reason': 'RESOURCE:MEMORY'}]
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from aws_ecs_remote import multipart
+from aws_ecs_remote.multipart import MB, MIN_PART_SIZE, MultipartUploadWriter
+from benchmarks.fakes import FakeS3, ModelCheckedClient
+
+PART = MIN_PART_SIZE
+CONFIG = TransferConfig(multipart_chunksize=PART, max_concurrency=2)
+
+
+@pytest.fixture
+def s3():
+    return FakeS3(keep_bodies=True)
+
+
+def writer(s3, **kwargs):
+    return MultipartUploadWriter(ModelCheckedClient(s3, 's3'), 'bucket', 'key', config=CONFIG, **kwargs)
+
+
+@pytest.fixture
+def parts(s3):
+    # Records each uploaded part's body
+    recorded = {}
+    upload_part = s3.upload_part
+
+    def record(**kwargs):
+        recorded[kwargs['PartNumber']] = bytes(kwargs['Body'])
+        return upload_part(**kwargs)
+
+    s3.upload_part = record
+    return recorded
+
+
+@pytest.mark.parametrize('size', [0, 1, PART - 1])
+def test_small_object_is_one_put(s3, size):
+    data = os.urandom(size)
+    with writer(s3) as stream:
+        stream.write(data)
+        assert stream.tell() == size
+    assert s3.bodies['key'] == data
+    assert s3.calls == {'PutObject': 1}
+
+
+@pytest.mark.parametrize('sizes, expected', [
+    ([PART], [PART]),
+    ([PART + 1], [PART, 1]),
+    ([2 * PART], [PART, PART]),
+    ([PART - 1, 1], [PART]),
+    ([PART - 1, 2, PART - 1], [PART, PART]),
+    ([1] + [MB] * 10, [PART, PART, 1]),
+])
+def test_parts_split_at_the_chunk_size(s3, parts, sizes, expected):
+    chunks = [os.urandom(size) for size in sizes]
+    with writer(s3) as stream:
+        for chunk in chunks:
+            assert stream.write(chunk) == len(chunk)
+    # Exactly one part per full chunk size and no empty trailing part
+    assert [len(parts[number]) for number in sorted(parts)] == expected
+    assert s3.bodies['key'] == b''.join(chunks)
+    assert s3.calls['CreateMultipartUpload'] == 1
+    assert s3.calls['UploadPart'] == len(expected)
+    assert 'PutObject' not in s3.calls
+    assert s3.uploads == {}
+
+
+def test_part_size_grows(s3, monkeypatch):
+    monkeypatch.setattr(multipart, 'PART_GROWTH', 2)
+    stream = writer(s3)
+    sizes = []
+    for part_number in range(6):
+        stream.part_number = part_number
+        sizes.append(stream.current_part_size())
+    assert sizes == [PART, PART, 2 * PART, 2 * PART, 4 * PART, 4 * PART]
+
+
+def test_chunk_size_is_at_least_the_s3_minimum(s3):
+    stream = MultipartUploadWriter(s3, 'bucket', 'key', config=TransferConfig(multipart_chunksize=1024))
+    assert stream.part_size == MIN_PART_SIZE
+
+
+def test_extra_args(s3):
+    extra_args = {'ContentType': 'application/zip'}
+    put_object = s3.put_object
+    create = s3.create_multipart_upload
+    requests = []
+    s3.put_object = lambda **kwargs: requests.append(kwargs) or put_object(**kwargs)
+    s3.create_multipart_upload = lambda **kwargs: requests.append(kwargs) or create(**kwargs)
+    with writer(s3, extra_args=extra_args) as stream:
+        stream.write(b'small')
+    with writer(s3, extra_args=extra_args) as stream:
+        stream.write(os.urandom(PART))
+    assert [request['ContentType'] for request in requests] == ['application/zip'] * 2
+
+
+def test_error_in_body_aborts_the_upload(s3):
+    with pytest.raises(RuntimeError):
+        with writer(s3) as stream:
+            stream.write(os.urandom(PART + 1))
+            raise RuntimeError('archive failed')
+    assert s3.calls['AbortMultipartUpload'] == 1
+    assert 'CompleteMultipartUpload' not in s3.calls
+    assert s3.uploads == {} and s3.objects == {}
+    assert stream.closed
+    with pytest.raises(ValueError):
+        stream.write(b'more')
+
+
+def test_error_before_the_first_part_writes_nothing(s3):
+    with pytest.raises(RuntimeError):
+        with writer(s3) as stream:
+            stream.write(b'partial')
+            raise RuntimeError('archive failed')
+    assert s3.calls == {}
+    assert s3.objects == {}
+
+
+def test_failed_part_aborts_the_upload(s3):
+    upload_part = s3.upload_part
+
+    def fail_second(**kwargs):
+        if kwargs['PartNumber'] == 2:
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'reset'}}, 'UploadPart')
+        return upload_part(**kwargs)
+
+    s3.upload_part = fail_second
+    with pytest.raises(ClientError):
+        with writer(s3) as stream:
+            stream.write(os.urandom(2 * PART + 1))
+    assert s3.calls['AbortMultipartUpload'] == 1
+    assert 'CompleteMultipartUpload' not in s3.calls
+    assert s3.uploads == {} and s3.objects == {}
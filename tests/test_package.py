@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import io
+import shlex
+import zipfile
+
+from aws_ecs_remote import __version__
+from aws_ecs_remote.package import build_wheel, package_bootstrap, pinned_bootstrap, upload_package, wheel_key, \
+    wheel_name
+from benchmarks.fakes import FakeS3
+
+
+def test_wheel_contents():
+    data = build_wheel()
+    assert data == build_wheel()
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        names = z.namelist()
+        dist_info = 'aws_ecs_remote-{}.dist-info'.format(__version__)
+        assert 'aws_ecs_remote/remote.py' in names
+        assert not any('__pycache__' in name or name.endswith('.pyc') for name in names)
+        metadata = z.read(dist_info + '/METADATA').decode('utf-8')
+        assert 'Version: {}\n'.format(__version__) in metadata
+        assert 'Requires-Dist: zstandard; extra == "zstd"\n' in metadata
+        # Every entry but RECORD itself is listed with its hash and size
+        record = z.read(dist_info + '/RECORD').decode('utf-8').splitlines()
+        assert sorted(line.split(',')[0] for line in record) == sorted(names)
+        for line in record:
+            name, digest, size = line.split(',')
+            if name.endswith('/RECORD'):
+                continue
+            content = z.read(name)
+            expected = base64.urlsafe_b64encode(hashlib.sha256(content).digest()).rstrip(b'=').decode('ascii')
+            assert digest == 'sha256=' + expected and int(size) == len(content)
+
+
+def test_upload_package_is_content_addressed():
+    s3 = FakeS3()
+    key = upload_package(s3, 'bucket')
+    assert key == wheel_key(build_wheel())
+    assert key.endswith('/' + wheel_name())
+    assert upload_package(s3, 'bucket') == key
+    assert s3.calls['PutObject'] == 1
+
+
+def test_bootstrap_commands():
+    command = package_bootstrap('bucket', 'cas/packages/abc/' + wheel_name(), extras=('zstd', 'cloudpickle'))
+    steps = command.split(' && ')
+    assert shlex.split(steps[0]) == ['pip', 'install', '--quiet', '--no-cache-dir', 'boto3']
+    assert "download_file('bucket', 'cas/packages/abc/" in shlex.split(steps[1])[2]
+    assert shlex.split(steps[2])[-1] == '/tmp/{}[zstd,cloudpickle]'.format(wheel_name())
+    assert shlex.split(pinned_bootstrap(extras=()))[-1] == 'aws-ecs-remote=={}'.format(__version__)
@@ -0,0 +1,129 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from aws_ecs_remote.archive import ArchiveFormat, write_archive
+from aws_ecs_remote.remote import fetch_source, remote_command, safe_path
+
+zstandard = pytest.importorskip('zstandard')
+
+
+class FakeS3:
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def download_fileobj(self, Bucket, Key, Fileobj):
+        Fileobj.write(self.objects[Key])
+
+
+def tar_zst(members):
+    # members is a list of (TarInfo, data or None)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for info, data in members:
+            if data is not None:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            else:
+                tar.addfile(info)
+    return zstandard.ZstdCompressor().compress(buffer.getvalue())
+
+
+def symlink(name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    return info, None
+
+
+def hardlink(name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.LNKTYPE
+    info.linkname = target
+    return info, None
+
+
+def regular(name, data):
+    return tarfile.TarInfo(name), data
+
+
+def extract(tmp_path, data, key='src.tar.zst'):
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    fetch_source(FakeS3({key: data}), 'bucket', key, str(dest))
+    return dest
+
+
+@pytest.mark.parametrize('archive_format,key', [
+    (ArchiveFormat.ZIP_DEFLATE, 'src.zip'),
+    (ArchiveFormat.TAR_ZSTD, 'src.tar.zst'),
+])
+def test_fetch_source_round_trip(tmp_path, archive_format, key):
+    src = tmp_path / 'src'
+    (src / 'pkg').mkdir(parents=True)
+    (src / 'main.py').write_text('print(1)\n')
+    (src / 'pkg' / 'run.sh').write_text('#!/bin/sh\n')
+    os.chmod(str(src / 'pkg' / 'run.sh'), 0o755)
+    stream = io.BytesIO()
+    write_archive(stream, str(src), ['main.py', 'pkg/run.sh'], archive_format=archive_format, quiet=True)
+    dest = extract(tmp_path, stream.getvalue(), key=key)
+    assert (dest / 'main.py').read_text() == 'print(1)\n'
+    assert os.stat(str(dest / 'pkg' / 'run.sh')).st_mode & 0o777 == 0o755
+
+
+@pytest.mark.parametrize('members', [
+    # Written through a link to the parent directory
+    [symlink('up', '..'), regular('up/escaped.txt', b'x')],
+    # Absolute link target
+    [symlink('etc', '/tmp'), regular('etc/escaped.txt', b'x')],
+    # Each link looks harmless alone; through the first, 'a/..' is the parent
+    [symlink('a', '.'), symlink('b', 'a/..'), regular('b/escaped.txt', b'x')],
+    [symlink('deep/a', '..'), symlink('deep/b', 'a/..'), regular('deep/b/escaped.txt', b'x')],
+    # Hard link to a file outside
+    [hardlink('passwd', '../outside.txt')],
+    # Member name itself outside
+    [regular('../escaped.txt', b'x')],
+])
+def test_tar_links_cannot_escape(tmp_path, members):
+    (tmp_path / 'outside.txt').write_text('outside')
+    with pytest.raises(ValueError):
+        extract(tmp_path, tar_zst(members))
+    assert not (tmp_path / 'escaped.txt').exists()
+    assert sorted(os.listdir(str(tmp_path))) == ['dest', 'outside.txt']
+
+
+def test_tar_rejects_special_files(tmp_path):
+    info = tarfile.TarInfo('fifo')
+    info.type = tarfile.FIFOTYPE
+    with pytest.raises(ValueError):
+        extract(tmp_path, tar_zst([(info, None)]))
+
+
+def test_tar_links_inside_dest(tmp_path):
+    dest = extract(tmp_path, tar_zst([
+        regular('data/values.txt', b'1 2 3'),
+        symlink('current', 'data'),
+        symlink('data/self', 'values.txt'),
+    ]))
+    assert (dest / 'current' / 'values.txt').read_bytes() == b'1 2 3'
+    assert (dest / 'data' / 'self').read_bytes() == b'1 2 3'
+
+
+def test_safe_path(tmp_path):
+    assert safe_path(str(tmp_path), 'a/b.txt') == os.path.join(str(tmp_path), 'a', 'b.txt')
+    for name in ('../x', '/etc/passwd', 'a/../../x'):
+        with pytest.raises(ValueError):
+            safe_path(str(tmp_path), name)
+
+
+def test_remote_command_quotes_and_bootstraps():
+    command, = remote_command(bucket='b', src_key='run/src.zip', script='my job.py', output_prefix='run/output/',
+                              args_key='run/args.json', args_index=3, bootstrap='pip install x')
+    assert command.startswith('pip install x && python -m aws_ecs_remote.remote ')
+    assert "--script 'my job.py'" in command
+    assert '--args run/args.json --args-index 3' in command
+    command, = remote_command(bucket='b', src_key='k', script='s.py', output_prefix='o/', bootstrap='')
+    assert command.startswith('python -m aws_ecs_remote.remote ')
@@ -0,0 +1,187 @@
+import threading
+
+import pytest
+
+from aws_ecs_remote import scheduler as scheduler_module
+from aws_ecs_remote.scheduler import JobQueue, JobState, Scheduler, queue_path
+from benchmarks.fakes import FakeSession
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue.open('test')
+    yield queue
+    queue.close()
+
+
+def test_submit_take_finish(queue):
+    assert queue.submit([{'i': 0}, {'i': 1}]) == 2
+    assert queue.submit([{'i': 2}], priority=1) == 1
+    jobs = queue.take(2)
+    # Higher priority first, then submission order
+    assert [job['args'] for job in jobs] == [{'i': 2}, {'i': 0}]
+    assert queue.counts() == {JobState.QUEUED: 1, JobState.LAUNCHING: 2}
+    queue.started([(jobs[0]['id'], 'arn:task/a'), (jobs[1]['id'], 'arn:task/b')], vcpus=0.5)
+    assert sorted(job['task_arn'] for job in queue.running()) == ['arn:task/a', 'arn:task/b']
+    queue.finish_tasks([
+        ('arn:task/a', JobState.SUCCEEDED, 'Essential container in task exited', 0),
+        ('arn:task/b', JobState.FAILED, 'Essential container in task exited', 1),
+    ])
+    done = dict((job['task_arn'], job) for job in queue.jobs() if job['task_arn'])
+    assert done['arn:task/a']['state'] == JobState.SUCCEEDED and done['arn:task/a']['exit_code'] == 0
+    assert done['arn:task/b']['state'] == JobState.FAILED and done['arn:task/b']['exit_code'] == 1
+    assert all(job['attempts'] == 1 and job['vcpus'] == 0.5 for job in done.values())
+    # A result for a task that is no longer running changes nothing
+    queue.finish_tasks([('arn:task/a', JobState.FAILED, 'late', 2)])
+    assert done['arn:task/a'] == queue.jobs()[jobs[0]['id'] - 1]
+    assert queue.running() == []
+    assert [job['args'] for job in queue.take(10)] == [{'i': 1}]
+    assert queue.take(10) == []
+
+
+def test_requeue_delay(queue):
+    queue.submit([{}])
+    job, = queue.take(1)
+    queue.requeue(job['id'], reason='RESOURCE:MEMORY', delay=60)
+    assert queue.take(1) == []
+    assert 59 < queue.next_ready() <= 60
+    requeued, = queue.jobs()
+    assert requeued['state'] == JobState.QUEUED and requeued['attempts'] == 1
+    assert requeued['reason'] == 'RESOURCE:MEMORY'
+    queue.requeue(job['id'], reason='quota', attempt=False)
+    assert queue.next_ready() == 0.
+    assert queue.take(1)[0]['attempts'] == 1
+
+
+def test_lease_expiry_and_reclaim(queue, monkeypatch):
+    queue.submit([{'i': 0}, {'i': 1}])
+    claimed = queue.take(2)
+    other = JobQueue(queue_path('test'))
+    try:
+        # Claims inside their lease belong to the scheduler that took them
+        assert other.recover() == 0
+        assert other.take(2) == []
+        # Once the lease runs out (the claimer crashed), another scheduler
+        # requeues and claims them
+        now = scheduler_module.time.time()
+        monkeypatch.setattr(scheduler_module.time, 'time', lambda: now + scheduler_module.LAUNCH_LEASE_SEC + 1)
+        assert other.recover() == 2
+        reclaimed = other.take(2)
+    finally:
+        other.close()
+    assert [job['id'] for job in reclaimed] == [job['id'] for job in claimed]
+    assert all(job['attempts'] == 0 for job in reclaimed)
+
+
+def test_recover_leaves_running_jobs(queue):
+    queue.submit([{}, {}])
+    first, second = queue.take(2)
+    queue.started([(first['id'], 'arn:task/a')], vcpus=1)
+    assert queue.recover(lease_sec=0) == 1
+    assert queue.counts() == {JobState.RUNNING: 1, JobState.QUEUED: 1}
+    assert queue.take(2)[0]['id'] == second['id']
+
+
+def test_concurrent_claimers_never_share_a_job(queue):
+    count = 300
+    queue.submit([{'i': i} for i in range(count)])
+    queues = [JobQueue(queue_path('test')) for _ in range(4)]
+    claimed = [[] for _ in queues]
+    barrier = threading.Barrier(len(queues))
+
+    def claim(claimer, ids):
+        barrier.wait()
+        while True:
+            jobs = claimer.take(7)
+            if not jobs:
+                return
+            ids.extend(job['id'] for job in jobs)
+
+    threads = [threading.Thread(target=claim, args=args) for args in zip(queues, claimed)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for claimer in queues:
+        claimer.close()
+    ids = [job_id for ids in claimed for job_id in ids]
+    assert len(ids) == len(set(ids)) == count
+    assert queue.counts() == {JobState.LAUNCHING: count}
+
+
+def make_scheduler(tmp_path, session, **kwargs):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'job.py').write_text('print("hello")\n')
+    return Scheduler('sched', cluster='test', script=str(src / 'job.py'), session=session,
+                     max_vcpus=2, poll_sec=0, quiet=True, **kwargs)
+
+
+def test_scheduler_runs_queue_to_completion(tmp_path, capsys):
+    session = FakeSession(stop_after=1)
+    ecs = session.clients['ecs']
+    run_task = ecs.run_task
+    commands = []
+
+    def record(**kwargs):
+        commands.append(kwargs['overrides']['containerOverrides'][0]['command'][0])
+        return run_task(**kwargs)
+
+    ecs.run_task = record
+    scheduler = make_scheduler(tmp_path, session)
+    try:
+        scheduler.submit_many([{'i': i} for i in range(5)])
+        assert scheduler.run_queue() == {JobState.SUCCEEDED: 5}
+        jobs = scheduler.queue.jobs()
+    finally:
+        scheduler.close()
+    # Each job writes to the output prefix named after its id
+    outputs = sorted(command.split('--output ')[1].split()[0] for command in commands)
+    assert outputs == ['sched/output/{:05d}/'.format(job['id']) for job in jobs]
+    assert all(job['exit_code'] == 0 and job['attempts'] == 1 for job in jobs)
+
+
+def test_scheduler_retry_limit(tmp_path, monkeypatch, capsys):
+    session = FakeSession(stop_after=1)
+    ecs = session.clients['ecs']
+    requests = []
+
+    def run_task(**kwargs):
+        requests.append(kwargs)
+        return {'tasks': [], 'failures': [{'reason': 'ATTRIBUTE'}]}
+
+    ecs.run_task = run_task
+    monkeypatch.setattr(scheduler_module, 'backoff_delay', lambda attempt: 0)
+    scheduler = make_scheduler(tmp_path, session, max_attempts=3)
+    try:
+        scheduler.submit()
+        assert scheduler.run_queue() == {JobState.FAILED: 1}
+        job, = scheduler.queue.jobs()
+    finally:
+        scheduler.close()
+    assert len(requests) == 3
+    assert job['attempts'] == 2 and job['reason'] == 'ATTRIBUTE'
+    assert 'job {} failed to launch: ATTRIBUTE'.format(job['id']) in capsys.readouterr().out
+
+
+def test_quota_failures_do_not_use_attempts(tmp_path, capsys):
+    session = FakeSession(stop_after=1)
+    ecs = session.clients['ecs']
+    run_task = ecs.run_task
+    quota = {'reason': 'You\'ve reached the limit on the number of vCPUs you can run concurrently'}
+    ecs.run_task = lambda **kwargs: {'tasks': [], 'failures': [quota]}
+    scheduler = make_scheduler(tmp_path, session, max_attempts=1)
+    try:
+        scheduler.prepare()
+        scheduler.submit()
+        assert scheduler.dispatch() == 0
+        job, = scheduler.queue.jobs()
+        assert job['state'] == JobState.QUEUED and job['attempts'] == 0
+        # Paused until the backoff passes or a task stops
+        assert scheduler.dispatch() == 0
+        assert scheduler.queue.counts() == {JobState.QUEUED: 1}
+        ecs.run_task = run_task
+        scheduler.quota_until = 0
+        assert scheduler.run_queue() == {JobState.SUCCEEDED: 1}
+    finally:
+        scheduler.close()
@@ -0,0 +1,127 @@
+import shlex
+
+import pytest
+
+from aws_ecs_remote.sweep import iter_batches, run_sweep
+from aws_ecs_remote.task_args import args_key, args_to_argv, decode_args_batch, encode_args_batch
+from benchmarks.fakes import FakeSession
+
+
+@pytest.fixture
+def script(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'train.py').write_text('print("hello")\n')
+    return str(src / 'train.py')
+
+
+def recording_session():
+    # Keeps the argument batches and RunTask requests the fakes would discard
+    session = FakeSession(stop_after=1, check_model=True)
+    s3 = session.clients['s3']
+    ecs = session.clients['ecs']
+    session.bodies = {}
+    session.run_task_requests = []
+    put_object = s3.put_object
+    run_task = ecs.run_task
+
+    def record_put_object(Bucket, Key, Body, **kwargs):
+        session.bodies[Key] = Body
+        return put_object(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+
+    def record_run_task(**kwargs):
+        session.run_task_requests.append(kwargs)
+        return run_task(**kwargs)
+
+    s3.put_object = record_put_object
+    ecs.run_task = record_run_task
+    return session
+
+
+def command_options(request):
+    # {option: value} from the container command of a RunTask request
+    command, = request['overrides']['containerOverrides'][0]['command']
+    argv = shlex.split(command.split(' && ')[-1])
+    return dict(zip(argv[3::2], argv[4::2]))
+
+
+def test_iter_batches_consumes_lazily():
+    consumed = []
+
+    def generate():
+        for i in range(5):
+            consumed.append(i)
+            yield i
+
+    batches = iter_batches(generate(), 2)
+    assert next(batches) == [0, 1]
+    assert consumed == [0, 1]
+    assert list(batches) == [[2, 3], [4]]
+    assert list(iter_batches([], 2)) == []
+
+
+def test_args_batch_round_trip():
+    args_list = [{'lr': 0.1, 'layers': [1, 2]}, ['--flag', 'x'], None]
+    data = encode_args_batch(args_list)
+    assert data == encode_args_batch(args_list)
+    assert decode_args_batch(data) == args_list
+    assert args_key('sweep-1', 3) == 'sweep-1/args/00003.json.gz'
+
+
+@pytest.mark.parametrize('args,argv', [
+    (None, []),
+    (['--a', 1, 'b'], ['--a', '1', 'b']),
+    ({'lr': 0.5, 'verbose': True, 'quiet': False, 'skip': None}, ['--lr', '0.5', '--verbose']),
+    ({'tag': ['x', 'y']}, ['--tag', 'x', '--tag', 'y']),
+])
+def test_args_to_argv(args, argv):
+    assert args_to_argv(args) == argv
+
+
+def test_run_sweep_launches_one_task_per_args(script, capsys):
+    session = recording_session()
+    args_list = ({'lr': lr} for lr in (0.1, 0.2, 0.3, 0.4, 0.5))
+    tasks = run_sweep(cluster='test', args_list=args_list, script=script, session=session,
+                      batch_size=2, quiet=True)
+    assert len(tasks) == 5
+    arg_keys = sorted(key for key in session.bodies if '/args/' in key)
+    assert [decode_args_batch(session.bodies[key]) for key in arg_keys] == [
+        [{'lr': 0.1}, {'lr': 0.2}], [{'lr': 0.3}, {'lr': 0.4}], [{'lr': 0.5}]
+    ]
+    # One source upload shared by every task
+    options = [command_options(request) for request in session.run_task_requests]
+    assert len(set(option['--src'] for option in options)) == 1
+    name = arg_keys[0].split('/args/')[0]
+    launched = sorted(
+        (option['--output'], option['--args'], int(option['--args-index'])) for option in options
+    )
+    assert launched == [
+        ('{}/output/{:05d}/'.format(name, index), args_key(name, index // 2), index % 2)
+        for index in range(5)
+    ]
+    assert all(request['count'] == 1 for request in session.run_task_requests)
+
+
+def test_run_sweep_reports_launch_failures(script, capsys):
+    session = recording_session()
+    ecs = session.clients['ecs']
+    run_task = ecs.run_task
+
+    def fail_second(**kwargs):
+        if command_options(kwargs)['--args-index'] == '1':
+            ecs.call('RunTask')
+            return {'tasks': [], 'failures': [{'reason': 'RESOURCE:MEMORY'}]}
+        return run_task(**kwargs)
+
+    ecs.run_task = fail_second
+    tasks = run_sweep(cluster='test', args_list=[{'x': i} for i in range(3)], script=script,
+                      session=session, quiet=True, max_attempts=1)
+    assert len(tasks) == 2
+    assert '1 tasks failed to launch: [1]' in capsys.readouterr().out
+
+
+def test_run_sweep_waits_for_tasks(script, capsys):
+    session = recording_session()
+    tasks = run_sweep(cluster='test', args_list=[{'x': i} for i in range(3)], script=script,
+                      session=session, wait=True, quiet=True)
+    assert [task['lastStatus'] for task in tasks] == ['STOPPED'] * 3
@@ -0,0 +1,151 @@
+import os
+import re
+
+import pytest
+
+from aws_ecs_remote.walk import IgnoreRules, list_files, translate_pattern
+
+
+def matches(pattern, path):
+    return re.match(translate_pattern(pattern) + r'\Z', path) is not None
+
+
+def make_tree(root, names):
+    for name in names:
+        path = os.path.join(root, *name.split('/'))
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(name)
+
+
+@pytest.mark.parametrize('pattern,path,expected', [
+    # No slash: matches at any depth
+    ('*.log', 'debug.log', True),
+    ('*.log', 'a/b/debug.log', True),
+    ('build', 'src/build', True),
+    # A slash anchors the pattern to the ignore file's directory
+    ('/build', 'build', True),
+    ('/build', 'src/build', False),
+    ('docs/*.md', 'docs/index.md', True),
+    ('docs/*.md', 'src/docs/index.md', False),
+    # * and ? stay within one path segment
+    ('docs/*.md', 'docs/api/index.md', False),
+    ('file?.txt', 'file1.txt', True),
+    ('file?.txt', 'file/.txt', False),
+    # ** spans directories
+    ('**/cache', 'cache', True),
+    ('**/cache', 'a/b/cache', True),
+    ('logs/**', 'logs/a/b.txt', True),
+    ('logs/**', 'other/logs/a.txt', False),
+    ('a/**/b', 'a/b', True),
+    ('a/**/b', 'a/x/y/b', True),
+    # Character classes and escapes
+    ('*.py[cod]', 'mod.pyc', True),
+    ('*.py[cod]', 'mod.py', False),
+    ('[!a]bc', 'xbc', True),
+    ('[!a]bc', 'abc', False),
+    ('\\*literal', '*literal', True),
+    ('\\*literal', 'xliteral', False),
+    ('a+b(c).txt', 'a+b(c).txt', True),
+])
+def test_translate_pattern(pattern, path, expected):
+    assert matches(pattern, path) == expected
+
+
+def test_directory_only_rules():
+    rules = IgnoreRules(['build/'])
+    assert rules.match('build', is_dir=True) is True
+    assert rules.match('build', is_dir=False) is None
+    assert rules.match('src/build', is_dir=True) is True
+
+
+def test_negation_last_match_wins():
+    rules = IgnoreRules(['*.log', '!keep.log', 'keep.log.d/'])
+    assert rules.match('debug.log', is_dir=False) is True
+    assert rules.match('keep.log', is_dir=False) is False
+    assert rules.match('a/keep.log', is_dir=False) is False
+    assert rules.match('notes.txt', is_dir=False) is None
+    rules = IgnoreRules(['!keep.log', '*.log'])
+    assert rules.match('keep.log', is_dir=False) is True
+
+
+def test_comments_blank_lines_and_escapes():
+    rules = IgnoreRules(['# comment\n', '\n', '   \n', '\\#hash\n', '\\!bang\n', 'trailing   \n'])
+    assert rules.match('#hash', is_dir=False) is True
+    assert rules.match('!bang', is_dir=False) is True
+    assert rules.match('trailing', is_dir=False) is True
+    assert rules.match('comment', is_dir=False) is None
+
+
+def test_rules_apply_below_their_base():
+    rules = IgnoreRules(['/out', '*.tmp'], base='sub')
+    assert rules.match('sub/out', is_dir=True) is True
+    assert rules.match('sub/deep/out', is_dir=True) is None
+    assert rules.match('sub/deep/x.tmp', is_dir=False) is True
+    assert rules.match('out', is_dir=True) is None
+    assert rules.match('subway/x.tmp', is_dir=False) is None
+
+
+def test_list_files_applies_nested_ignore_files(tmp_path):
+    make_tree(tmp_path, [
+        'main.py',
+        'debug.log',
+        'build/out.bin',
+        'src/app.py',
+        'src/keep.log',
+        'src/build/gen.py',
+        'src/lib/build',
+        'docs/index.md',
+        'docs/draft/wip.md',
+    ])
+    (tmp_path / '.gitignore').write_text('*.log\nbuild/\n')
+    (tmp_path / 'src' / '.ecsremoteignore').write_text('!keep.log\n')
+    (tmp_path / 'docs' / '.gitignore').write_text('/draft\n')
+    assert list_files(str(tmp_path)) == [
+        'docs/index.md',
+        'main.py',
+        'src/app.py',
+        'src/keep.log',
+        # build/ only matches directories
+        'src/lib/build',
+    ]
+
+
+def test_list_files_prunes_hidden_and_default_ignores(tmp_path):
+    make_tree(tmp_path, [
+        'main.py',
+        'mod.pyc',
+        '.env',
+        '.hidden/secret.txt',
+        '.git/config',
+        'pkg/__pycache__/mod.cpython-39.pyc',
+        'pkg/mod.py',
+        'env/pyvenv.cfg',
+        'env/lib/site.py',
+    ])
+    assert list_files(str(tmp_path)) == ['main.py', 'pkg/mod.py']
+    assert list_files(str(tmp_path), include_hidden=True) == [
+        '.env',
+        '.hidden/secret.txt',
+        'main.py',
+        'pkg/mod.py',
+    ]
+    assert 'mod.pyc' in list_files(str(tmp_path), default_ignore=None)
+
+
+def test_ignored_directory_is_not_listed(tmp_path, monkeypatch):
+    make_tree(tmp_path, ['keep.py', 'node_modules/a/b.js'])
+    (tmp_path / '.gitignore').write_text('node_modules/\n')
+    scanned = []
+    scandir = os.scandir
+
+    def tracking_scandir(path):
+        scanned.append(os.path.relpath(path, str(tmp_path)))
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', tracking_scandir)
+    assert list_files(str(tmp_path)) == ['keep.py']
+    assert scanned == ['.']